@@ -19,6 +19,7 @@ from tpx3.scans.TimewalkCalib import TimewalkCalib
 from tpx3.scans.ScanHardware import ScanHardware
 from tpx3.scans.NoiseScan import NoiseScan
 from tpx3.scan_base import ConfigError
+import tpx3.analysis as analysis
 from UI.tpx3_logger import file_logger, mask_logger, equal_logger, TPX3_datalogger
 from UI.GUI.converter import utils as conv_utils
 from UI.GUI.converter.converter_manager import ConverterManager
@@ -52,6 +53,8 @@ functions = ['ToT', 'ToT_Calibration', 'tot_Calibration', 'tot',
                 'TP_Period', 'tp_period',
                 'Set_operation_mode', 'Set_Op_mode', 'Op_mode', 'set_operation_mode', 'set_Op_mode', 'op_mode',
                 'Set_Fast_Io', 'Fast_Io', 'set_fast_io', 'fast_io', 'Fast_Io_en', 'fast_io_en',
+                'Set_Online_Analysis', 'Online_Analysis', 'set_online_analysis', 'online_analysis',
+                'Set_Store_Hit_Data', 'Store_Hit_Data', 'set_store_hit_data', 'store_hit_data',
                 'Set_Readout_Intervall', 'set_readout_intervall', 'Readout_Intervall', 'readout_intervall',
                 'Set_Run_Name', 'Run_Name', 'set_run_name', 'run_name',
                 'Get_Run_Name', 'get_run_name',
@@ -61,7 +64,8 @@ functions = ['ToT', 'ToT_Calibration', 'tot_Calibration', 'tot',
                 'Chip_names', 'chip_names', 'Who', 'who',
                 'Mask_name', 'mask_name',
                 'Equalisation_name', 'equalisation_name', 'Equal_name', 'equal_name',
-                'Get_DAC_Values', 'get_dac_values', 'DAC_Values', 'dac_values'
+                'Get_DAC_Values', 'get_dac_values', 'DAC_Values', 'dac_values',
+                'Warmup', 'warmup',
                 'About', 'about',
                 'Help', 'help', 'h', '-h',
                 'End', 'end', 'Quit', 'quit', 'q', 'Q', 'Exit', 'exit']
@@ -78,8 +82,8 @@ expert_functions = ['Set_CLK_fast_mode', 'set_clk_fast_mode', 'CLK_fast_mode', '
 help_functions = ['ToT_Calibration', 'Timewalk_Calibration', 'Threshold_Scan', 'Threshold_Calibration', 'Pixel_DAC_Optimisation', 'Equalisation',
                     'Noise_Scan', 'Testpulse_Scan', 'Initialise_Hardware', 'Run_Datataking', 'Set_DAC', 'Load_Equalisation', 'Save_Equalisation',
                     'Uniform_Equalisation', 'Save_Backup', 'Load_Backup', 'Set_Default', 'GUI', 'Set_Polarity', 'Set_Mask', 'Unset_Mask', 'Load_Mask',
-                    'Save_Mask', 'TP_Period', 'Set_operation_mode', 'Set_Fast_Io', 'Set_Readout_Intervall', 'Set_Run_Name', 'Get_Run_Name',
-                    'Plot', 'Stop_Plot', 'Chip_names', 'Mask_name', 'Equalisation_name','Get_DAC_Values', 'About', 'Help', 'Quit']
+                    'Save_Mask', 'TP_Period', 'Set_operation_mode', 'Set_Fast_Io', 'Set_Online_Analysis', 'Set_Store_Hit_Data', 'Set_Readout_Intervall', 'Set_Run_Name', 'Get_Run_Name',
+                    'Plot', 'Stop_Plot', 'Chip_names', 'Mask_name', 'Equalisation_name','Get_DAC_Values', 'Warmup', 'About', 'Help', 'Quit']
 
 help_expert = ['Set_CLK_fast_mode', 'Set_Acknowledgement', 'Set_TP_ext_in', 'Set_ClkOut_frequency', 'Set_Sense_DAC', 'Enable_Link']
 
@@ -109,6 +113,12 @@ def expert_completer(text, state):
 # With this you can end a wrong started function with "Ctrl. c" without ending the whole CLI.
 class TPX3_multiprocess_start(object):
     def process_call(function, **kwargs):
+        # Analysis settings for the scans which support them
+        if function in {'ThresholdScan', 'TestpulseScan', 'ToTCalib', 'ThresholdCalib', 'PixelDACopt', 'EqualisationCharge'}:
+            kwargs.setdefault('online_analysis', TPX3_datalogger.read_value(name = 'Online_analysis') == 1)
+        if function in {'ThresholdScan', 'TestpulseScan', 'ThresholdCalib', 'EqualisationCharge', 'NoiseScan'}:
+            kwargs.setdefault('store_hit_data', TPX3_datalogger.read_value(name = 'Store_hit_data') == 1)
+
         if function != "ScanHardware":
             run_name = TPX3_datalogger.get_run_name(scan_type = function)
         else:
@@ -877,6 +887,42 @@ class TPX3_CLI_function_call(object):
         else:
             print('Unknown value')
 
+    def Set_Online_Analysis(object, Online_analysis = None):
+        if Online_analysis == None:
+            print('> Please enter the online analysis enable (0 for off or 1 for on):')
+            while(1):
+                Online_analysis = input('>> ')
+                try:
+                    Online_analysis = int(Online_analysis)
+                    break
+                except:
+                    if Online_analysis in exit_list:
+                        return
+                    else:
+                        print('Input needs to be a number!')
+        if Online_analysis == 1 or Online_analysis == 0:
+            TPX3_datalogger.write_value(name = 'Online_analysis', value = Online_analysis)
+        else:
+            print('Unknown value')
+
+    def Set_Store_Hit_Data(object, Store_hit_data = None):
+        if Store_hit_data == None:
+            print('> Please enter if the hit data of scans is stored (0 for off or 1 for on):')
+            while(1):
+                Store_hit_data = input('>> ')
+                try:
+                    Store_hit_data = int(Store_hit_data)
+                    break
+                except:
+                    if Store_hit_data in exit_list:
+                        return
+                    else:
+                        print('Input needs to be a number!')
+        if Store_hit_data == 1 or Store_hit_data == 0:
+            TPX3_datalogger.write_value(name = 'Store_hit_data', value = Store_hit_data)
+        else:
+            print('Unknown value')
+
     def Set_Run_Name(object, run_name = None):
         if run_name == None:
             print('> Please enter the file name addition for the run data file:')
@@ -1892,6 +1938,44 @@ class TPX3_CLI_TOP(object):
                         elif len(inputlist) > 2:
                             print('To many parameters! The given function takes only one parameter:\n Fast Io enable.')
 
+                #Set online analysis
+                elif inputlist[0] in {'Set_Online_Analysis', 'Online_Analysis', 'set_online_analysis', 'online_analysis'}:
+                    if len(inputlist) == 1:
+                        print('Set_Online_Analysis')
+                        try:
+                            function_call.Set_Online_Analysis()
+                        except KeyboardInterrupt:
+                            print('User quit')
+                    else:
+                        if inputlist[1] in {'Help', 'help', 'h', '-h'}:
+                            print('This is the online analysis enable function. With online analysis the scans histogram the data while it is taken. As argument you can give the enable as 0 (off) or 1 (on)')
+                        elif len(inputlist) == 2:
+                                try:
+                                    function_call.Set_Online_Analysis(Online_analysis = int(inputlist[1]))
+                                except KeyboardInterrupt:
+                                    print('User quit')
+                        elif len(inputlist) > 2:
+                            print('To many parameters! The given function takes only one parameter:\n Online analysis enable.')
+
+                #Set store hit data
+                elif inputlist[0] in {'Set_Store_Hit_Data', 'Store_Hit_Data', 'set_store_hit_data', 'store_hit_data'}:
+                    if len(inputlist) == 1:
+                        print('Set_Store_Hit_Data')
+                        try:
+                            function_call.Set_Store_Hit_Data()
+                        except KeyboardInterrupt:
+                            print('User quit')
+                    else:
+                        if inputlist[1] in {'Help', 'help', 'h', '-h'}:
+                            print('This is the store hit data function. Without stored hit data the scans only create the histograms. As argument you can give the enable as 0 (off) or 1 (on)')
+                        elif len(inputlist) == 2:
+                                try:
+                                    function_call.Set_Store_Hit_Data(Store_hit_data = int(inputlist[1]))
+                                except KeyboardInterrupt:
+                                    print('User quit')
+                        elif len(inputlist) > 2:
+                            print('To many parameters! The given function takes only one parameter:\n Store hit data enable.')
+
                 #Set Default
                 elif inputlist[0] in {'Set_Default', 'Default', 'set_default', 'default'}:
                     if len(inputlist) == 1:
@@ -2160,6 +2244,22 @@ class TPX3_CLI_TOP(object):
                         else :
                             print('Get DAC values does not take parameters!')
 
+                #Warmup
+                elif inputlist[0] in {'Warmup', 'warmup'}:
+                    if len(inputlist) == 1:
+                        print('Warmup')
+                        start = time.time()
+                        try:
+                            analysis.warmup_kernels()
+                            print('Compiled the analysis in %.1f s' % (time.time() - start))
+                        except KeyboardInterrupt:
+                            print('User quit')
+                    else:
+                        if inputlist[1] in {'Help', 'help', 'h', '-h'}:
+                            print('This is the warmup function. It compiles the analysis once and stores it on disk, so that the analysis of the following scans starts without compiling it.')
+                        else :
+                            print('Warmup does not take parameters!')
+
                 #About
                 elif inputlist[0] in {'About', 'about'}:
                     if len(inputlist) == 1:
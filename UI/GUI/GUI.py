@@ -1530,6 +1530,32 @@ class GUI_Additional_Settings(Gtk.Window):
         Readout_Speed_entry_label = Gtk.Label()
         Readout_Speed_entry_label.set_text('Readout Speed')
 
+        #Button for online analysis select
+        self.Online_analysis_value = TPX3_datalogger.read_value('Online_analysis')
+        self.Online_analysis_button = Gtk.ToggleButton()
+        if self.Online_analysis_value == 1:
+            self.Online_analysis_button.set_active(True)
+            self.Online_analysis_button.set_label('  ON  ')
+        else:
+            self.Online_analysis_button.set_active(False)
+            self.Online_analysis_button.set_label('  OFF  ')
+        self.Online_analysis_button.connect('toggled', self.Online_analysis_button_toggled)
+        Online_analysis_button_label = Gtk.Label()
+        Online_analysis_button_label.set_text('Online analysis')
+
+        #Button for store hit data select
+        self.Store_hit_data_value = TPX3_datalogger.read_value('Store_hit_data')
+        self.Store_hit_data_button = Gtk.ToggleButton()
+        if self.Store_hit_data_value == 1:
+            self.Store_hit_data_button.set_active(True)
+            self.Store_hit_data_button.set_label('  ON  ')
+        else:
+            self.Store_hit_data_button.set_active(False)
+            self.Store_hit_data_button.set_label('  OFF  ')
+        self.Store_hit_data_button.connect('toggled', self.Store_hit_data_button_toggled)
+        Store_hit_data_button_label = Gtk.Label()
+        Store_hit_data_button_label.set_text('Store hit data')
+
         #Expert check box
         self.expert_checkbox = Gtk.CheckButton(label='Expert')
         self.expert_checkbox.connect('toggled', self.on_expert_toggled)
@@ -1633,22 +1659,26 @@ class GUI_Additional_Settings(Gtk.Window):
         grid.attach(self.TP_Period, 2, 5, 2, 1)
         grid.attach(Readout_Speed_entry_label, 0, 6, 2, 1)
         grid.attach(self.Readout_Speed_entry, 2, 6, 3, 1)
-        grid.attach(Space, 0, 7, 3, 1)
-        grid.attach(self.TP_Ext_Int_button_label, 0, 8, 2, 1)
-        grid.attach(self.TP_Ext_Int_button, 2, 8, 2, 1)
-        grid.attach(self.AckCommand_en_button_label, 0, 9, 2, 1)
-        grid.attach(self.AckCommand_en_button, 2, 9, 2, 1)
-        grid.attach(self.ClkOut_frequency_combo_label, 0, 10, 2, 1)
-        grid.attach(self.ClkOut_frequency_combo, 2, 10, 3, 1)
-        grid.attach(self.dropdown_label, 0, 11, 2, 1)
-        grid.attach(self.dropdown, 2, 11, 3, 1)
-        grid.attach(self.Space2, 0, 12, 3, 1)
-        grid.attach(self.Link_label, 0, 13, 7, 1)
+        grid.attach(Online_analysis_button_label, 0, 7, 2, 1)
+        grid.attach(self.Online_analysis_button, 2, 7, 2, 1)
+        grid.attach(Store_hit_data_button_label, 0, 8, 2, 1)
+        grid.attach(self.Store_hit_data_button, 2, 8, 2, 1)
+        grid.attach(Space, 0, 9, 3, 1)
+        grid.attach(self.TP_Ext_Int_button_label, 0, 10, 2, 1)
+        grid.attach(self.TP_Ext_Int_button, 2, 10, 2, 1)
+        grid.attach(self.AckCommand_en_button_label, 0, 11, 2, 1)
+        grid.attach(self.AckCommand_en_button, 2, 11, 2, 1)
+        grid.attach(self.ClkOut_frequency_combo_label, 0, 12, 2, 1)
+        grid.attach(self.ClkOut_frequency_combo, 2, 12, 3, 1)
+        grid.attach(self.dropdown_label, 0, 13, 2, 1)
+        grid.attach(self.dropdown, 2, 13, 3, 1)
+        grid.attach(self.Space2, 0, 14, 3, 1)
+        grid.attach(self.Link_label, 0, 15, 7, 1)
         for link_number in range(self.hardware_links):
-            grid.attach(self.link_label[link_number], link_number % 8, 14 + (2 * (link_number // 8)), 1, 1)
-            grid.attach(self.link_enable_button[link_number], link_number % 8, 15 + (2 * (link_number // 8)), 1, 1)
-        grid.attach(self.Space3, 0, 16 + 2 * ((self.hardware_links - 1) // 8), 3, 1)
-        grid.attach(self.Savebutton, 8, 17 + 2 * ((self.hardware_links - 1) // 8), 1, 1)
+            grid.attach(self.link_label[link_number], link_number % 8, 16 + (2 * (link_number // 8)), 1, 1)
+            grid.attach(self.link_enable_button[link_number], link_number % 8, 17 + (2 * (link_number // 8)), 1, 1)
+        grid.attach(self.Space3, 0, 18 + 2 * ((self.hardware_links - 1) // 8), 3, 1)
+        grid.attach(self.Savebutton, 8, 19 + 2 * ((self.hardware_links - 1) // 8), 1, 1)
 
         self.show_all()
         self.TP_Ext_Int_button_label.hide()
@@ -1726,6 +1756,24 @@ class GUI_Additional_Settings(Gtk.Window):
             self.Fast_IO_button.set_label('  OFF ')
         self.Fast_IO_en_value = state
 
+    def Online_analysis_button_toggled(self, button):
+        if self.Online_analysis_button.get_active():
+            state = 1
+            self.Online_analysis_button.set_label('  ON  ')
+        else:
+            state = 0
+            self.Online_analysis_button.set_label('  OFF ')
+        self.Online_analysis_value = state
+
+    def Store_hit_data_button_toggled(self, button):
+        if self.Store_hit_data_button.get_active():
+            state = 1
+            self.Store_hit_data_button.set_label('  ON  ')
+        else:
+            state = 0
+            self.Store_hit_data_button.set_label('  OFF ')
+        self.Store_hit_data_value = state
+
     def TP_Ext_Int_button_toggled(self, button):
         if self.TP_Ext_Int_button.get_active():
             state = 1
@@ -1803,6 +1851,8 @@ class GUI_Additional_Settings(Gtk.Window):
         TPX3_datalogger.write_to_yaml(name = 'Sense_DAC')
         TPX3_datalogger.write_value(name = 'Readout_Speed', value = self.Readout_Speed_value)
         TPX3_datalogger.write_value(name = 'TP_Period', value = self.TP_Period_value)
+        TPX3_datalogger.write_value(name = 'Online_analysis', value = self.Online_analysis_value)
+        TPX3_datalogger.write_value(name = 'Store_hit_data', value = self.Store_hit_data_value)
         for link_number in range(self.hardware_links):
             TPX3_datalogger.change_link_status(link_number, self.link_enable[link_number])
 
@@ -368,7 +368,8 @@ class TPX3_data_logger(object):
                             'VTP_coarse', 'VTP_fine', 'Ibias_CP_PLL', 'PLL_Vcntrl',
                             'Equalisation_path', 'Mask_path', 'Run_name', 'Polarity', 'Op_mode', 'Fast_Io_en',
                             'clk_fast_out', 'ClkOut_frequency_src', 'AckCommand_en', 'SelectTP_Ext_Int',
-                            'clkphasediv', 'clkphasenum', 'PLLOutConfig', 'Readout_Speed', 'TP_Period', 'Sense_DAC']
+                            'clkphasediv', 'clkphasenum', 'PLLOutConfig', 'Readout_Speed', 'TP_Period', 'Sense_DAC',
+                            'Online_analysis', 'Store_hit_data']
         self.data = self.default_config()
 
     def default_config(self):
@@ -417,7 +418,9 @@ class TPX3_data_logger(object):
                 'PLLOutConfig' : 0,
                 'Readout_Speed': 0.1,
                 'TP_Period': 3,
-                'Sense_DAC': 29}
+                'Sense_DAC': 29,
+                'Online_analysis': 0,
+                'Store_hit_data': 1}
 
     def is_valid(self, config):
         if not isinstance(config, dict):
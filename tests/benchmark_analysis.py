@@ -0,0 +1,600 @@
+#!/usr/bin/env python
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Benchmarks for the offline analysis. Uses synthetic data, no hardware needed.
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+import numpy as np
+import numba
+import tables as tb
+from functools import partial
+from scipy.special import erf
+from basil.utils.BitLogic import BitLogic
+
+import tpx3.analysis as analysis
+import tpx3.lut as lut
+from test_Analysis import create_raw_data
+
+
+class NoProgress(object):
+    '''
+        Progress queue replacement which discards the progress, used instead of tqdm
+    '''
+    def put(self, fraction):
+        pass
+
+
+def legacy_link_data_to_dut(raw_data):
+    '''
+        Link demultiplexing with one filter per link as it was done before _raw_data_to_words
+    '''
+    data_combined = np.zeros(raw_data.shape[0], dtype=np.uint64)
+    for link in range(8):
+        link_filter = (raw_data & 0xfe000000) >> 25 == link
+        if np.sum(link_filter) == 0:
+            continue
+        link_combined, link_indices, _, _, _ = analysis.raw_data_to_dut_old(raw_data[link_filter], np.where(link_filter)[0])
+        np.put(data_combined, link_indices[0::2], link_combined)
+    return np.delete(data_combined, data_combined == 0)
+
+
+def benchmark_raw_data_to_dut(n_words):
+    raw_data = create_raw_data(n_words // 16)
+    no_timestamps = np.empty(0, dtype=np.uint64)
+    no_indices = np.empty(0, dtype=np.int64)
+
+    # Compile the kernel before timing
+    analysis._raw_data_to_words(raw_data[:100], no_timestamps, no_indices)
+
+    start = time.time()
+    legacy = legacy_link_data_to_dut(raw_data)
+    legacy_time = time.time() - start
+
+    start = time.time()
+    data_words = analysis._raw_data_to_words(raw_data, no_timestamps, no_indices)[0]
+    kernel_time = time.time() - start
+
+    if not np.array_equal(legacy, data_words):
+        raise RuntimeError('Results of the legacy and the single pass link demultiplexing differ')
+
+    print('raw_data_to_dut with %d words' % raw_data.shape[0])
+    print('    per link filters: %8.2f MWords/s' % (raw_data.shape[0] / legacy_time / 1e6))
+    print('    single pass:      %8.2f MWords/s' % (raw_data.shape[0] / kernel_time / 1e6))
+
+
+def create_meta_data(n_words, n_rows):
+    '''
+        Creates meta data which splits n_words raw data words into n_rows readouts
+    '''
+    meta_data = np.zeros(n_rows, dtype=[('index_start', 'u8'), ('index_stop', 'u8'), ('timestamp_start', 'f8'), ('scan_param_id', 'u4')])
+    index = np.linspace(0, n_words, n_rows + 1).astype(np.uint64)
+    meta_data['index_start'] = index[:-1]
+    meta_data['index_stop'] = index[1:]
+    meta_data['timestamp_start'] = np.arange(n_rows) * 0.005
+    return meta_data
+
+
+def measure(func, *args, **kwargs):
+    '''
+        Returns the result, the run time and the peak memory of func
+    '''
+    tracemalloc.start()
+    start = time.time()
+    result = func(*args, **kwargs)
+    run_time = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, run_time, peak
+
+
+def legacy_hstack(chunks):
+    '''
+        Result assembly with one np.hstack per chunk as it was done before _concatenate_chunks
+    '''
+    ret = []
+    for chunk in chunks:
+        if len(ret):
+            ret = np.hstack((ret, chunk))
+        else:
+            ret = chunk
+    return ret
+
+
+def benchmark_interpret_raw_data(words_per_row, legacy_rows):
+    print('interpret_raw_data with split_fine=True and %d words per meta data row' % words_per_row)
+    for n_rows in [1000, 10000, 100000]:
+        raw_data = create_raw_data(n_rows * words_per_row // 16, timestamp_every=words_per_row // 2)
+        meta_data = create_meta_data(raw_data.shape[0], n_rows)
+
+        hit_data, run_time, peak = measure(analysis.interpret_raw_data, raw_data, 0, False, meta_data, split_fine=True, progress=NoProgress())
+        print('    %6d rows: interpretation %7.2f s, peak memory %8.1f MB' % (n_rows, run_time, peak / 1e6))
+
+        # Compare only the result assembly of the same chunks
+        chunks = np.array_split(hit_data, n_rows)
+        if n_rows <= legacy_rows:
+            _, legacy_time, legacy_peak = measure(legacy_hstack, chunks)
+            print('                 assembly with hstack   %7.2f s, peak memory %8.1f MB' % (legacy_time, legacy_peak / 1e6))
+        else:
+            print('                 assembly with hstack   skipped, grows quadratically with the number of rows')
+        _, run_time, peak = measure(analysis._concatenate_chunks, chunks)
+        print('                 assembly concatenated  %7.2f s, peak memory %8.1f MB' % (run_time, peak / 1e6))
+
+
+def benchmark_parallel(n_words, words_per_row):
+    n_rows = n_words // words_per_row
+    raw_data = create_raw_data(n_words // 16, timestamp_every=words_per_row // 2, loss_rate=1e-5)
+    meta_data = create_meta_data(raw_data.shape[0], n_rows)
+    print('interpret_raw_data with split_fine=True, %d words and %d meta data rows' % (raw_data.shape[0], n_rows))
+
+    n_processes = 1
+    while n_processes <= mp.cpu_count():
+        start = time.time()
+        analysis.interpret_raw_data(raw_data, 0, False, meta_data, split_fine=True, progress=NoProgress(), n_processes=n_processes)
+        run_time = time.time() - start
+        if n_processes == 1:
+            serial_time = run_time
+        print('    %2d processes: %7.2f s, speedup %5.2f' % (n_processes, run_time, serial_time / run_time))
+        n_processes *= 2
+
+
+def legacy_lfsr_lut(bits):
+    '''
+        LFSR look up table generation with BitLogic as it was done at import time before tpx3.lut
+    '''
+    lut_array = np.zeros(2 ** bits, dtype=np.uint16)
+    lfsr = BitLogic(bits)
+    lfsr[bits - 1:0] = 2 ** bits - 1
+    for i in range(2 ** bits):
+        lut_array[BitLogic.tovalue(lfsr)] = i
+        feedback = 0
+        for tap in lut._lfsr_taps[bits]:
+            feedback ^= lfsr[tap]
+        for bit in range(bits - 1, 0, -1):
+            lfsr[bit] = lfsr[bit - 1]
+        lfsr[0] = feedback
+    lut_array[2 ** bits - 1] = 0
+    return lut_array
+
+
+def legacy_gray_lut(bits):
+    '''
+        Gray decoding look up table generation with BitLogic as it was done before tpx3.lut
+    '''
+    lut_array = np.zeros(2 ** bits, dtype=np.uint16)
+    for j in range(2 ** bits):
+        encoded_value = BitLogic(bits)
+        encoded_value[bits - 1:0] = j
+        gray_decrypt_v = BitLogic(bits)
+        gray_decrypt_v[bits - 1] = encoded_value[bits - 1]
+        for i in range(bits - 2, -1, -1):
+            gray_decrypt_v[i] = gray_decrypt_v[i + 1] ^ encoded_value[i]
+        lut_array[j] = gray_decrypt_v.tovalue()
+    return lut_array
+
+
+def worker_ready():
+    return True
+
+
+def benchmark_startup(n_runs):
+    start = time.time()
+    legacy = [legacy_lfsr_lut(4), legacy_lfsr_lut(10), legacy_lfsr_lut(14), legacy_gray_lut(14)]
+    legacy_time = time.time() - start
+
+    lut._luts.clear()
+    start = time.time()
+    shared = [lut.lfsr_4_lut(), lut.lfsr_10_lut(), lut.lfsr_14_lut(), lut.gray_14_lut()]
+    shared_time = time.time() - start
+
+    for legacy_lut, shared_lut in zip(legacy, shared):
+        if not np.array_equal(legacy_lut, shared_lut):
+            raise RuntimeError('Look up tables of BitLogic and tpx3.lut differ')
+
+    print('Look up table generation')
+    print('    BitLogic:  %8.1f ms' % (legacy_time * 1e3))
+    print('    tpx3.lut:  %8.1f ms' % (shared_time * 1e3))
+
+    # Import in a fresh interpreter, as done by the CLI
+    import_times = []
+    for _ in range(n_runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', 'import tpx3.analysis'])
+        import_times.append(time.time() - start)
+    print('Fresh interpreter with import tpx3.analysis: %7.2f s (best of %d)' % (min(import_times), n_runs))
+
+    # Spawned workers import the analysis again before they can run the first task
+    pool = mp.get_context('spawn').Pool(1)
+    start = time.time()
+    pool.apply(worker_ready)
+    print('First task on a spawned worker process:      %7.2f s' % (time.time() - start))
+    pool.close()
+    pool.join()
+
+
+# First analysis of a scan in a fresh process, as started by the CLI and the GUI
+first_analysis_script = '''
+import time
+start = time.time()
+import numpy as np
+import tpx3.analysis as analysis
+from six.moves.queue import Queue
+from test_Analysis import create_raw_data
+
+raw_data = create_raw_data(20000, timestamp_every=40)
+meta_data = np.zeros(20, dtype=[('index_start', 'u8'), ('index_stop', 'u8'), ('timestamp_start', 'f8'), ('scan_param_id', 'u4')])
+index = np.linspace(0, raw_data.shape[0], 21).astype(np.uint64)
+meta_data['index_start'] = index[:-1]
+meta_data['index_stop'] = index[1:]
+meta_data['scan_param_id'] = np.arange(20)
+hit_data = analysis.interpret_raw_data(raw_data, 2, False, meta_data, progress=Queue())
+hit_data = hit_data[hit_data['data_header'] == 1]
+scurves = analysis.scurve_hist(hit_data, np.arange(20))
+analysis.noise_pixel_count(hit_data, np.arange(20), 0)
+analysis.totcurve_hist(hit_data)
+analysis.raw_data_to_scurve_hist(raw_data, meta_data, 20, progress=Queue())
+analysis.fit_scurves_batch(np.minimum(scurves[:1000], 100).astype(np.uint16), np.arange(20), 100, 1., progress=Queue())
+print(time.time() - start)
+'''
+
+
+def first_analysis(env):
+    output = subprocess.check_output([sys.executable, '-c', first_analysis_script], env=env)
+    return float(output.split()[-1])
+
+
+def benchmark_warmup():
+    import os
+    import shutil
+    import tempfile
+    cache_dir = tempfile.mkdtemp()
+    env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+    try:
+        print('First analysis in a fresh process')
+        print('    without cached kernels:   %7.2f s' % first_analysis(env))
+        shutil.rmtree(cache_dir)
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', 'import tpx3.analysis as analysis; analysis.warmup_kernels()'], env=env)
+        print('    warmup_kernels:           %7.2f s' % (time.time() - start))
+        print('    after warmup_kernels:     %7.2f s' % first_analysis(env))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def interpret_scurve_hist(raw_data, meta_data, n_params):
+    '''
+        S-curve histogram via the hit data as it is done with store_hit_data
+    '''
+    hit_data = analysis.interpret_raw_data(raw_data, 2, False, meta_data, progress=NoProgress(), columns=['data_header', 'x', 'y', 'scan_param_id', 'EventCounter'])
+    hit_data = hit_data[hit_data['data_header'] == 1]
+    return analysis.scurve_hist(hit_data, np.arange(n_params))
+
+
+def benchmark_scurve_hist(n_words, n_params):
+    raw_data = create_raw_data(n_words // 16)
+    meta_data = create_meta_data(raw_data.shape[0], n_params)
+    meta_data['scan_param_id'] = np.arange(n_params)
+    print('S-curve histogram of %d words with %d scan parameters' % (raw_data.shape[0], n_params))
+
+    # Compile the kernels before timing
+    interpret_scurve_hist(raw_data[:1000], meta_data[:1], 1)
+    analysis.raw_data_to_scurve_hist(raw_data[:1000], meta_data[:1], 1, progress=NoProgress())
+
+    expected, run_time, peak = measure(interpret_scurve_hist, raw_data, meta_data, n_params)
+    print('    hit data + scurve_hist:  %7.2f s, peak memory %8.1f MB' % (run_time, peak / 1e6))
+    (scurves, _), run_time, peak = measure(analysis.raw_data_to_scurve_hist, raw_data, meta_data, n_params, progress=NoProgress())
+    print('    raw_data_to_scurve_hist: %7.2f s, peak memory %8.1f MB' % (run_time, peak / 1e6))
+
+    if not np.array_equal(expected, scurves):
+        raise RuntimeError('S-curve histograms of the hit data and the fused kernel differ')
+
+
+def benchmark_hist_scaling(n_words, n_params):
+    rng = np.random.RandomState(0)
+    n_hits = n_words // 2
+    hit_data = np.zeros(n_hits, dtype=[('x', 'u1'), ('y', 'u1'), ('scan_param_id', 'u4'), ('EventCounter', 'u2'), ('TOT', 'u2')])
+    hit_data['x'] = rng.randint(0, 256, n_hits)
+    hit_data['y'] = rng.randint(0, 256, n_hits)
+    hit_data['scan_param_id'] = rng.randint(0, n_params, n_hits)
+    hit_data['EventCounter'] = rng.randint(0, 1024, n_hits)
+    hit_data['TOT'] = rng.randint(0, 1024, n_hits)
+    print('scurve_hist and totcurve_hist of %d hits with %d scan parameters' % (n_hits, n_params))
+
+    # Compile the kernels before timing
+    analysis.scurve_hist(hit_data[:100000], np.arange(n_params))
+    analysis.totcurve_hist(hit_data[:100000])
+
+    max_threads = numba.get_num_threads()
+    threads = 1
+    while True:
+        numba.set_num_threads(threads)
+        _, scurve_time, scurve_peak = measure(analysis.scurve_hist, hit_data, np.arange(n_params))
+        _, tot_time, _ = measure(analysis.totcurve_hist, hit_data)
+        print('    %2d threads: scurve_hist %7.2f s (peak memory %8.1f MB), totcurve_hist %7.2f s' % (threads, scurve_time, scurve_peak / 1e6, tot_time))
+        if threads == max_threads:
+            break
+        threads = min(2 * threads, max_threads)
+    numba.set_num_threads(max_threads)
+
+
+def create_scurves(n_pixels, n_steps, n_injections):
+    '''
+        Creates binomial S-curves with random thresholds and noise
+    '''
+    rng = np.random.RandomState(0)
+    x = np.arange(n_steps)
+    mu = rng.uniform(0.2 * n_steps, 0.8 * n_steps, n_pixels)
+    sigma = rng.uniform(1, 0.05 * n_steps, n_pixels)
+    p = 0.5 * (1 + erf((x[np.newaxis, :] - mu[:, np.newaxis]) / (np.sqrt(2) * sigma[:, np.newaxis])))
+    return x, rng.binomial(n_injections, p).astype(np.uint16)
+
+
+def benchmark_scurve_fit(n_pixels, n_steps):
+    n_injections = 100
+    x, scurves = create_scurves(n_pixels, n_steps, n_injections)
+    sigma_0 = np.median([analysis.get_noise(x, curve, n_injections) for curve in scurves[:1000]])
+    print('S-curve fit of %d pixels with %d scan parameters' % (n_pixels, n_steps))
+
+    # Compile the kernels before timing
+    analysis.fit_scurves_batch(scurves[:10], x, n_injections, sigma_0, progress=NoProgress())
+
+    start = time.time()
+    single = analysis.get_fit_executor().map(partial(analysis.fit_scurve, scan_param_range=x, n_injections=n_injections, sigma_0=sigma_0, invert_x=False), scurves, progress=NoProgress())
+    single_time = time.time() - start
+    start = time.time()
+    batch = analysis.fit_scurves_batch(scurves, x, n_injections, sigma_0, progress=NoProgress())
+    batch_time = time.time() - start
+
+    single = np.array(single)
+    valid = (single[:, 0] != 0) & (batch[0] != 0)
+    print('    fit_scurve on %2d processes: %7.2f s' % (mp.cpu_count(), single_time))
+    print('    fit_scurves_batch:          %7.2f s' % batch_time)
+    print('    %d/%d fits valid in both, maximum threshold difference %.2e' % (np.sum(valid), n_pixels, np.max(np.abs(single[valid, 0] - batch[0][valid]), initial=0)))
+
+
+def benchmark_fit_executor(n_pixels, n_steps):
+    n_injections = 100
+    x, scurves = create_scurves(n_pixels, n_steps, n_injections)
+    fit = partial(analysis.fit_scurve, scan_param_range=x, n_injections=n_injections, sigma_0=3., invert_x=False)
+    print('fit_scurve of %d pixels with %d scan parameters on %d processes' % (n_pixels, n_steps, mp.cpu_count()))
+
+    # Baseline: a fresh pool per fit which gets every pixel as pickled list
+    start = time.time()
+    pool = mp.Pool()
+    single = pool.map(fit, scurves.tolist())
+    pool.close()
+    pool.join()
+    print('    Pool with pickled pixels:      %7.2f s' % (time.time() - start))
+
+    executor = analysis.FitExecutor()
+    for run in ['cold', 'warm']:
+        start = time.time()
+        blocks = executor.map(fit, scurves, progress=NoProgress())
+        print('    FitExecutor (%s pool):        %7.2f s' % (run, time.time() - start))
+    executor.close()
+
+    if single != blocks:
+        raise RuntimeError('Results of the Pool and FitExecutor differ')
+
+
+def create_totcurves(n_pixels, n_steps):
+    '''
+        Creates ToT curves with random parameters, rounded ToT values and no ToT below the threshold
+    '''
+    rng = np.random.RandomState(0)
+    x = np.arange(n_steps)
+    a = rng.uniform(0.15, 0.3, (n_pixels, 1))
+    b = rng.uniform(3, 8, (n_pixels, 1))
+    c = rng.uniform(20, 100, (n_pixels, 1))
+    t = rng.uniform(0.03 * n_steps, 0.1 * n_steps, (n_pixels, 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tot = a * x + b - c / (x - t)
+    return np.where((x > t) & (tot > 1), np.round(tot + rng.normal(0, 0.3, tot.shape)), 0).clip(0)
+
+
+def benchmark_tot_fit(n_pixels, n_steps):
+    totcurves = create_totcurves(n_pixels, n_steps)
+    t_est = np.average(np.where((totcurves > 0) & (totcurves <= 5))[1])
+    print('ToT-curve fit of %d pixels with %d scan parameters' % (n_pixels, n_steps))
+
+    # Compile the kernels before timing
+    analysis.fit_totcurves_batch(totcurves[:10], t_est, progress=NoProgress())
+
+    start = time.time()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        single = analysis.get_fit_executor().map(partial(analysis.fit_ToT, scan_param_range=None, t_est=t_est), totcurves, progress=NoProgress())
+    single_time = time.time() - start
+    start = time.time()
+    batch = np.array(analysis.fit_totcurves_batch(totcurves, t_est, progress=NoProgress())).T
+    batch_time = time.time() - start
+
+    single = np.array(single)
+    valid = (single[:, 4] != 0) & (batch[:, 4] != 0)
+    print('    fit_ToT on %2d processes:    %7.2f s' % (mp.cpu_count(), single_time))
+    print('    fit_totcurves_batch:        %7.2f s' % batch_time)
+    print('    %d/%d fits valid in both, median chi2/ndf ratio %.4f' % (np.sum(valid), n_pixels, np.median(batch[valid, 4] / single[valid, 4])))
+
+
+# Settings of the raw data and hit data compared by benchmark_storage
+storage_settings = [('blosc 5 (default raw data)', {'complib': 'blosc', 'complevel': 5}),
+                    ('zlib 5 (default hit data)', {'complib': 'zlib', 'complevel': 5}),
+                    ('blosc:lz4 1', {'complib': 'blosc:lz4', 'complevel': 1}),
+                    ('blosc:lz4 5 bitshuffle', {'complib': 'blosc:lz4', 'complevel': 5, 'bitshuffle': True}),
+                    ('blosc:zstd 5', {'complib': 'blosc:zstd', 'complevel': 5}),
+                    ('blosc:zstd 9 bitshuffle', {'complib': 'blosc:zstd', 'complevel': 9, 'bitshuffle': True}),
+                    ('uncompressed', {'complib': 'zlib', 'complevel': 0})]
+
+
+def load_raw_file(raw_file, n_words):
+    '''
+        Returns raw data, meta data and general configuration of a recorded run or, without raw_file, synthetic ones
+    '''
+    if raw_file is not None:
+        with tb.open_file(raw_file) as h5_file:
+            return h5_file.root.raw_data[:], h5_file.root.meta_data[:], h5_file.root.configuration.generalConfig[:]
+    raw_data = create_raw_data(n_words // 16, timestamp_every=32, loss_rate=1e-5)
+    meta_data = create_meta_data(raw_data.shape[0], max(raw_data.shape[0] // 10000, 1))
+    general_config = np.array([(b'Op_mode', 0), (b'Fast_Io_en', 0)], dtype=[('configuration', 'S64'), ('value', 'u2')])
+    return raw_data, meta_data, general_config
+
+
+def benchmark_storage(raw_file, n_words, chunkshape):
+    '''
+        Writes the raw data with the compression settings of storage_settings, reads it back and analyzes it
+        with iter_interpreted_hits, which stores the hit data with the same settings
+    '''
+    raw_data, meta_data, general_config = load_raw_file(raw_file, n_words)
+    if raw_file is None:
+        print('Synthetic raw data with random payloads, the compression ratios of a recorded run (--raw_file) are more meaningful')
+    print('Storage of %d raw data words (%.1f MB)' % (raw_data.shape[0], raw_data.nbytes / 1e6))
+    analysis.warmup_kernels()
+    for name, settings in storage_settings:
+        if chunkshape:
+            settings = dict(settings, chunkshape=(chunkshape,))
+        storage = {'raw_data': settings, 'hit_data': settings}
+        fd, filename = tempfile.mkstemp(suffix='.h5')
+        os.close(fd)
+
+        start = time.time()
+        with tb.open_file(filename, mode='w') as h5_file:
+            h5_file.create_group(h5_file.root, 'configuration')
+            h5_file.create_table(h5_file.root.configuration, 'generalConfig', general_config)
+            h5_file.create_table(h5_file.root, 'meta_data', meta_data, **analysis.storage_options('meta_data', storage))
+            raw_data_earray = h5_file.create_earray(h5_file.root, name='raw_data', atom=tb.UIntAtom(), shape=(0,), **analysis.storage_options('raw_data', storage))
+            # Appends of the size of a DataWriter batch
+            for index in range(0, raw_data.shape[0], 2**20):
+                raw_data_earray.append(raw_data[index:index + 2**20])
+            raw_data_earray.flush()
+            ratio = raw_data.nbytes / float(raw_data_earray.size_on_disk)
+        write_time = time.time() - start
+
+        with tb.open_file(filename, mode='a') as h5_file:
+            start = time.time()
+            h5_file.root.raw_data[:]
+            read_time = time.time() - start
+            h5_file.create_group(h5_file.root, 'interpreted')
+            start = time.time()
+            for hit_data in analysis.iter_interpreted_hits(h5_file, progress=NoProgress(), storage=storage):
+                pass
+            analyze_time = time.time() - start
+        os.remove(filename)
+        print('    %-26s write %7.1f MB/s, read %7.1f MB/s, analyze %6.1f MB/s, compression ratio %5.2f'
+              % (name, raw_data.nbytes / write_time / 1e6, raw_data.nbytes / read_time / 1e6, raw_data.nbytes / analyze_time / 1e6, ratio))
+
+
+def main(args_dict):
+    if args_dict['raw_data_to_dut']:
+        benchmark_raw_data_to_dut(args_dict['n_words'])
+    if args_dict['interpret_raw_data']:
+        benchmark_interpret_raw_data(args_dict['words_per_row'], args_dict['legacy_rows'])
+    if args_dict['parallel']:
+        benchmark_parallel(args_dict['n_words'], args_dict['words_per_row'])
+    if args_dict['scurve_hist']:
+        benchmark_scurve_hist(args_dict['n_words'], args_dict['n_params'])
+    if args_dict['hist_scaling']:
+        benchmark_hist_scaling(args_dict['n_words'], args_dict['n_params'])
+    if args_dict['startup']:
+        benchmark_startup(args_dict['n_runs'])
+    if args_dict['warmup']:
+        benchmark_warmup()
+    if args_dict['scurve_fit']:
+        benchmark_scurve_fit(args_dict['n_pixels'], args_dict['n_steps'])
+    if args_dict['fit_executor']:
+        benchmark_fit_executor(args_dict['n_pixels'], args_dict['n_steps'])
+    if args_dict['tot_fit']:
+        benchmark_tot_fit(args_dict['n_pixels'], args_dict['n_steps'])
+    if args_dict['storage']:
+        benchmark_storage(args_dict['raw_file'], args_dict['n_words'], args_dict['chunkshape'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Timepix3 analysis benchmark script')
+    parser.add_argument('--n_words',
+                        type=int,
+                        default=10000000,
+                        help='Number of 32 bit words in the synthetic raw data')
+    parser.add_argument('--raw_data_to_dut',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark the link demultiplexing')
+    parser.add_argument('--words_per_row',
+                        type=int,
+                        default=64,
+                        help='Number of 32 bit words per meta data row')
+    parser.add_argument('--legacy_rows',
+                        type=int,
+                        default=1000,
+                        help='Maximum number of meta data rows for which the hstack assembly is measured')
+    parser.add_argument('--interpret_raw_data',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark the result assembly of interpret_raw_data')
+    parser.add_argument('--parallel',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark interpret_raw_data on a process pool')
+    parser.add_argument('--scurve_hist',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark the fused S-curve histogramming')
+    parser.add_argument('--n_params',
+                        type=int,
+                        default=1000,
+                        help='Number of scan parameters of the S-curve histogram')
+    parser.add_argument('--hist_scaling',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark scurve_hist and totcurve_hist across the numbers of threads')
+    parser.add_argument('--startup',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark the look up table generation and the import time')
+    parser.add_argument('--warmup',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark the first analysis in a fresh process with and without the kernel cache')
+    parser.add_argument('--n_runs',
+                        type=int,
+                        default=3,
+                        help='Number of fresh interpreters started for the import time')
+    parser.add_argument('--scurve_fit',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark the S-curve fit of single pixels against the batch fit')
+    parser.add_argument('--fit_executor',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark the per pixel fits on a fresh pool against the FitExecutor')
+    parser.add_argument('--tot_fit',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark the ToT-curve fit of single pixels against the batch fit')
+    parser.add_argument('--n_pixels',
+                        type=int,
+                        default=65536,
+                        help='Number of pixels of the S-curve and ToT-curve fits')
+    parser.add_argument('--n_steps',
+                        type=int,
+                        default=200,
+                        help='Number of scan parameters of the S-curve and ToT-curve fits')
+    parser.add_argument('--storage',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark the write, read and analysis speed and the compression ratio of the storage settings')
+    parser.add_argument('--raw_file',
+                        default=None,
+                        help='HDF5 file of a recorded run which is replayed by --storage, by default synthetic raw data is used')
+    parser.add_argument('--chunkshape',
+                        type=int,
+                        default=0,
+                        help='Chunkshape of the raw data and hit data for --storage, by default the one chosen by PyTables')
+    args_dict = vars(parser.parse_args())
+    logging.getLogger('Analysis').setLevel(logging.CRITICAL)
+    main(args_dict)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Benchmarks for the FIFO readout. Uses a mock FIFO, no hardware needed.
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+import argparse
+import logging
+import os
+import tempfile
+import time
+import numpy as np
+import tables as tb
+from time import time as now
+
+from tpx3.fifo_readout import FifoReadout
+from tpx3.data_writer import DataWriter
+from test_FifoReadout import MockFifo, MockChip, meta_data_dtype
+
+
+class LegacyFifoReadout(FifoReadout):
+    '''
+        Readout which collects the words of a readout in a list as it was done before the RingBuffer
+    '''
+    def _read_interval(self, time_read):
+        dlist = []
+        while now() - time_read < self.readout_interval:
+            dlist.extend(self.read_data())
+        data = np.asarray(dlist, dtype=np.uint32)
+        self._ring_buffer.commit()  # empty readout, keeps the releases of the worker balanced
+        return data
+
+
+def run_readout(readout_class, block_size, duration, readout_interval, ring_buffer_size):
+    '''
+        Runs the readout for duration seconds and returns the number of words the callback received
+        and the latencies between the end of the readouts and the callbacks
+    '''
+    fifo = MockFifo(block_size=block_size)
+    fifo_readout = readout_class(MockChip(fifo), readout_interval=readout_interval, moving_average_time_period=10 * readout_interval, ring_buffer_size=ring_buffer_size)
+    n_words = [0]
+    latencies = []
+
+    def callback(data_tuple):
+        latencies.append(fifo_readout.get_float_time() - data_tuple[2])
+        n_words[0] += data_tuple[0].shape[0]
+
+    fifo_readout.start(callback=callback)
+    start = time.time()
+    time.sleep(duration)
+    fifo.n_blocks = fifo.n_words // block_size  # the FIFO is empty from now on
+    fifo_readout.stop()
+    return n_words[0], time.time() - start, fifo_readout._ring_buffer_overflows, np.array(latencies)
+
+
+def benchmark_readout(block_size, duration, readout_interval, ring_buffer_size):
+    print('FIFO readout with blocks of %d words, readout interval %.3f s' % (block_size, readout_interval))
+    for name, readout_class in (('List readout', LegacyFifoReadout), ('Ring buffer readout', FifoReadout)):
+        n_words, run_time, overflows, latencies = run_readout(readout_class, block_size, duration, readout_interval, ring_buffer_size)
+        print('    %-20s %8.1f MWords/s (%d ring buffer overflows), latency to the callback %.2f ms (max. %.2f ms)'
+              % (name, n_words / run_time / 1e6, overflows, 1e3 * np.mean(latencies), 1e3 * np.max(latencies)))
+
+
+def benchmark_idle(duration, readout_interval, max_readout_interval):
+    '''
+        CPU time and FIFO reads of the readout while the FIFO is empty, with a fixed and an adaptive interval
+    '''
+    print('FIFO readout of an empty FIFO for %.1f s, readout interval %.3f s' % (duration, readout_interval))
+    for adaptive in (False, True):
+        fifo = MockFifo(n_blocks=0)
+        chip = MockChip(fifo)
+        fifo_readout = FifoReadout(chip, readout_interval=readout_interval, moving_average_time_period=10 * readout_interval,
+                                   adaptive=adaptive, max_readout_interval=max_readout_interval, error_read_interval=10 * readout_interval if adaptive else 0.)
+        start = time.process_time()
+        fifo_readout.start(callback=lambda data_tuple: None)
+        time.sleep(duration)
+        fifo_readout.stop()
+        cpu_time = time.process_time() - start
+        print('    %-20s CPU %5.1f %%, %8d FIFO reads, %6d error counter reads'
+              % ('Adaptive interval' if adaptive else 'Fixed interval', 1e2 * cpu_time / duration, fifo.n_reads, chip.rx[0].n_error_reads))
+
+
+def legacy_write(raw_data_earray, meta_data_table, data_tuple, scan_param_id):
+    '''
+        Append and flush per readout as it was done in ScanBase.handle_data before the DataWriter
+    '''
+    total_words = raw_data_earray.nrows
+    raw_data_earray.append(data_tuple[0])
+    raw_data_earray.flush()
+    len_raw_data = data_tuple[0].shape[0]
+    meta_data_table.row['timestamp_start'] = data_tuple[1]
+    meta_data_table.row['timestamp_stop'] = data_tuple[2]
+    meta_data_table.row['discard_error'] = data_tuple[3]
+    meta_data_table.row['decode_error'] = data_tuple[4]
+    meta_data_table.row['data_length'] = len_raw_data
+    meta_data_table.row['index_start'] = total_words
+    meta_data_table.row['index_stop'] = total_words + len_raw_data
+    meta_data_table.row['scan_param_id'] = scan_param_id
+    meta_data_table.row.append()
+    meta_data_table.flush()
+
+
+def benchmark_writer(words_per_readout, n_readouts):
+    '''
+        Write throughput of the readouts to the HDF5 file, with a flush per readout and with the DataWriter
+    '''
+    rng = np.random.default_rng(0)
+    raw_data = rng.integers(0, 2**16, size=words_per_readout, dtype=np.uint32)  # compressible like hit data
+    print('HDF5 writer with %d readouts of %d words' % (n_readouts, words_per_readout))
+    for name in ('Flush per readout', 'DataWriter'):
+        fd, filename = tempfile.mkstemp(suffix='.h5')
+        os.close(fd)
+        with tb.open_file(filename, mode='w') as h5_file:
+            raw_data_earray = h5_file.create_earray(h5_file.root, name='raw_data', atom=tb.UIntAtom(), shape=(0,),
+                                                    filters=tb.Filters(complib='blosc', complevel=5, fletcher32=False))
+            meta_data_table = h5_file.create_table(h5_file.root, name='meta_data', description=meta_data_dtype,
+                                                   filters=tb.Filters(complib='zlib', complevel=5, fletcher32=False))
+            data_writer = DataWriter(raw_data_earray, meta_data_table)
+            start = time.time()
+            for i in range(n_readouts):
+                data_tuple = (raw_data, 0., 0., 0, 0)
+                if name == 'DataWriter':
+                    data_writer.add(data_tuple, 0)
+                else:
+                    legacy_write(raw_data_earray, meta_data_table, data_tuple, 0)
+            data_writer.flush()
+            run_time = time.time() - start
+        os.remove(filename)
+        print('    %-20s %8.1f MWords/s, %8.0f readouts/s' % (name, n_readouts * words_per_readout / run_time / 1e6, n_readouts / run_time))
+
+
+def main(args_dict):
+    if args_dict['writer']:
+        for words_per_readout in args_dict['block_sizes']:
+            benchmark_writer(words_per_readout, args_dict['n_readouts'])
+        return
+    if args_dict['idle']:
+        benchmark_idle(args_dict['duration'], args_dict['readout_interval'], args_dict['max_readout_interval'])
+        return
+    for block_size in args_dict['block_sizes']:
+        benchmark_readout(block_size, args_dict['duration'], args_dict['readout_interval'], args_dict['ring_buffer_size'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the FIFO readout')
+    parser.add_argument('--block_sizes',
+                        type=int,
+                        nargs='+',
+                        default=[256, 4096, 65536],
+                        help='Numbers of words which the mock FIFO returns per read')
+    parser.add_argument('--duration',
+                        type=float,
+                        default=5.,
+                        help='Run time of each readout in seconds')
+    parser.add_argument('--readout_interval',
+                        type=float,
+                        default=0.05,
+                        help='Readout interval of the FifoReadout in seconds')
+    parser.add_argument('--ring_buffer_size',
+                        type=int,
+                        default=2**24,
+                        help='Size of the ring buffer in words')
+    parser.add_argument('--idle',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark the CPU usage of the readout of an empty FIFO with a fixed and an adaptive interval')
+    parser.add_argument('--max_readout_interval',
+                        type=float,
+                        default=0.1,
+                        help='Maximum readout interval of the adaptive readout in seconds')
+    parser.add_argument('--writer',
+                        action='store_true',
+                        help='Toggle this, if you want to benchmark the write throughput to the HDF5 file for readouts of block_sizes words')
+    parser.add_argument('--n_readouts',
+                        type=int,
+                        default=2000,
+                        help='Number of readouts written to the HDF5 file')
+    args_dict = vars(parser.parse_args())
+    logging.getLogger('FifoReadout').setLevel(logging.CRITICAL)
+    logging.getLogger('LegacyFifoReadout').setLevel(logging.CRITICAL)
+    main(args_dict)
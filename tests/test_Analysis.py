@@ -0,0 +1,759 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+import unittest
+import subprocess
+import multiprocessing as mp
+import sys
+import warnings
+import numpy as np
+import tempfile
+from functools import partial
+import tables as tb
+from six.moves.queue import Queue
+from scipy.special import erf
+
+import tpx3.analysis as analysis
+import tpx3.lut as lut
+from tpx3.online_analysis import OnlineHistogramming
+
+
+def create_link_data(n_pairs, link, seed=0):
+    '''
+        Creates the 32 bit packages of n_pairs hits for one link
+    '''
+    rng = np.random.default_rng(seed)
+    payload = rng.integers(1, 2 ** 24, size=(n_pairs, 2), dtype=np.uint32)
+    package1 = (np.uint32(link) << np.uint32(25)) | np.uint32(1 << 24) | payload[:, 0]
+    package0 = (np.uint32(link) << np.uint32(25)) | payload[:, 1]
+    return np.stack([package1, package0], axis=1).ravel()
+
+
+def create_raw_data(n_pairs, links=8, timestamp_every=0, loss_rate=0., seed=0):
+    '''
+        Creates a raw data chunk with the packages of all links interleaved.
+        If timestamp_every is set an FPGA timestamp is added every timestamp_every hits.
+        Packages are removed randomly with the probability loss_rate.
+    '''
+    rng = np.random.default_rng(seed)
+    link_data = np.stack([create_link_data(n_pairs, link, seed + link).reshape(-1, 2) for link in range(links)])
+    order = rng.permutation(np.repeat(np.arange(links), n_pairs))
+    # Position of each hit within its link
+    rank = np.empty_like(order)
+    rank[np.argsort(order, kind='stable')] = np.tile(np.arange(n_pairs), links)
+    raw_data = link_data[order, rank]
+
+    if timestamp_every:
+        positions = np.arange(0, raw_data.shape[0], timestamp_every)
+        timestamp = 1000 + 150000 * np.arange(positions.shape[0], dtype=np.uint64)
+        timestamp_data = np.empty((positions.shape[0], 2), dtype=np.uint32)
+        timestamp_data[:, 0] = (0b0101 << 28) | ((timestamp >> np.uint64(24)) & np.uint64(0xffffff))
+        timestamp_data[:, 1] = (0b0101 << 28) | (1 << 24) | (timestamp & np.uint64(0xffffff))
+        raw_data = np.insert(raw_data, positions, timestamp_data, axis=0)
+    raw_data = raw_data.ravel()
+
+    if loss_rate:
+        raw_data = raw_data[rng.random(raw_data.shape[0]) >= loss_rate]
+    return raw_data
+
+
+def correct_packages_recursive(raw_data, indices, error_flag):
+    '''
+        Reference implementation: recursive correction as it was done in save_and_correct
+    '''
+    second = (raw_data[1::2] & 0x01000000) >> 24
+    first = (raw_data[0::2] & 0x01000000) >> 24
+    errors = np.where(second == error_flag)[0]
+    if len(errors) == 0:
+        return raw_data, indices, 0
+    error = errors[0]
+    if error == 0:
+        delete = 0
+    elif first[error] == error_flag:
+        delete = 2 * error + 1
+    else:
+        delete = 2 * (error - 1) + 1
+    raw_data, indices, num = correct_packages_recursive(np.delete(raw_data, delete), np.delete(indices, delete), error_flag)
+    return raw_data, indices, num + 1
+
+
+def correct_overlap_splits(data_combined, last_timestamp, next_to_last_timestamp):
+    '''
+        Reference implementation: timestamp extension overlap correction on the list of
+        splits starting with a fpga timestamp as it was done in raw_data_to_dut
+    '''
+    timestamp_indices = np.where((data_combined >> np.uint64(48)) == 0b0101)[0]
+    if len(timestamp_indices) and timestamp_indices[0] != 0:
+        splits = [[next_to_last_timestamp], [last_timestamp] + list(data_combined[:timestamp_indices[0]])]
+    else:
+        splits = [[last_timestamp] + list(data_combined[:timestamp_indices[0] if len(timestamp_indices) else None])]
+    for start, stop in zip(timestamp_indices, list(timestamp_indices[1:]) + [None]):
+        splits.append(list(data_combined[start:stop]))
+
+    for i in range(1, len(splits)):
+        extension = (int(splits[i][0]) & 0x3000) >> 12
+        old = [hit for hit in splits[i][1:] if (int(analysis._gray_14_lut[(int(hit) >> 14) & 0x3fff]) & 0x3000) >> 12 != extension]
+        splits[i - 1] += old
+        splits[i] = [splits[i][0]] + [hit for hit in splits[i][1:] if (int(analysis._gray_14_lut[(int(hit) >> 14) & 0x3fff]) & 0x3000) >> 12 == extension]
+
+    timestamps = [split[0] for split in splits for _ in split[1:]]
+    data_words = [hit for split in splits for hit in split[1:]]
+    return np.array(data_words, dtype=np.uint64), np.array(timestamps, dtype=np.uint64)
+
+
+class TestLut(unittest.TestCase):
+    def test_lfsr(self):
+        for bits, lut_array in [(4, lut.lfsr_4_lut()), (10, lut.lfsr_10_lut()), (14, lut.lfsr_14_lut())]:
+            states = lut.lfsr_states(bits)
+            # The all ones state is the start and end of the sequence and decodes to 0
+            self.assertEqual(states[0], 2 ** bits - 1)
+            self.assertEqual(states[-1], 2 ** bits - 1)
+            np.testing.assert_array_equal(lut_array[states[1:-1]], np.arange(1, 2 ** bits - 1))
+
+    def test_gray(self):
+        counts = np.arange(2 ** 14, dtype=np.uint16)
+        np.testing.assert_array_equal(lut.gray_14_lut()[counts ^ (counts >> 1)], counts)
+
+
+class TestPackageCorrection(unittest.TestCase):
+    def test_link_package_loss(self):
+        for loss_rate in [1e-3, 1e-2, 1e-1]:
+            raw_data = create_link_data(2000, link=0, seed=7)
+            raw_data = raw_data[np.random.default_rng(11).random(raw_data.shape[0]) >= loss_rate]
+            indices = np.arange(raw_data.shape[0])
+
+            expected = correct_packages_recursive(raw_data, indices, 1)
+            result = analysis.save_and_correct(raw_data, indices)
+
+            self.assertTrue(np.array_equal(result[0], expected[0]))
+            self.assertTrue(np.array_equal(result[1], expected[1]))
+            self.assertEqual(result[2], expected[2])
+            self.assertEqual(result[2], raw_data.shape[0] - result[0].shape[0])
+
+    def test_timer_package_loss(self):
+        for loss_rate in [1e-3, 1e-2, 1e-1]:
+            # Timer packages have the inverted flag at bit 24
+            raw_data = create_link_data(2000, link=0, seed=13) ^ np.uint32(0x01000000)
+            raw_data = raw_data[np.random.default_rng(17).random(raw_data.shape[0]) >= loss_rate]
+            indices = np.arange(raw_data.shape[0])
+
+            expected = correct_packages_recursive(raw_data, indices, 0)
+            result = analysis.save_and_correct_timer(raw_data, indices)
+
+            self.assertTrue(np.array_equal(result[0], expected[0]))
+            self.assertTrue(np.array_equal(result[1], expected[1]))
+            self.assertEqual(result[2], expected[2])
+
+    def test_large_package_loss(self):
+        # Far more missing packages than the recursion limit would allow
+        raw_data = create_link_data(500000, link=0, seed=19)
+        raw_data = raw_data[np.random.default_rng(23).random(raw_data.shape[0]) >= 1e-1]
+
+        corrected, indices, num = analysis.save_and_correct(raw_data, np.arange(raw_data.shape[0]))
+
+        self.assertGreater(num, 10000)
+        self.assertEqual(corrected.shape[0] + num, raw_data.shape[0])
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        self.assertTrue(np.all(corrected[1::2] & 0x01000000 == 0))
+
+
+class TestRawDataToDut(unittest.TestCase):
+    def test_link_pairing(self):
+        # The single pass kernel has to give the same result as the per link interpretation
+        for loss_rate in [0., 1e-3, 1e-2]:
+            raw_data = create_raw_data(500, loss_rate=loss_rate, seed=3)
+            data_words, _, _, _, _, pending, leftover = analysis._raw_data_to_words(raw_data, np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64))
+
+            expected = np.zeros(raw_data.shape[0], dtype=np.uint64)
+            for link in range(8):
+                link_filter = (raw_data & 0xfe000000) >> 25 == link
+                link_combined, link_indices, _, _, leftoverpackage = analysis.raw_data_to_dut_old(raw_data[link_filter], np.where(link_filter)[0])
+                np.put(expected, link_indices[0::2], link_combined)
+                self.assertEqual(pending[link], leftoverpackage is not None)
+                if leftoverpackage is not None:
+                    self.assertEqual(leftover[link], leftoverpackage)
+            expected = expected[expected != 0]
+
+            self.assertTrue(np.array_equal(data_words, expected))
+
+    def test_timestamps(self):
+        raw_data = create_raw_data(500, timestamp_every=20, seed=5)
+        data_words, timestamps, _, _, leftoverpackage = analysis.raw_data_to_dut(raw_data, 0, 0, leftoverpackage=[])
+
+        self.assertEqual(data_words.shape[0], 8 * 500)
+        self.assertEqual(timestamps.shape[0], data_words.shape[0])
+        self.assertEqual(len(leftoverpackage), 0)
+
+    def test_extension_overlap(self):
+        last_timestamp = (0b0101 << 48) | 0x1000
+        next_to_last_timestamp = (0b0101 << 48) | 0x3000
+        for offset in [0, 6]:
+            # With an offset the chunk starts with chip data instead of a fpga timestamp
+            raw_data = create_raw_data(500, timestamp_every=7, seed=29)[offset:]
+            data_words, timestamps, last, nlast, _ = analysis.raw_data_to_dut(raw_data, last_timestamp, next_to_last_timestamp, leftoverpackage=[])
+
+            timestamp_filter = (raw_data & 0xF0000000) >> 28 == 0b0101
+            k = (raw_data[timestamp_filter] & 0xFFFFFF).astype(np.uint64)
+            timestamps_combined = ((k[0::2] << np.uint64(24)) + k[1::2]) | np.uint64(0b0101 << 48)
+            data_combined, _, _ = analysis._link_data_to_dut(raw_data, timestamps_combined, np.where(timestamp_filter)[0][0::2], 0, [])
+            expected_words, expected_timestamps = correct_overlap_splits(data_combined, last_timestamp, next_to_last_timestamp)
+
+            self.assertTrue(np.array_equal(data_words, expected_words))
+            self.assertTrue(np.array_equal(timestamps, expected_timestamps))
+            self.assertEqual(last, timestamps_combined[-1])
+            self.assertEqual(nlast, timestamps_combined[-2])
+
+            # The debug diagnostics must not change the result
+            debug_words, debug_timestamps, _, _, _ = analysis.raw_data_to_dut(raw_data, last_timestamp, next_to_last_timestamp, leftoverpackage=[], debug=True)
+            self.assertTrue(np.array_equal(debug_words, data_words))
+            self.assertTrue(np.array_equal(debug_timestamps, timestamps))
+
+
+class TestInterpretRawData(unittest.TestCase):
+    def assertHitsEqual(self, hits, expected, fields):
+        self.assertEqual(hits.shape, expected.shape)
+        for field in fields:
+            self.assertTrue(np.array_equal(hits[field], expected[field]), field)
+
+    def test_parallel(self):
+        # With package loss the workers have to recover the leftover packages of the previous block
+        raw_data = create_raw_data(4000, timestamp_every=40, loss_rate=1e-3, seed=31)
+        n_rows = 200
+        meta_data = np.zeros(n_rows, dtype=[('index_start', 'u8'), ('index_stop', 'u8'), ('timestamp_start', 'f8'), ('scan_param_id', 'u4')])
+        index = np.linspace(0, raw_data.shape[0], n_rows + 1).astype(np.uint64)
+        meta_data['index_start'] = index[:-1]
+        meta_data['index_stop'] = index[1:]
+        meta_data['timestamp_start'] = np.arange(n_rows)
+        meta_data['scan_param_id'] = np.arange(n_rows) // 10
+        fields = ['data_header', 'header', 'x', 'y', 'TOA', 'TOT', 'EventCounter', 'HitCounter', 'FTOA', 'TOA_Extension', 'TOA_Combined']
+
+        for split_fine, field in [(False, 'scan_param_id'), (True, 'chunk_start_time')]:
+            expected = analysis.interpret_raw_data(raw_data, 0, False, meta_data, split_fine=split_fine, progress=Queue())
+            hits = analysis.interpret_raw_data(raw_data, 0, False, meta_data, split_fine=split_fine, progress=Queue(), n_processes=3)
+            self.assertHitsEqual(hits, expected, fields + [field])
+
+        # The same pool can be used for several calls
+        with mp.get_context('spawn').Pool(2) as pool:
+            for split_fine, field in [(False, 'scan_param_id'), (True, 'chunk_start_time')]:
+                expected = analysis.interpret_raw_data(raw_data, 0, False, meta_data, split_fine=split_fine, progress=Queue())
+                hits = analysis.interpret_raw_data(raw_data, 0, False, meta_data, split_fine=split_fine, progress=Queue(), pool=pool)
+                self.assertHitsEqual(hits, expected, fields + [field])
+
+    def test_param_boundary(self):
+        # The first package of a hit is the last word of the first scan parameter
+        raw_data = create_raw_data(1000, timestamp_every=40, seed=53)
+        n_hits = 8 * 1000
+        boundary = [i for i in range(raw_data.shape[0] // 2, raw_data.shape[0]) if raw_data[i] >> 28 != 0b0101 and (raw_data[i] >> 24) & 1][0] + 1
+        meta_data = np.zeros(2, dtype=[('index_start', 'u8'), ('index_stop', 'u8'), ('timestamp_start', 'f8'), ('scan_param_id', 'u4')])
+        meta_data['index_start'] = [0, boundary]
+        meta_data['index_stop'] = [boundary, raw_data.shape[0]]
+        meta_data['scan_param_id'] = [0, 1]
+
+        for kwargs in [{}, {'n_processes': 2}, {'split_fine': True}]:
+            hits = analysis.interpret_raw_data(raw_data, 0, False, meta_data, progress=Queue(), **kwargs)
+            self.assertEqual(hits.shape[0], n_hits)
+        hits = analysis.interpret_raw_data(raw_data, 2, False, meta_data, progress=Queue())
+        hits = hits[hits['data_header'] == 1]
+        scurves, pix_occ = analysis.raw_data_to_scurve_hist(raw_data, meta_data, 2, progress=Queue())
+        np.testing.assert_array_equal(scurves, analysis.scurve_hist(hits, np.arange(2)))
+        self.assertEqual(pix_occ.sum(), hits.shape[0])
+
+    def test_columns(self):
+        raw_data = create_raw_data(1000, timestamp_every=40, seed=41)
+        expected = analysis.interpret_raw_data(raw_data, 0, False, progress=Queue())
+
+        columns = ['data_header', 'x', 'y', 'TOT']
+        hits = analysis.interpret_raw_data(raw_data, 0, False, progress=Queue(), columns=columns)
+        self.assertEqual(list(hits.dtype.names), columns)
+        self.assertHitsEqual(hits, expected, columns)
+
+        # The compact layout of the ToA/ToT mode keeps only the columns which are filled in this mode
+        columns = analysis._op_mode_columns(0, False)
+        self.assertNotIn('iTOT', columns)
+        self.assertNotIn('EventCounter', columns)
+        hits = analysis.interpret_raw_data(raw_data, 0, False, progress=Queue(), columns=columns)
+        self.assertHitsEqual(hits, expected, [column for column in columns if column not in ['scan_param_id', 'chunk_start_time']])
+
+    def test_raw_data_to_scurve_hist(self):
+        raw_data = create_raw_data(4000, timestamp_every=40, loss_rate=1e-3, seed=43)
+        n_rows = 200
+        meta_data = np.zeros(n_rows, dtype=[('index_start', 'u8'), ('index_stop', 'u8'), ('timestamp_start', 'f8'), ('scan_param_id', 'u4')])
+        index = np.linspace(0, raw_data.shape[0], n_rows + 1).astype(np.uint64)
+        meta_data['index_start'] = index[:-1]
+        meta_data['index_stop'] = index[1:]
+        meta_data['scan_param_id'] = np.arange(n_rows) // 10
+
+        hit_data = analysis.interpret_raw_data(raw_data, 2, False, meta_data, progress=Queue())
+        hit_data = hit_data[hit_data['data_header'] == 1]
+        expected = analysis.scurve_hist(hit_data, np.arange(20))
+        expected_occ = np.bincount(hit_data['x'].astype(np.uint32) * 256 + hit_data['y'].astype(np.uint32), minlength=256 * 256)
+
+        # Small windows, so that the scan parameters are spread over several reads
+        scurves, pix_occ = analysis.raw_data_to_scurve_hist(raw_data, meta_data, 20, chunk_words=5000, progress=Queue())
+        self.assertEqual(scurves.dtype, expected.dtype)
+        np.testing.assert_array_equal(scurves, expected)
+        np.testing.assert_array_equal(pix_occ, expected_occ)
+
+        # Second half of the scan parameters in their own histogram
+        meta_data_second = meta_data[meta_data['scan_param_id'] >= 10]
+        scurves, _ = analysis.raw_data_to_scurve_hist(raw_data, meta_data_second, 10, param_offset=10, progress=Queue())
+        np.testing.assert_array_equal(scurves, expected[:, 10:])
+        with self.assertRaises(ValueError):
+            analysis.raw_data_to_scurve_hist(raw_data, meta_data_second, 10, progress=Queue())
+
+    def test_iter_interpreted_hits(self):
+        raw_data = create_raw_data(2000, timestamp_every=40, loss_rate=1e-3, seed=37)
+        n_rows = 100
+        meta_data = np.zeros(n_rows, dtype=[('index_start', 'u8'), ('index_stop', 'u8'), ('timestamp_start', 'f8'), ('scan_param_id', 'u4')])
+        index = np.linspace(0, raw_data.shape[0], n_rows + 1).astype(np.uint64)
+        meta_data['index_start'] = index[:-1]
+        meta_data['index_stop'] = index[1:]
+        meta_data['timestamp_start'] = np.arange(n_rows)
+        meta_data['scan_param_id'] = np.arange(n_rows) // 10
+        fields = ['x', 'y', 'TOA', 'TOT', 'HitCounter', 'TOA_Extension', 'TOA_Combined']
+
+        with tempfile.NamedTemporaryFile(suffix='.h5') as f:
+            with tb.open_file(f.name, 'w') as h5_file:
+                h5_file.create_group(h5_file.root, 'configuration')
+                general_config = np.array([(b'Op_mode', 0), (b'Fast_Io_en', 0)], dtype=[('configuration', 'S64'), ('value', 'u2')])
+                h5_file.create_table(h5_file.root.configuration, 'generalConfig', general_config)
+                h5_file.create_array(h5_file.root, 'raw_data', raw_data)
+                h5_file.create_table(h5_file.root, 'meta_data', meta_data)
+                h5_file.create_group(h5_file.root, 'interpreted')
+
+                for split_fine, field in [(False, 'scan_param_id'), (True, 'chunk_start_time')]:
+                    expected = analysis.interpret_raw_data(raw_data, 0, False, meta_data, split_fine=split_fine, progress=Queue())
+                    expected = expected[expected['data_header'] == 1]
+                    name = 'hit_data_%d' % split_fine
+                    windows = list(analysis.iter_interpreted_hits(h5_file, chunk_words=1000, split_fine=split_fine, hit_data_name=name, progress=Queue()))
+
+                    self.assertGreaterEqual(len(windows), 10)
+                    self.assertHitsEqual(np.concatenate(windows), expected, fields + [field])
+                    self.assertHitsEqual(h5_file.root.interpreted._f_get_child(name)[:], expected, fields + [field])
+
+    def test_storage_options(self):
+        options = analysis.storage_options('hit_data')
+        self.assertEqual(options['filters'], tb.Filters(complib='zlib', complevel=5, fletcher32=False))
+        self.assertIsNone(options['chunkshape'])
+        # The vlarrays of the clusters keep their previous filters by default
+        self.assertEqual(analysis.storage_options('cluster_data')['filters'], tb.Filters(complib='zlib', complevel=5))
+
+        storage = {'raw_data': {'complib': 'blosc:zstd', 'complevel': 9, 'bitshuffle': True, 'chunkshape': [4096]}}
+        options = analysis.storage_options('raw_data', storage)
+        self.assertEqual(options['filters'], tb.Filters(complib='blosc:zstd', complevel=9, shuffle=False, bitshuffle=True, fletcher32=False))
+        self.assertEqual(options['chunkshape'], (4096,))
+        with tempfile.NamedTemporaryFile(suffix='.h5') as f:
+            with tb.open_file(f.name, 'w') as h5_file:
+                raw_data = h5_file.create_earray(h5_file.root, 'raw_data', atom=tb.UIntAtom(), shape=(0,), **options)
+                raw_data.append(np.arange(10000, dtype=np.uint32))
+            with tb.open_file(f.name) as h5_file:
+                self.assertEqual(h5_file.root.raw_data.chunkshape, (4096,))
+                self.assertEqual(h5_file.root.raw_data.filters.complib, 'blosc:zstd')
+                np.testing.assert_array_equal(h5_file.root.raw_data[:], np.arange(10000))
+
+        with self.assertRaises(ValueError):
+            analysis.storage_options('hit_data', {'hit_data': {'level': 5}})
+
+
+class TestFitScurves(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(11)
+        self.x = np.arange(1000, 1100)
+        self.n_injections = 100
+        self.mu = rng.uniform(1030, 1070, 100)
+        self.sigma = rng.uniform(1, 6, 100)
+        self.rng = rng
+
+    def create_scurves(self, invert_x):
+        sign = -1 if invert_x else 1
+        p = 0.5 * (1 + sign * erf((self.x[np.newaxis, :] - self.mu[:, np.newaxis]) / (np.sqrt(2) * self.sigma[:, np.newaxis])))
+        scurves = self.rng.binomial(self.n_injections, p).astype(np.uint16)
+        # Pixels without data and pixels with too few hits for a fit
+        scurves[:5] = 0
+        scurves[5:10] = self.rng.binomial(self.n_injections, 0.05, (5, self.x.shape[0]))
+        return scurves
+
+    def check_batch_fit(self, invert_x):
+        scurves = self.create_scurves(invert_x)
+        sigma_0 = np.median([analysis.get_noise(self.x, curve, self.n_injections, invert_x) for curve in scurves if curve.max() == self.n_injections])
+        batch = np.array(analysis.fit_scurves_batch(scurves, self.x, self.n_injections, sigma_0, invert_x, progress=Queue())).T
+        single = np.array([analysis.fit_scurve(curve.tolist(), self.x, self.n_injections, sigma_0, invert_x) for curve in scurves])
+        np.testing.assert_array_equal(batch[:10], 0)
+        np.testing.assert_array_equal(batch[:, 0] == 0, single[:, 0] == 0)
+        np.testing.assert_allclose(batch, single, rtol=1e-3)
+
+    def test_fit_scurves_batch(self):
+        self.check_batch_fit(invert_x=False)
+
+    def test_fit_zcurves_batch(self):
+        self.check_batch_fit(invert_x=True)
+
+    def test_fit_degenerate_scurves(self):
+        for invert_x in (False, True):
+            sign = -1 if invert_x else 1
+            # Sharp S-curves with a sigma below one step and noisy S-curves
+            sigma = np.where(np.arange(100) < 40, self.rng.uniform(0.05, 0.3, 100), self.sigma)
+            p = 0.5 * (1 + sign * erf((self.x[np.newaxis, :] - self.mu[:, np.newaxis]) / (np.sqrt(2) * sigma[:, np.newaxis])))
+            scurves = self.rng.binomial(self.n_injections, p)
+            noise = (self.rng.uniform(size=(40, 100)) < 0.05) * self.rng.randint(1, 10, (40, 100))
+            scurves[60:] = np.minimum(scurves[60:] + noise, self.n_injections)
+            # Step functions, hits for all steps and hits only for the last step
+            scurves[:20] = np.where(sign * (self.x[np.newaxis, :] - self.mu[:20, np.newaxis]) >= 0, self.n_injections, 0)
+            scurves[40:45] = self.n_injections
+            scurves[45:50] = 0
+            scurves[45:50, -1 if sign == 1 else 0] = self.n_injections
+
+            thr, sig, _, status, _ = analysis.fit_scurves_batch(scurves, self.x, self.n_injections, 3., invert_x, progress=Queue(), diagnostics=True)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                single = np.array([analysis._fit_scurve_params(curve.tolist(), self.x, self.n_injections, 3., invert_x) for curve in scurves])
+            np.testing.assert_array_equal(status, single[:, 3])
+            np.testing.assert_array_equal(status[40:45], analysis.FIT_REJECTED)
+            np.testing.assert_allclose(thr, single[:, 1], atol=0.05)
+            np.testing.assert_array_equal(sig == 0, status != analysis.FIT_OK)
+
+    def test_fit_diagnostics(self):
+        scurves = self.create_scurves(invert_x=False)
+        # Not converging within max_iter
+        _, _, _, status, n_iter = analysis.fit_scurves_batch(scurves, self.x, self.n_injections, 3., max_iter=1, progress=Queue(), diagnostics=True)
+        self.assertTrue(np.all(status[10:] == analysis.FIT_NOT_CONVERGED))
+        thr, _, chi2ndf, status, n_iter = analysis.fit_scurves_batch(scurves, self.x, self.n_injections, 3., progress=Queue(), diagnostics=True)
+        np.testing.assert_array_equal(status[:5], analysis.FIT_NO_DATA)
+        np.testing.assert_array_equal(status[5:10], analysis.FIT_LOW_SIGNAL)
+        np.testing.assert_array_equal(status[10:] == analysis.FIT_OK, thr[10:] != 0)
+        self.assertTrue(np.all(n_iter[status == analysis.FIT_OK] > 0))
+        np.testing.assert_array_equal(n_iter[:10], 0)
+
+        table = analysis.fit_diagnostics(np.resize(status, 256 * 256), 0, np.resize(chi2ndf, 256 * 256))
+        self.assertEqual(table['x'][300], 1)
+        self.assertEqual(table['y'][300], 44)
+        self.assertEqual(table['status'][256 * 256 - 1], status[(256 * 256 - 1) % 100])
+
+    def test_chi2ndf(self):
+        scurves = self.create_scurves(invert_x=False)
+        A = self.rng.uniform(90, 110, 100)
+        A[:5] = 0.
+        sigma = np.where(A != 0, self.sigma, 0.)
+        expected = np.zeros(100)
+        for i in range(5, 100):
+            yerr = analysis.scurve_errors(scurves[i], self.n_injections)
+            expected[i] = analysis.Chi_square(self.x, scurves[i], yerr, analysis.scurve, (A[i], self.mu[i], sigma[i]))[0]
+        np.testing.assert_allclose(analysis.scurve_chi2ndf(scurves, self.x, self.n_injections, A, self.mu, sigma), expected)
+
+        # Chi_square for a function with default arguments
+        def line(x, a, b, unused=None):
+            return a * x + b
+        self.assertEqual(analysis.Chi_square(np.arange(4.), np.arange(4.) + 1, np.ones(4), line, (1., 0.)), (2., 2))
+
+    def test_scurve_fit_cache(self):
+        scurves = self.create_scurves(invert_x=False)
+        cache = analysis.ScurveFitCache()
+        first = np.array(cache.fit(scurves, self.x, self.n_injections, 3., progress=Queue()))
+
+        # Shift the thresholds of some pixels as in the next iteration of the PixelDACopt
+        self.mu[50:60] += 3
+        changed = scurves.copy()
+        changed[50:60] = self.create_scurves(invert_x=False)[50:60]
+        second = np.array(cache.fit(changed, self.x, self.n_injections, 3., progress=Queue()))
+        fresh = np.array(analysis.fit_scurves_batch(changed, self.x, self.n_injections, 3., progress=Queue()))
+
+        # Unchanged pixels keep their result, changed pixels are refitted from the last result
+        np.testing.assert_array_equal(np.delete(second, np.s_[50:60], axis=1), np.delete(first, np.s_[50:60], axis=1))
+        np.testing.assert_allclose(second, fresh, rtol=1e-3)
+
+    def test_scurve_fit_cache_steps(self):
+        # Step functions have fits with a sigma far below one step
+        steps = np.where(self.x >= self.mu[:, np.newaxis], self.n_injections, 0)
+        cache = analysis.ScurveFitCache()
+        first = np.array(cache.fit(steps, self.x, self.n_injections, 3., progress=Queue()))
+        self.assertTrue(np.all(first[1] < 0.5))
+
+        # The S-curves of the next fit do not start from these fits
+        self.mu += 0.2
+        scurves = self.create_scurves(invert_x=False)
+        second = np.array(cache.fit(scurves, self.x, self.n_injections, 3., progress=Queue()))
+        fresh = np.array(analysis.fit_scurves_batch(scurves, self.x, self.n_injections, 3., progress=Queue()))
+        np.testing.assert_allclose(second, fresh, rtol=1e-3)
+
+    def test_fitless_scurves(self):
+        for invert_x in (False, True):
+            scurves = self.create_scurves(invert_x)
+            thr, sig = analysis.fitless_scurves(scurves, self.x, self.n_injections, invert_x)
+            # Same values as the estimators per pixel, pixels without valid data are 0
+            for i in range(10, scurves.shape[0]):
+                self.assertAlmostEqual(thr[i], analysis.get_threshold(self.x, scurves[i], self.n_injections, invert_x))
+                self.assertAlmostEqual(sig[i], analysis.get_noise(self.x, scurves[i], self.n_injections, invert_x))
+            np.testing.assert_array_equal(thr[:10], 0)
+            np.testing.assert_array_equal(sig[:10], 0)
+            np.testing.assert_allclose(thr[10:], self.mu[10:], atol=1)
+            np.testing.assert_allclose(sig[10:], self.sigma[10:], atol=1)
+
+    def test_fit_executor(self):
+        scurves = self.create_scurves(invert_x=False)
+        fit = partial(analysis.fit_scurve, scan_param_range=self.x, n_injections=self.n_injections, sigma_0=3., invert_x=False)
+        executor = analysis.FitExecutor(n_processes=2)
+        try:
+            progress = Queue()
+            result = executor.map(fit, scurves, progress=progress)
+            # The pool is kept for the next fit
+            pool = executor._pool
+            blocks = executor.map_blocks(np.sum, scurves, progress=progress)
+            self.assertIs(executor._pool, pool)
+        finally:
+            executor.close()
+        self.assertEqual(result, [fit(curve) for curve in scurves])
+        self.assertEqual(sum(blocks), scurves.sum())
+        self.assertEqual(progress.queue[-1], 1)
+
+    def test_fit_executor_after_parallel_kernel(self):
+        # Forked pools hang at the exit of processes which ran numba parallel kernels before
+        script = '''
+import numpy as np
+from numba import njit, prange
+import tpx3.analysis as analysis
+
+@njit(parallel=True)
+def kernel(n):
+    total = 0
+    for i in prange(n):
+        total += i
+    return total
+
+class NoProgress(object):
+    def put(self, fraction):
+        pass
+
+kernel(1000)
+print(sum(analysis.get_fit_executor().map_blocks(np.sum, np.ones((100, 10)), progress=NoProgress())))
+'''
+        output = subprocess.check_output([sys.executable, '-c', script], timeout=300)
+        self.assertEqual(float(output), 1000.)
+
+
+class TestThresholdHelpers(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(5)
+
+    def test_vths(self):
+        scurves = self.rng.randint(0, 100, (256 * 256, 60)).astype(np.uint16)
+        scurves[::3] = 0
+        expected = np.zeros((256, 256), dtype=np.uint16)
+        for pixel, curve in enumerate(scurves[:, :50].astype(np.int64)):
+            if curve.sum() > 0:
+                expected[pixel // 256, pixel % 256] = 1000 + np.sum(curve * np.arange(50)) / (curve.sum() * 1.0)
+        np.testing.assert_array_equal(analysis.vths(scurves, range(50), 1000), expected)
+
+    def test_vth_hist(self):
+        vths = self.rng.uniform(-5, 1100, (256, 256))
+        expected = np.zeros(1001, dtype=np.uint16)
+        for value in vths.ravel():
+            if 0 <= int(value) < 1000:
+                expected[int(value)] += 1
+        np.testing.assert_array_equal(analysis.vth_hist(vths, 1000), expected)
+
+    def test_th_means(self):
+        hist_th0 = np.zeros(1001, dtype=np.uint16)
+        hist_th15 = np.zeros(1001, dtype=np.uint16)
+        hist_th0[400:600] = self.rng.randint(0, 50, 200)
+        hist_th15[500:700] = self.rng.randint(0, 50, 200)
+        expected = analysis.th_means.py_func(hist_th0, hist_th15, 300, 900)
+        self.assertEqual(analysis.th_means(hist_th0, hist_th15, 300, 900), expected)
+
+    def test_toas(self):
+        data = np.zeros(5000, dtype=[('x', 'u1'), ('y', 'u1'), ('FTOA', 'u1'), ('TOT', 'u2'), ('TOA_Combined', 'u8'), ('Shutter_Timer', 'u8')])
+        data['x'] = self.rng.randint(0, 256, 5000)
+        data['y'] = self.rng.randint(0, 20, 5000)
+        data['FTOA'] = self.rng.randint(0, 3, 5000)
+        data['TOT'] = self.rng.randint(0, 3, 5000)
+        data['TOA_Combined'] = self.rng.randint(0, 800, 5000)
+        data['Shutter_Timer'] = self.rng.randint(0, 20, 5000)
+        mask = np.zeros((256, 256))
+        mask[:, 5] = 1
+
+        # Value of the first hit per pixel with a value != 0
+        ftoas = np.zeros((256, 256), dtype=np.uint8)
+        toas = np.zeros((256, 256))
+        full_toa = np.zeros((256, 256))
+        tots = np.zeros((256, 256))
+        for hit in data:
+            x, y = hit['x'], hit['y']
+            if ftoas[x, y] == 0:
+                ftoas[x, y] = hit['FTOA']
+            if toas[x, y] == 0:
+                toas[x, y] = (hit['TOA_Combined'] * 25) - (hit['Shutter_Timer'] * 1.5625)
+            if full_toa[x, y] == 0:
+                offset = ((int(x) - 2) % 256 // 2 % 16) * 1.5625
+                full_toa[x, y] = ((hit['TOA_Combined'] * 25) - (hit['FTOA'] * 1.5625) + offset) - (hit['Shutter_Timer'] * 1.5625)
+            if tots[x, y] == 0:
+                tots[x, y] = hit['TOT']
+
+        toas[full_toa > 10000] -= 409600
+        full_toa[full_toa > 10000] -= 409600
+        full_toa[(full_toa < 5000) | (mask == 1)] = np.nan
+        tots[(full_toa < 5000) | (mask == 1)] = np.nan
+
+        result = analysis.toas(data, mask)
+        for value, expected in zip(result, (ftoas, toas, full_toa, np.nanmean(full_toa), np.nanstd(full_toa), tots, np.nanmean(tots), np.nanstd(tots))):
+            np.testing.assert_array_equal(value, expected)
+
+
+class TestHistKernels(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(11)
+        self.hit_data = np.zeros(20000, dtype=[('x', 'u1'), ('y', 'u1'), ('scan_param_id', 'u4'), ('EventCounter', 'u2'), ('TOT', 'u2')])
+        self.hit_data['x'] = rng.randint(0, 256, 20000)
+        self.hit_data['y'] = rng.randint(0, 8, 20000)
+        self.hit_data['scan_param_id'] = rng.randint(0, 5, 20000)
+        self.hit_data['EventCounter'] = rng.randint(0, 1024, 20000)
+        self.hit_data['TOT'] = rng.randint(0, 1024, 20000)
+
+    def test_scurve_hist(self):
+        pixel = self.hit_data['x'].astype(np.int64) * 256 + self.hit_data['y']
+        expected = np.zeros((256 * 256, 5), dtype=np.uint64)
+        np.add.at(expected, (pixel, self.hit_data['scan_param_id']), self.hit_data['EventCounter'])
+        np.testing.assert_array_equal(analysis.scurve_hist(self.hit_data, np.arange(5)), expected)
+        # Several partial histograms, also with more partials than hits
+        for n_partials in [3, 8]:
+            result = analysis._scurve_hist(self.hit_data['x'], self.hit_data['y'], self.hit_data['scan_param_id'], self.hit_data['EventCounter'], 5, n_partials)
+            np.testing.assert_array_equal(result, expected)
+        result = analysis._scurve_hist(self.hit_data['x'][:5], self.hit_data['y'][:5], self.hit_data['scan_param_id'][:5], self.hit_data['EventCounter'][:5], 5, 8)
+        np.testing.assert_array_equal(result.sum(), self.hit_data['EventCounter'][:5].sum())
+
+    def test_scurve_hist_overflow(self):
+        # More than 2^16 counts in one bin
+        hit_data = self.hit_data[:1000].copy()
+        hit_data['x'], hit_data['y'], hit_data['scan_param_id'], hit_data['EventCounter'] = 7, 3, 2, 1023
+        scurves = analysis.scurve_hist(hit_data, np.arange(5))
+        self.assertEqual(scurves[7 * 256 + 3, 2], 1023000)
+
+    def test_totcurve_hist(self):
+        # The ToT sum depends on the order of the hits of a pixel
+        means = np.zeros(256 * 256, dtype=np.uint64)
+        hits = np.zeros(256 * 256, dtype=np.uint64)
+        for hit in self.hit_data:
+            pixel = int(hit['x']) * 256 + int(hit['y'])
+            if hits[pixel] == 0 or hit['TOT'] > 0.5 * (means[pixel] / hits[pixel]):
+                means[pixel] += hit['TOT']
+            hits[pixel] += 1
+        for n_parts in [1, 3, 8]:
+            result = analysis._totcurve_hist(self.hit_data['x'], self.hit_data['y'], self.hit_data['TOT'], n_parts)
+            np.testing.assert_array_equal(result[0], means)
+            np.testing.assert_array_equal(result[1], hits)
+
+    def test_noise_pixel_count(self):
+        hit_data = self.hit_data.astype([('x', 'u1'), ('y', 'u1'), ('scan_param_id', 'u2'), ('EventCounter', 'u2'), ('TOT', 'u2')])
+        # The noise curves are uint16
+        hit_data['EventCounter'] %= 8
+        pixels = np.zeros(15, dtype=np.uint16)
+        hits = np.zeros(15, dtype=np.uint16)
+        seen = set()
+        for hit in hit_data:
+            key = (hit['x'], hit['y'], hit['scan_param_id'])
+            if key not in seen:
+                seen.add(key)
+                pixels[hit['scan_param_id'] + 10] += 1
+                hits[hit['scan_param_id'] + 10] += hit['EventCounter']
+        result = analysis.noise_pixel_count(hit_data, np.arange(5), 10)
+        np.testing.assert_array_equal(result[0], pixels)
+        np.testing.assert_array_equal(result[1], hits)
+
+    def test_warmup_kernels(self):
+        analysis.warmup_kernels()
+        for kernel, signature in analysis._kernel_signatures():
+            self.assertIn(signature, kernel.signatures)
+        # Kernels which are called from python, the others are compiled into them
+        for kernel in [analysis._raw_data_to_words, analysis._correct_packages, analysis._raw_data_to_scurve_hist, analysis._scurve_hist_words,
+                       analysis._scurve_hist_flush, analysis.th_means, analysis._fit_scurves_lm, analysis._fit_totcurves_lm]:
+            self.assertTrue(kernel.signatures)
+
+    def test_totcurve_hist_overflow(self):
+        hit_data = self.hit_data[:1000].copy()
+        hit_data['x'], hit_data['y'], hit_data['TOT'] = 7, 3, 1023
+        means, hits = analysis.totcurve_hist(hit_data)
+        self.assertEqual(means[7 * 256 + 3], 1023000)
+        self.assertEqual(hits[7 * 256 + 3], 1000)
+
+
+class TestFitTotcurves(unittest.TestCase):
+    def test_fit_totcurves_batch(self):
+        rng = np.random.RandomState(3)
+        x = np.arange(300)
+        a, b = rng.uniform(0.15, 0.3, (100, 1)), rng.uniform(3, 8, (100, 1))
+        c, t = rng.uniform(20, 100, (100, 1)), rng.uniform(10, 30, (100, 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tot = a * x + b - c / (x - t)
+        totcurves = np.where((x > t) & (tot > 1), np.round(tot + rng.normal(0, 0.3, tot.shape)), 0).clip(0)
+        # Pixels without data and with too few data points
+        totcurves[:4] = 0
+        totcurves[3, 100:102] = 20
+        t_est = np.average(np.where((totcurves > 0) & (totcurves <= 5))[1])
+
+        batch = np.array(analysis.fit_totcurves_batch(totcurves, t_est, progress=Queue())).T
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            single = np.array([analysis.fit_ToT(curve, None, t_est) for curve in totcurves])
+
+        np.testing.assert_array_equal(batch[:4], 0)
+        # The totcurve has several local minima close to the pole, the fits have to find equally good ones
+        valid = (batch[:, 4] != 0) & (single[:, 4] != 0)
+        self.assertGreaterEqual(np.sum(valid), 95)
+        self.assertAlmostEqual(np.median(batch[valid, 4] / single[valid, 4]), 1, places=3)
+        np.testing.assert_allclose(batch[valid, 0], single[valid, 0], rtol=0.1)
+
+    def test_fit_totcurves_batch_pole(self):
+        # Start value of t on a step with data
+        totcurves = np.arange(8, dtype=float).reshape(1, 8) + 1
+        np.testing.assert_array_equal(np.array(analysis.fit_totcurves_batch(totcurves, 1., progress=Queue())).shape, (5, 1))
+
+
+class TestOnlineHistogramming(unittest.TestCase):
+    def setUp(self):
+        self.raw_data = create_raw_data(2000, loss_rate=1e-3, seed=47)
+        n_rows = 100
+        self.meta_data = np.zeros(n_rows, dtype=[('index_start', 'u8'), ('index_stop', 'u8'), ('timestamp_start', 'f8'), ('scan_param_id', 'u4')])
+        index = np.linspace(0, self.raw_data.shape[0], n_rows + 1).astype(np.uint64)
+        self.meta_data['index_start'] = index[:-1]
+        self.meta_data['index_stop'] = index[1:]
+        self.meta_data['scan_param_id'] = np.arange(n_rows) // 10
+
+    def add_readouts(self, histogramming):
+        for row in self.meta_data:
+            histogramming.histogram(self.raw_data[row['index_start']:row['index_stop']], row['scan_param_id'])
+        histogramming.stop()
+        self.assertTrue(histogramming.complete)
+
+    def test_scurve(self):
+        histogramming = OnlineHistogramming(10)
+        self.add_readouts(histogramming)
+        scurves, pix_occ = analysis.raw_data_to_scurve_hist(self.raw_data, self.meta_data, 10, progress=Queue())
+        self.assertEqual(histogramming.scurves.dtype, scurves.dtype)
+        np.testing.assert_array_equal(histogramming.scurves, scurves)
+        np.testing.assert_array_equal(histogramming.pix_occ, pix_occ)
+
+    def test_tot(self):
+        histogramming = OnlineHistogramming(10, op_mode=0, scurve=False, tot=True)
+        self.add_readouts(histogramming)
+        for param_id in range(10):
+            rows = self.meta_data[self.meta_data['scan_param_id'] == param_id]
+            hit_data = analysis.interpret_raw_data(self.raw_data[rows['index_start'][0]:rows['index_stop'][-1]], 0, False)
+            means, hits = analysis.totcurve_hist(hit_data[hit_data['data_header'] == 1])
+            np.testing.assert_array_equal(histogramming.totcurves_means[:, param_id], means)
+            np.testing.assert_array_equal(histogramming.totcurves_hits[:, param_id], hits)
+
+    def test_invalid_scan_param_id(self):
+        # The readouts use 10 scan parameters
+        histogramming = OnlineHistogramming(5)
+        for row in self.meta_data:
+            histogramming.histogram(self.raw_data[row['index_start']:row['index_stop']], row['scan_param_id'])
+        histogramming.stop()
+        self.assertFalse(histogramming.complete)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,295 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+from __future__ import absolute_import
+from __future__ import division
+import unittest
+import time
+import tempfile
+import numpy as np
+import tables as tb
+from threading import Thread
+from six.moves.queue import Queue
+
+from tpx3.fifo_readout import RingBuffer, FifoReadout
+from tpx3.data_writer import DataWriter
+
+meta_data_dtype = np.dtype([('index_start', 'u8'), ('index_stop', 'u8'), ('data_length', 'u4'), ('timestamp_start', 'f8'), ('timestamp_stop', 'f8'),
+                            ('scan_param_id', 'u4'), ('discard_error', 'u4'), ('decode_error', 'u4'), ('trigger', 'f8')])
+
+
+class MockRx(object):
+    '''
+        Receiver channel without errors
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.READY = True
+        self.ENABLE = True
+        self.RESET = 0
+        self.INVERT = False
+        self.SAMPLING_EDGE = 0
+        self.DATA_DELAY = 0
+        self.DECODER_ERROR_COUNTER = 0
+        self.n_error_reads = 0
+
+    @property
+    def LOST_DATA_COUNTER(self):
+        self.n_error_reads += 1
+        return 0
+
+    def rx_error_reset(self):
+        pass
+
+
+class MockFifo(object):
+    '''
+        FIFO which returns blocks of block_size consecutive words, as bytes from the transfer layer.
+        With n_blocks it is empty after n_blocks blocks.
+    '''
+    def __init__(self, block_size=1024, n_blocks=None):
+        self.block_size = block_size
+        self.n_blocks = n_blocks
+        self.n_words = 0
+        self.n_reads = 0
+
+    def __getitem__(self, key):
+        return 0  # FIFO_SIZE and RESET
+
+    def get_data(self):
+        self.n_reads += 1
+        if self.n_blocks is not None and self.n_words >= self.n_blocks * self.block_size:
+            return np.frombuffer(b'', dtype='<u4')
+        block = np.arange(self.n_words, self.n_words + self.block_size, dtype=np.uint32)
+        self.n_words += self.block_size
+        return np.frombuffer(block.tobytes(), dtype='<u4')
+
+
+class MockChip(object):
+    '''
+        Chip with the modules used by the FifoReadout
+    '''
+    def __init__(self, fifo):
+        self.fifo = fifo
+        self.rx = [MockRx('RX%d' % i) for i in range(8)]
+
+    def __getitem__(self, key):
+        return self.fifo
+
+    def get_modules(self, kind):
+        return self.rx
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_views(self):
+        ring = RingBuffer(10)
+        self.assertTrue(ring.write(np.arange(3, dtype=np.uint32)))
+        self.assertTrue(ring.write(np.arange(3, 5, dtype=np.uint32)))
+        data = ring.commit()
+        self.assertTrue(np.array_equal(data, np.arange(5)))
+        self.assertTrue(np.shares_memory(data, ring._buffer))
+
+    def test_wrap(self):
+        ring = RingBuffer(10)
+        ring.write(np.zeros(4, dtype=np.uint32))
+        ring.commit()
+        ring.write(np.ones(4, dtype=np.uint32))
+        second = ring.commit()
+        # The committed readouts are not overwritten
+        self.assertFalse(ring.write(np.full(4, 2, dtype=np.uint32)))
+        ring.release()
+        # The readout is moved to the beginning of the buffer when it does not fit at the end
+        self.assertTrue(ring.write(np.full(2, 2, dtype=np.uint32)))
+        self.assertTrue(ring.write(np.full(2, 3, dtype=np.uint32)))
+        third = ring.commit()
+        self.assertTrue(np.array_equal(third, [2, 2, 3, 3]))
+        self.assertTrue(np.array_equal(second, np.ones(4)))
+        self.assertFalse(ring.write(np.zeros(3, dtype=np.uint32)))
+        ring.release()
+        self.assertTrue(ring.write(np.zeros(6, dtype=np.uint32)))
+        self.assertTrue(np.array_equal(third, [2, 2, 3, 3]))
+
+    def test_random(self):
+        # The free space check has the result of a check against every committed readout
+        rng = np.random.RandomState(5)
+        ring = RingBuffer(50)
+        committed = []
+        for _ in range(5000):
+            for start, stop in [(ring._stop, ring._stop + 7), (0, ring._stop - ring._start + 7)]:
+                used = any(start < chunk_stop and chunk_start < stop for chunk_start, chunk_stop in ring._chunks)
+                self.assertEqual(ring._fits(start, stop), stop <= ring.size and not used)
+            action = rng.randint(3)
+            if action == 0:
+                ring.write(np.full(rng.randint(1, 15), len(committed), dtype=np.uint32))
+            elif action == 1:
+                data = ring.commit()
+                committed.append((data, data.copy()))
+            elif committed:
+                data, copy = committed.pop(0)
+                self.assertTrue(np.array_equal(data, copy))
+                ring.release()
+
+
+class TestFifoReadout(unittest.TestCase):
+    def run_readout(self, fifo, ring_buffer_size):
+        fifo_readout = FifoReadout(MockChip(fifo), readout_interval=0.01, moving_average_time_period=0.1, ring_buffer_size=ring_buffer_size)
+        readouts = []
+        fifo_readout.start(callback=lambda data_tuple: readouts.append(data_tuple[0].copy()))
+        while fifo.n_words < fifo.n_blocks * fifo.block_size:
+            time.sleep(0.01)
+        fifo_readout.stop()
+        return fifo_readout, np.concatenate(readouts)
+
+    def test_readout(self):
+        fifo = MockFifo(block_size=100, n_blocks=50000)
+        fifo_readout, data = self.run_readout(fifo, 2**21)
+        self.assertTrue(np.array_equal(data, np.arange(5000000)))
+        self.assertEqual(fifo_readout._ring_buffer_overflows, 0)
+        self.assertEqual(len(fifo_readout._ring_buffer._chunks), 0)
+
+    def test_readout_overflow(self):
+        # Readouts which do not fit into the ring buffer are copied
+        fifo = MockFifo(block_size=100, n_blocks=2000)
+        fifo_readout, data = self.run_readout(fifo, 1000)
+        self.assertTrue(np.array_equal(data, np.arange(200000)))
+        self.assertGreater(fifo_readout._ring_buffer_overflows, 0)
+        self.assertEqual(len(fifo_readout._ring_buffer._chunks), 0)
+
+    def test_consumers(self):
+        # All consumers get the same views on the ring buffer
+        fifo = MockFifo(block_size=100, n_blocks=2000)
+        fifo_readout = FifoReadout(MockChip(fifo), readout_interval=0.01, moving_average_time_period=0.1)
+        readouts = [[], []]
+        views = []
+
+        def writer(data_tuple):
+            readouts[0].append(data_tuple[0].copy())
+            views.append(np.shares_memory(data_tuple[0], fifo_readout._ring_buffer._buffer))
+
+        def histogrammer(data_tuple):
+            time.sleep(0.001)
+            readouts[1].append(data_tuple[0].copy())
+
+        fifo_readout.start(callback=[writer, histogrammer])
+        while fifo.n_words < fifo.n_blocks * fifo.block_size:
+            time.sleep(0.01)
+        fifo_readout.stop()
+        self.assertEqual(len(fifo_readout.worker_threads), 2)
+        self.assertFalse(fifo_readout.is_alive)
+        for data in readouts:
+            self.assertTrue(np.array_equal(np.concatenate(data), np.arange(200000)))
+        self.assertTrue(any(views))
+        self.assertEqual(fifo_readout.queue_depth, [0, 0])
+        self.assertEqual(len(fifo_readout._ring_buffer._chunks), 0)
+
+    def test_backpressure(self):
+        # The readout waits for a slow consumer, no readout is lost
+        fifo = MockFifo(block_size=100, n_blocks=2000)
+        fifo_readout = FifoReadout(MockChip(fifo), readout_interval=0.002, moving_average_time_period=0.1, queue_size=2)
+        readouts = []
+
+        def consumer(data_tuple):
+            time.sleep(0.01)
+            readouts.append(data_tuple[0].copy())
+
+        fifo_readout.start(callback=consumer)
+        while fifo.n_words < fifo.n_blocks * fifo.block_size:
+            time.sleep(0.01)
+        fifo_readout.stop()
+        self.assertTrue(np.array_equal(np.concatenate(readouts), np.arange(200000)))
+        self.assertLessEqual(fifo_readout.queue_high_water[0], 2)
+        self.assertGreater(fifo_readout._queue_full_count, 0)
+
+    def test_adaptive(self):
+        fifo = MockFifo(block_size=100, n_blocks=0)
+        chip = MockChip(fifo)
+        fifo_readout = FifoReadout(chip, readout_interval=0.005, moving_average_time_period=0.1,
+                                   adaptive=True, max_readout_interval=0.05, error_read_interval=0.1)
+        readouts = []
+        fifo_readout.start(callback=lambda data_tuple: readouts.append(data_tuple[0].copy()))
+        # The empty FIFO is read about once per max_readout_interval
+        time.sleep(0.5)
+        self.assertLess(fifo.n_reads, 30)
+        self.assertEqual(fifo_readout._interval, 0.05)
+        self.assertLess(chip.rx[0].n_error_reads, 10)
+        fifo.n_blocks = 2000
+        while fifo.n_words < fifo.n_blocks * fifo.block_size:
+            time.sleep(0.01)
+        fifo_readout.stop()
+        self.assertTrue(np.array_equal(np.concatenate(readouts), np.arange(200000)))
+
+    def test_error_read_interval(self):
+        fifo = MockFifo(block_size=100, n_blocks=2000)
+        chip = MockChip(fifo)
+        chip.rx[0].DECODER_ERROR_COUNTER = 2
+        fifo_readout = FifoReadout(chip, readout_interval=0.001, moving_average_time_period=0.1, error_read_interval=10.)
+        errors = []
+        fifo_readout.start(callback=lambda data_tuple: errors.append(data_tuple[4]))
+        while fifo.n_words < fifo.n_blocks * fifo.block_size:
+            time.sleep(0.01)
+        fifo_readout.stop()
+        # The counters are read with the first readout and the readouts after stop, the readouts in between get the values of the first read
+        self.assertLessEqual(chip.rx[0].n_error_reads, 3)
+        self.assertGreater(len(errors), 2)
+        self.assertEqual(errors, [2] * len(errors))
+
+
+class TestDataWriter(unittest.TestCase):
+    def write_readouts(self, readouts, **kwargs):
+        with tempfile.NamedTemporaryFile(suffix='.h5') as tmp:
+            with tb.open_file(tmp.name, mode='w') as h5_file:
+                raw_data_earray = h5_file.create_earray(h5_file.root, name='raw_data', atom=tb.UIntAtom(), shape=(0,))
+                meta_data_table = h5_file.create_table(h5_file.root, name='meta_data', description=meta_data_dtype)
+                data_writer = DataWriter(raw_data_earray, meta_data_table, **kwargs)
+                for i, raw_data in enumerate(readouts):
+                    data_writer.add((raw_data, 2. * i, 2. * i + 1, i, 0), i // 10)
+                data_writer.flush()
+            with tb.open_file(tmp.name) as h5_file:
+                return h5_file.root.raw_data[:], h5_file.root.meta_data[:], data_writer.n_writes
+
+    def test_batches(self):
+        rng = np.random.default_rng(0)
+        readouts = [rng.integers(0, 2**32, size=n, dtype=np.uint32) for n in rng.integers(0, 300, size=100)]
+        readouts[50] = np.arange(5000, dtype=np.uint32)  # does not fit into a batch
+        raw_data, meta_data, n_writes = self.write_readouts(readouts, batch_words=1000, flush_interval=10.)
+        np.testing.assert_array_equal(raw_data, np.concatenate(readouts))
+        self.assertEqual(meta_data.shape[0], 100)
+        for i, row in enumerate(meta_data):
+            np.testing.assert_array_equal(raw_data[row['index_start']:row['index_stop']], readouts[i])
+            self.assertEqual(row['data_length'], readouts[i].shape[0])
+            self.assertEqual(row['timestamp_start'], 2. * i)
+            self.assertEqual(row['discard_error'], i)
+            self.assertEqual(row['scan_param_id'], i // 10)
+        self.assertLess(n_writes, 30)
+
+    def test_flush_interval(self):
+        readouts = [np.arange(10, dtype=np.uint32)] * 5
+        raw_data, meta_data, n_writes = self.write_readouts(readouts, flush_interval=0.)
+        self.assertEqual(raw_data.shape[0], 50)
+        self.assertEqual(n_writes, 5)
+
+    def test_flush_due(self):
+        # The FifoReadout worker writes the batch while it gets no readouts
+        with tempfile.NamedTemporaryFile(suffix='.h5') as tmp:
+            with tb.open_file(tmp.name, mode='w') as h5_file:
+                raw_data_earray = h5_file.create_earray(h5_file.root, name='raw_data', atom=tb.UIntAtom(), shape=(0,))
+                meta_data_table = h5_file.create_table(h5_file.root, name='meta_data', description=meta_data_dtype)
+                data_writer = DataWriter(raw_data_earray, meta_data_table, flush_interval=0.05)
+                fifo_readout = FifoReadout(MockChip(MockFifo()), readout_interval=0.01, moving_average_time_period=0.1)
+                data_queue = Queue()
+                worker_thread = Thread(target=fifo_readout.worker, args=(lambda data_tuple: data_writer.add(data_tuple, 0), data_queue, data_writer.flush_due))
+                worker_thread.start()
+                fifo_readout._ring_buffer.write(np.arange(10, dtype=np.uint32))
+                data_queue.put(((fifo_readout._ring_buffer.commit(), 0., 1., 0, 0), [1]))
+                time.sleep(0.2)
+                self.assertEqual(data_writer.n_writes, 1)
+                self.assertEqual(raw_data_earray.nrows, 10)
+                data_queue.put(None)
+                worker_thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,73 +12,139 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 import numpy as np
-from basil.utils.BitLogic import BitLogic
+import tables as tb
 import logging
+import time
 from tqdm import tqdm
 import multiprocessing as mp
+import atexit
 from functools import partial
 from scipy.optimize import curve_fit
 from scipy.special import erf
+import numba
 from numba import njit, prange
 import math
 from six.moves import range
+from six.moves.queue import Queue
 import sys
+import tpx3.lut as lut
 
 logger = logging.getLogger('Analysis')
 
-_lfsr_4_lut = np.zeros((2 ** 4), dtype=np.uint16)
-_lfsr_10_lut = np.zeros((2 ** 10), dtype=np.uint16)
-_lfsr_14_lut = np.zeros((2 ** 14), dtype=np.uint16)
-_gray_14_lut = np.zeros((2 ** 14), dtype=np.uint16)
+_lfsr_4_lut = lut.lfsr_4_lut()
+_lfsr_10_lut = lut.lfsr_10_lut()
+_lfsr_14_lut = lut.lfsr_14_lut()
+_gray_14_lut = lut.gray_14_lut()
+
+# Maximum memory of the partial histograms of the threads in scurve_hist
+_max_partial_bytes = 512 * 1024 * 1024
+
+@njit(parallel = True, cache = True)
+def _scurve_hist(x, y, param_id, counter, n_params, n_partials):
+    n_hits = x.shape[0]
+    chunk = (n_hits + n_partials - 1) // n_partials
+
+    # Every thread histograms its chunk of the hits into its own partial histogram
+    partials = np.zeros((n_partials, 256*256, n_params), dtype=np.uint32)
+    for part in prange(n_partials):
+        for i in range(part * chunk, min((part + 1) * chunk, n_hits)):
+            partials[part, x[i]*256 + y[i], param_id[i]] += counter[i]
+    if n_partials == 1:
+        return partials[0]
+
+    # Sum the partial histograms pixel by pixel
+    scurves = np.zeros((256*256, n_params), dtype=np.uint32)
+    for pixel in prange(256*256):
+        for part in range(n_partials):
+            for p in range(n_params):
+                scurves[pixel, p] += partials[part, pixel, p]
+    return scurves
 
-@njit(parallel = True)
 def scurve_hist(hit_data, param_range):
-    scurves = np.zeros((256*256, len(param_range)), dtype=np.uint16)
-
-    for i in prange(hit_data.shape[0]):
-        x = hit_data['x'][i]
-        y = hit_data['y'][i]
-        p = hit_data['scan_param_id'][i]
-        c = hit_data['EventCounter'][i]
-        scurves[x*256+y,p] += c
+    '''
+        Sums the EventCounter of the hits per pixel and scan parameter id. The hits are histogrammed
+        in parallel into one partial histogram per thread, as far as they fit into _max_partial_bytes.
+    '''
+    n_params = len(param_range)
+    n_partials = min(numba.get_num_threads(), max(1, hit_data.shape[0] // 10000),
+                     max(1, _max_partial_bytes // (256 * 256 * max(n_params, 1) * 4)))
+    return _scurve_hist(hit_data['x'], hit_data['y'], hit_data['scan_param_id'], hit_data['EventCounter'], n_params, n_partials)
+
+@njit(parallel = True, cache = True)
+def _totcurve_hist(x, y, tot, n_parts):
+    n_hits = x.shape[0]
+    chunk = (n_hits + n_parts - 1) // n_parts
+    block = (256*256 + n_parts - 1) // n_parts
+
+    # Count the hits of every chunk for the pixel blocks of the threads
+    counts = np.zeros((n_parts, n_parts), dtype=np.int64)
+    for part in prange(n_parts):
+        for i in range(part * chunk, min((part + 1) * chunk, n_hits)):
+            counts[part, (x[i]*256 + y[i]) // block] += 1
+
+    # Sort the hits by pixel block, keeping the order of the hits within the blocks
+    offsets = np.zeros((n_parts, n_parts), dtype=np.int64)
+    starts = np.zeros(n_parts + 1, dtype=np.int64)
+    total = 0
+    for owner in range(n_parts):
+        starts[owner] = total
+        for part in range(n_parts):
+            offsets[part, owner] = total
+            total += counts[part, owner]
+    starts[n_parts] = total
+    order = np.empty(n_hits, dtype=np.int64)
+    for part in prange(n_parts):
+        position = offsets[part].copy()
+        for i in range(part * chunk, min((part + 1) * chunk, n_hits)):
+            owner = (x[i]*256 + y[i]) // block
+            order[position[owner]] = i
+            position[owner] += 1
+
+    # Every thread histograms the hits of its pixel block in the order they were taken
+    totcurves_means = np.zeros(256*256, dtype=np.uint32)
+    totcurves_hits = np.zeros(256*256, dtype=np.uint32)
+    for owner in prange(n_parts):
+        for k in range(starts[owner], starts[owner + 1]):
+            i = order[k]
+            pixel = x[i]*256 + y[i]
+            c = tot[i]
+            if totcurves_hits[pixel] == 0:
+                totcurves_means[pixel] += c
+            # Ignore charge injections from post-pulse oscillations (lower amplitude)
+            elif c > 0.5 * (totcurves_means[pixel] / totcurves_hits[pixel]):
+                totcurves_means[pixel] += c
+            totcurves_hits[pixel] += 1
 
-    return scurves
+    return totcurves_means, totcurves_hits
 
-@njit
 def totcurve_hist(hit_data):
-    totcurves_means = np.zeros(256*256, dtype=np.uint16)
-    totcurves_hits = np.zeros(256*256, dtype=np.uint16)
-
-    for i in range(hit_data.shape[0]):
-        x = hit_data['x'][i]
-        y = hit_data['y'][i]
-        c = hit_data['TOT'][i]
-        if totcurves_hits[x*256+y] == 0:
-            totcurves_means[x*256+y] += c
-        # Ignore charge injections from post-pulse oscillations (lower amplitude)
-        elif c > 0.5 * (totcurves_means[x*256+y] / totcurves_hits[x*256+y]):
-            totcurves_means[x*256+y] += c
-        totcurves_hits[x*256+y] += 1
+    '''
+        Sums the ToT of the hits per pixel and counts the hits. The sum depends on the order of the
+        hits of a pixel, so the threads histogram the hits of separate blocks of pixels.
+    '''
+    n_parts = min(numba.get_num_threads(), max(1, hit_data.shape[0] // 10000))
+    return _totcurve_hist(hit_data['x'], hit_data['y'], hit_data['TOT'], n_parts)
+
+@njit(cache=True)
+def _noise_pixel_count(x, y, param_id, counter, n_params, Vthreshold_start):
+    noise_curve_pixel = np.zeros(n_params + Vthreshold_start, dtype=np.uint16)
+    noise_curve_hits = np.zeros(n_params + Vthreshold_start, dtype=np.uint16)
+    pixel_list = np.zeros((256*256, Vthreshold_start + n_params), dtype=np.uint16)
+
+    for i in range(x.shape[0]):
+        p = param_id[i] + Vthreshold_start
+        if pixel_list[x[i] * 256 + y[i], p] == 0:
+            noise_curve_pixel[p] += 1
+            noise_curve_hits[p] += counter[i]
+        pixel_list[x[i] * 256 + y[i], p] += 1
 
-    return totcurves_means, totcurves_hits
+    return noise_curve_pixel, noise_curve_hits
 
-@njit
 def noise_pixel_count(hit_data, param_range, Vthreshold_start):
-    noise_curve_pixel = np.zeros(len(param_range) + Vthreshold_start, dtype=np.uint16)
-    noise_curve_hits = np.zeros(len(param_range) + Vthreshold_start, dtype=np.uint16)
-    pixel_list = np.zeros((256*256, Vthreshold_start + len(param_range)), dtype=np.uint16)
-
-    for i in range(hit_data.shape[0]):
-        x = hit_data['x'][i]
-        y = hit_data['y'][i]
-        c = hit_data['EventCounter'][i]
-        p = hit_data['scan_param_id'][i]
-        if pixel_list[x * 256 + y, p + Vthreshold_start] == 0:
-            noise_curve_pixel[p + Vthreshold_start] += 1
-            noise_curve_hits[p + Vthreshold_start] += c
-        pixel_list[x * 256 + y, p + Vthreshold_start] += 1
-
-    return noise_curve_pixel, noise_curve_hits
+    '''
+        Counts per threshold the active pixels and their hits
+    '''
+    return _noise_pixel_count(hit_data['x'], hit_data['y'], hit_data['scan_param_id'], hit_data['EventCounter'], len(param_range), Vthreshold_start)
 
 def Chi_square(x_values, y_values, sigma, function, function_parameters, chi_red = True):
 #This function calculates the chi² value for a given function and data input.
@@ -92,7 +158,7 @@ def Chi_square(x_values, y_values, sigma, function, function_parameters, chi_red
 		raise TypeError("Input chi_red needs to be boolean")
 	
 	if function.__defaults__ is not None:
-		needed_args = function.__code__.co_argcount - len(myfunction.__defaults__)
+		needed_args = function.__code__.co_argcount - len(function.__defaults__)
 	else:
 		needed_args = function.__code__.co_argcount
 	if (needed_args-1) != len(function_parameters):
@@ -108,47 +174,61 @@ def Chi_square(x_values, y_values, sigma, function, function_parameters, chi_red
 	else:
 		return chi2, degrees_of_freedome
 
+def chi2ndf(y, y_fit, yerr, n_params):
+    '''
+        chi2/ndf of the data y to the fitted values y_fit with the errors yerr, for all rows (one curve
+        per row) at once. Steps with y = nan are not counted, rows with ndf <= 0 get 0.
+    '''
+    y = np.asarray(y, dtype=float)
+    valid = ~np.isnan(y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = np.where(valid, ((y - y_fit) / yerr) ** 2, 0.).sum(axis=-1)
+    ndf = valid.sum(axis=-1) - n_params
+    return np.where(ndf > 0, chi2 / np.maximum(ndf, 1), 0.)
+
 
 def vths(scurves, param_range, Vthreshold_start):
-    vths = np.zeros((256, 256), dtype=np.uint16)
-    for x in range(256):
-        for y in range(256):
-            sum_of_hits = 0
-            weighted_sum_of_hits = 0
-            for i in range(len(param_range)):
-                sum_of_hits += scurves[x*256+y, i]
-                weighted_sum_of_hits += scurves[x*256+y, i] * i
-            if(sum_of_hits > 0):
-                vths[x, y] = Vthreshold_start + weighted_sum_of_hits / (sum_of_hits * 1.0)
-    return vths
+    '''
+        Threshold of every pixel as mean scan parameter of its hits, 0 for pixels without hits
+    '''
+    hits = np.asarray(scurves)[:, :len(param_range)].astype(np.int64)
+    sum_of_hits = hits.sum(axis=1)
+    weighted_sum_of_hits = hits.dot(np.arange(len(param_range)))
+    vths = np.zeros(256 * 256, dtype=np.uint16)
+    hit_pixels = sum_of_hits > 0
+    vths[hit_pixels] = Vthreshold_start + weighted_sum_of_hits[hit_pixels] / (sum_of_hits[hit_pixels] * 1.0)
+    return np.reshape(vths, (256, 256))
 
 def vth_hist(vths, Vthreshold_stop):
-    hist = np.zeros(Vthreshold_stop + 1, dtype=np.uint16)
-    for x in range(256):
-        for y in range(256):
-            if int(vths[x, y]) >= Vthreshold_stop:
-                logger.info("Scan for pixel %d / %d failed, calculated threshold = %f" % (x, y, vths[x,y]))
-            elif int(vths[x, y]) < 0:
-                logger.info("Scan for pixel %d / %d failed, calculated threshold = %f" % (x, y, vths[x,y]))
-            else:
-                hist[int(vths[x, y])] += 1
-    return hist
+    '''
+        Histogram of the thresholds of all pixels, pixels with a threshold below 0 or from
+        Vthreshold_stop on failed and are not counted
+    '''
+    thresholds = np.trunc(np.asarray(vths, dtype=float))
+    failed = ~(thresholds >= 0) | (thresholds >= Vthreshold_stop)
+    if np.any(failed):
+        logger.info("Scan for %d pixels failed, calculated threshold < 0 or >= %d" % (np.count_nonzero(failed), Vthreshold_stop))
+    return np.bincount(thresholds[~failed].astype(np.int64), minlength=Vthreshold_stop + 1).astype(np.uint16)
+
+def _first_per_pixel(values, data, out):
+    '''
+        Sets out for every pixel to the first value != 0 of its hits in data
+    '''
+    selection = np.flatnonzero(values != 0)
+    pixels = data['x'][selection].astype(np.int64) * 256 + data['y'][selection]
+    pixels, first = np.unique(pixels, return_index=True)
+    out.reshape(-1)[pixels] = values[selection[first]]
 
 def toas(data, mask):
     ftoas = np.zeros((256, 256), dtype=np.uint8)
     toas = np.zeros((256, 256), dtype=float)
     full_toa = np.zeros((256, 256), dtype=float)
     tots = np.zeros((256, 256), dtype=float)
-    for hit in data:
-        if ftoas[hit['x'], hit['y']] == 0:
-            ftoas[hit['x'], hit['y']] = hit['FTOA']
-        if toas[hit['x'], hit['y']] == 0:
-            toas[hit['x'], hit['y']] = (hit['TOA_Combined'] * 25) - (hit['Shutter_Timer'] * 1.5625)
-        if full_toa[hit['x'], hit['y']] == 0:
-            offset = (((hit['x'] - 2) // 2) % 16) * 1.5625
-            full_toa[hit['x'], hit['y']] = ((hit['TOA_Combined'] * 25) - (hit['FTOA'] * 1.5625) + offset) - (hit['Shutter_Timer'] * 1.5625)
-        if tots[hit['x'], hit['y']] == 0:
-            tots[hit['x'], hit['y']] = hit['TOT']
+    offset = (((data['x'] - 2) // 2) % 16) * 1.5625
+    _first_per_pixel(data['FTOA'], data, ftoas)
+    _first_per_pixel((data['TOA_Combined'] * 25) - (data['Shutter_Timer'] * 1.5625), data, toas)
+    _first_per_pixel(((data['TOA_Combined'] * 25) - (data['FTOA'] * 1.5625) + offset) - (data['Shutter_Timer'] * 1.5625), data, full_toa)
+    _first_per_pixel(data['TOT'], data, tots)
     toas[np.where(full_toa > 10000)] -= 409600
     full_toa[np.where(full_toa > 10000)] -= 409600
     full_toa[np.where(full_toa < 5000)] = np.nan
@@ -191,6 +271,7 @@ def pixeldac_opt(hist_th0, hist_th15, pixeldac, last_pixeldac, last_delta, Vthre
 
     return (new_pixeldac, delta, rms_delta)
 
+@njit(error_model='numpy', cache=True)
 def th_means(hist_th0, hist_th15, Vthreshold_start, Vthreshold_stop):
     sum_th0 = 0
     entries_th0 = 0.
@@ -222,11 +303,42 @@ def th_means(hist_th0, hist_th15, Vthreshold_start, Vthreshold_stop):
     return (mean_th0, mean_th15, rms_th0, rms_th15, delta, rms_delta)
 
 
-def _interpret_raw_data(data, op_mode = 0, vco = False, ToA_Extension = None):
-    data_type = {'names': ['data_header', 'header', 'hit_index', 'x',     'y',     'TOA',    'TOT',    'EventCounter', 'HitCounter', 'FTOA',  'scan_param_id', 'chunk_start_time', 'iTOT',   'TOA_Extension', 'TOA_Combined'],
-               'formats': ['uint8',       'uint8',  'uint64', 'uint8', 'uint8', 'uint16', 'uint16', 'uint16',       'uint8',      'uint8', 'uint16',        'float',            'uint16', 'uint64',        'uint64']}
+_hit_data_type = {'names': ['data_header', 'header', 'hit_index', 'x',     'y',     'TOA',    'TOT',    'EventCounter', 'HitCounter', 'FTOA',  'scan_param_id', 'chunk_start_time', 'iTOT',   'TOA_Extension', 'TOA_Combined'],
+                  'formats': ['uint8',       'uint8',  'uint64', 'uint8', 'uint8', 'uint16', 'uint16', 'uint16',       'uint8',      'uint8', 'uint16',        'float',            'uint16', 'uint64',        'uint64']}
+
+# Columns which are not filled by _interpret_raw_data but by the functions calling it
+_external_columns = ['hit_index', 'scan_param_id', 'chunk_start_time']
+
+def _op_mode_columns(op_mode, vco):
+    '''
+        Returns the hit_data columns which contain data in the given op_mode
+    '''
+    columns = ['data_header', 'header', 'x', 'y', 'FTOA' if vco else 'HitCounter', 'scan_param_id', 'chunk_start_time']
+    if op_mode == 0b00:
+        columns += ['TOA', 'TOT', 'TOA_Extension', 'TOA_Combined']
+    elif op_mode == 0b01:
+        columns += ['TOA', 'TOA_Extension', 'TOA_Combined']
+    else:
+        columns += ['EventCounter', 'iTOT']
+    return columns
 
-    pix_data = np.recarray((data.shape[0]), dtype=data_type)
+def _hit_data_dtype(columns=None):
+    '''
+        Returns the dtype of the hit_data with the given columns, by default all columns
+    '''
+    if columns is None:
+        return np.dtype(_hit_data_type)
+    names = [name for name in _hit_data_type['names'] if name in columns]
+    formats = [_hit_data_type['formats'][_hit_data_type['names'].index(name)] for name in names]
+    return np.dtype({'names': names, 'formats': formats})
+
+def _interpret_raw_data(data, op_mode = 0, vco = False, ToA_Extension = None, columns = None):
+    '''
+        Interprets the 48 bit data words. By default all columns are created, columns which are
+        not produced in the op_mode are set to zero. If columns is given only these columns are created.
+    '''
+    pix_data = np.recarray((data.shape[0]), dtype=_hit_data_dtype(columns))
+    names = pix_data.dtype.names
 
     n47 = np.uint64(47)
     n44 = np.uint64(44)
@@ -238,126 +350,136 @@ def _interpret_raw_data(data, op_mode = 0, vco = False, ToA_Extension = None):
     n3fff = np.uint64(0x3fff)
     nf = np.uint64(0xf)
 
-    pixel = (data >> n28) & np.uint64(0b111)
-    super_pixel = (data >> np.uint64(28 + 3)) & np.uint64(0x3f)
-    right_col = pixel > 3
-    eoc = (data >> np.uint64(28 + 9)) & np.uint64(0x7f)
-
-    pix_data['data_header'] = data >> n47
-    pix_data['header'] = data >> n44
-    pix_data['y'] = (super_pixel * 4) + (pixel - right_col * 4)
-    pix_data['x'] = eoc * 2 + right_col * 1
-    if(vco == False):
+    if 'data_header' in names:
+        pix_data['data_header'] = data >> n47
+    if 'header' in names:
+        pix_data['header'] = data >> n44
+    if 'x' in names or 'y' in names:
+        pixel = (data >> n28) & np.uint64(0b111)
+        super_pixel = (data >> np.uint64(28 + 3)) & np.uint64(0x3f)
+        right_col = pixel > 3
+        eoc = (data >> np.uint64(28 + 9)) & np.uint64(0x7f)
+        if 'y' in names:
+            pix_data['y'] = (super_pixel * 4) + (pixel - right_col * 4)
+        if 'x' in names:
+            pix_data['x'] = eoc * 2 + right_col * 1
+
+    produced = _op_mode_columns(op_mode, vco)
+    if 'HitCounter' in names and 'HitCounter' in produced:
         pix_data['HitCounter'] = _lfsr_4_lut[data & nf]
-        pix_data['FTOA'] = np.zeros(len(data))
-    else:
-        pix_data['HitCounter'] = np.zeros(len(data))
+    if 'FTOA' in names and 'FTOA' in produced:
         pix_data['FTOA'] = data & nf
 
     # ToA and ToT mode
-    if op_mode == 0b00:
-        pix_data['TOT'] = _lfsr_10_lut[(data >> n4) & n3ff]
-        pix_data['TOA'] = _gray_14_lut[(data >> n14) & n3fff]
-        pix_data['EventCounter'] = np.zeros(len(data))
-        if len(ToA_Extension):
-            pix_data['TOA_Extension'] = ToA_Extension & 0xFFFFFFFFFFFF # remove header marking it as timestamp
-            pix_data['TOA_Combined'] = (ToA_Extension & 0xFFFFFFFFC000) + pix_data['TOA']
-        else:
-            pix_data['TOA_Extension'] = np.zeros(len(data))
-            pix_data['TOA_Combined'] = np.zeros(len(data))
-    elif op_mode == 0b01: # ToA
-        pix_data['TOA'] = _gray_14_lut[(data >> n14) & n3fff]
-        pix_data['EventCounter'] = np.zeros(len(data))
-        pix_data['TOT'] = np.zeros(len(data))
+    if op_mode == 0b00 or op_mode == 0b01:
+        if 'TOT' in names and 'TOT' in produced:
+            pix_data['TOT'] = _lfsr_10_lut[(data >> n4) & n3ff]
+        if 'TOA' in names or 'TOA_Combined' in names:
+            toa = _gray_14_lut[(data >> n14) & n3fff]
+            if 'TOA' in names:
+                pix_data['TOA'] = toa
         if len(ToA_Extension):
-            pix_data['TOA_Extension'] = ToA_Extension & 0xFFFFFFFFFFFF # remove header marking it as timestamp
-            pix_data['TOA_Combined'] = (ToA_Extension & 0xFFFFFFFFC000) + pix_data['TOA']
+            if 'TOA_Extension' in names:
+                pix_data['TOA_Extension'] = ToA_Extension & 0xFFFFFFFFFFFF # remove header marking it as timestamp
+            if 'TOA_Combined' in names:
+                pix_data['TOA_Combined'] = (ToA_Extension & 0xFFFFFFFFC000) + toa
         else:
-            pix_data['TOA_Extension'] = np.zeros(len(data))
-            pix_data['TOA_Combined'] = np.zeros(len(data))
+            produced = [name for name in produced if name not in ['TOA_Extension', 'TOA_Combined']]
     else: # Event and iToT
-        pix_data['iTOT'] = _lfsr_14_lut[(data >> n14) & n3fff]
-        pix_data['EventCounter'] = _lfsr_10_lut[(data >> n4) & n3ff]
-        pix_data['TOT'] = np.zeros(len(data))
-        pix_data['TOA'] = np.zeros(len(data))
-        pix_data['TOA_Extension'] = np.zeros(len(data))
-        pix_data['TOA_Combined'] = np.zeros(len(data))
+        if 'iTOT' in names:
+            pix_data['iTOT'] = _lfsr_14_lut[(data >> n14) & n3fff]
+        if 'EventCounter' in names:
+            pix_data['EventCounter'] = _lfsr_10_lut[(data >> n4) & n3ff]
+
+    # Columns without data in the op_mode are zero
+    for name in names:
+        if name not in produced and name not in _external_columns:
+            pix_data[name] = 0
 
     return pix_data
 
-"""
-Corrects for missing packages in the raw_data of the data
-"""
-def save_and_correct(raw_data, indices):
-    # split into packages, which should be package0 and 1
-    package0 = raw_data[1::2]
-    package0 = (package0 & 0x01000000) >> 24
-    package1 = raw_data[0::2]
-    package1 = (package1 & 0x01000000) >> 24
-    # package 0 should have a 0 here, check where this is not the case
-    ones = np.where(package0 == 1)[0]
+# Actions of _package_action for the next package of a link
+_START_PAIR = 0
+_COMPLETE_PAIR = 1
+_DELETE_FIRST = 2
+_DELETE_CURRENT = 3
+_DELETE_PACKAGE0 = 4
+
+@njit(nogil=True, cache=True)
+def _package_action(word, error_flag, pending, has_pair, pending_word):
+    '''
+        Package correction of one link shared by all kernels which pair 32 bit link packages.
+        The second package of a pair must not have error_flag at bit 24. pending tells if a first
+        package (pending_word) waits for its partner, has_pair if there is a previous complete pair.
+        Returns the action for the next package word:
+        - _START_PAIR: word is the first package of a new pair
+        - _COMPLETE_PAIR: word completes the pair of the pending package
+        - _DELETE_FIRST: the pending package is deleted, word is the new pending package
+        - _DELETE_CURRENT: word is deleted, the pending package waits for its partner
+        - _DELETE_PACKAGE0: package 0 of the previous pair is deleted, the pending package is its
+          new package 0 and word is the new pending package
+    '''
+    n24 = np.uint64(24)
+    one = np.uint64(1)
+    flag = np.uint64(error_flag)
+    if not pending:
+        return _START_PAIR
+    if (np.uint64(word) >> n24) & one != flag:
+        return _COMPLETE_PAIR
     # found an error -> missing package somewhere
-    if len(ones) != 0:
-        first = ones[0]
-        # delete package belonging to the missing one
-        if first == 0:
-            raw_data = np.delete(raw_data, 0, axis = 0)
-            indices = np.delete(indices, 0, axis = 0)
-            #logger.info("Deleted package at index "+str(0))
-        elif package1[first] == 1:
-            raw_data = np.delete(raw_data, 2*first+1, axis = 0)
-            indices = np.delete(indices, 2*first+1, axis = 0)
-            #logger.info("Deleted package at index "+str(2*first+1))
-        else:
-            raw_data = np.delete(raw_data, 2*(first-1)+1, axis = 0)
-            indices = np.delete(indices, 2*(first-1)+1, axis = 0)
-            #logger.info("Deleted package at index "+str(2*(first-1)+1))
+    if not has_pair:
+        return _DELETE_FIRST
+    if (np.uint64(pending_word) >> n24) & one == flag:
+        return _DELETE_CURRENT
+    return _DELETE_PACKAGE0
+
+@njit(cache=True)
+def _correct_packages(raw_data, error_flag):
+    '''
+        Streaming resynchronisation of 32 bit package pairs. The second package of a pair
+        must not have error_flag at bit 24. Every gap is repaired in a single forward scan
+        by deleting one package, in the same way as the former recursive correction.
+
+        Returns the positions of the kept packages and the number of deleted packages.
+    '''
+    keep = np.empty(raw_data.shape[0], dtype=np.int64)
+    n_keep = 0
+    num = 0
+
+    for i in range(raw_data.shape[0]):
+        pending = n_keep % 2 == 1
+        pending_word = raw_data[keep[n_keep - 1]] if pending else raw_data[i]
+        action = _package_action(raw_data[i], error_flag, pending, n_keep > 1, pending_word)
+
+        if action == _START_PAIR or action == _COMPLETE_PAIR:
+            keep[n_keep] = i
+            n_keep += 1
+            continue
 
-        # call recursively until everything is as it should
-        raw_data, indices, num = save_and_correct(raw_data,indices)
         num += 1
-    # everything is fine, return
-    else:
-        num = 0
+        if action == _DELETE_FIRST:
+            keep[n_keep - 1] = i
+        elif action == _DELETE_PACKAGE0:
+            keep[n_keep - 2] = keep[n_keep - 1]
+            keep[n_keep - 1] = i
 
-    return raw_data, indices, num
+    return keep[:n_keep], num
+
+"""
+Corrects for missing packages in the raw_data of the data
+"""
+def save_and_correct(raw_data, indices):
+    # package 0 (every second package) should have a 0 at bit 24
+    keep, num = _correct_packages(raw_data, 1)
+    return raw_data[keep], indices[keep], num
 
 """
 Corrects for missing packages in the raw_data of the FPGA Timestamps
 """
 def save_and_correct_timer(raw_data, indices):
-    # split timer packages
-    package1 = raw_data[1::2]
-    package1 = (package1 & 0x01000000) >> 24
-    package0 = raw_data[0::2]
-    package0 = (package0 & 0x01000000) >> 24
-    #package1 should have a 1 at this position; find where this is not the case
-    ones = np.where(package1 == 0)[0]
-    # if we found an error: correct
-    if len(ones) != 0:
-        first = ones[0]
-        # delete the package that belongs to the missing package
-        if first == 0:
-            raw_data = np.delete(raw_data, 0, axis = 0)
-            indices = np.delete(indices, 0, axis = 0)
-            #logger.info("Deleted package at index "+str(0))
-        elif package0[first] == 0:
-            raw_data = np.delete(raw_data, 2*first+1, axis = 0)
-            indices = np.delete(indices, 2*first+1, axis = 0)
-            #logger.info("Deleted package at index "+str(2*first+1))
-        else:
-            raw_data = np.delete(raw_data, 2*(first-1)+1, axis = 0)
-            indices = np.delete(indices, 2*(first-1)+1, axis = 0)
-            #logger.info("Deleted package at index "+str(2*(first-1)+1))
-
-        # call recursively on the resulting new raw_data until everything is fine
-        raw_data, indices, num = save_and_correct_timer(raw_data,indices)
-        num += 1 # counting variable
-    #if everything is alright: wounderfull, return!
-    else:
-        num = 0
-
-    return raw_data, indices, num
+    # package 1 (every second package) should have a 1 at bit 24
+    keep, num = _correct_packages(raw_data, 0)
+    return raw_data[keep], indices[keep], num
 
 
 def raw_data_to_dut_old(raw_data, indices):
@@ -382,7 +504,156 @@ def raw_data_to_dut_old(raw_data, indices):
     package1 = raw_data[0::2]
     return data_words, indices, package0, package1, leftoverpackage
 
-def raw_data_to_dut(raw_data, last_timestamp, next_to_last_timestamp, chunk_nr=0, leftoverpackage=[]):
+@njit(cache=True)
+def _combine_link_words(package1, package0):
+    '''
+        Combines the two 32 bit link packages of one pixel hit to the 48 bit data word.
+        Identical to the '>u4' view based combination in raw_data_to_dut_old.
+    '''
+    n8 = np.uint64(8)
+    n16 = np.uint64(16)
+    n24 = np.uint64(24)
+    nff = np.uint64(0xff)
+    n24_mask = np.uint64(0xffffff)
+
+    k1 = np.uint64(package1) & n24_mask
+    k0 = np.uint64(package0) & n24_mask
+    # byte swap of the lower 24 bits of both packages
+    high = ((k0 & nff) << n24) | (((k0 >> n8) & nff) << n16) | (((k0 >> n16) & nff) << n8)
+    low = ((k1 & nff) << n16) | (((k1 >> n8) & nff) << n8) | ((k1 >> n16) & nff)
+    return (high << n16) + low
+
+
+@njit(cache=True)
+def _raw_data_to_words(raw_data, timestamps_combined, timestamps_combined_indices):
+    '''
+        Single pass demultiplexing of the 8 links and pairing of the 32 bit link packages.
+        Missing packages are corrected per link in the same way as _correct_packages does
+        it on the link-filtered data. The FPGA timestamps are put on their initial positions.
+
+        Returns the combined data words (in the order of their first package), the
+        corresponding package 0 and package 1 words, the number of packages, the number of
+        deleted packages and the left over package per link.
+    '''
+    links = 8
+    n = raw_data.shape[0]
+    n25 = np.uint64(25)
+
+    data_combined = np.zeros(n, dtype=np.uint64)
+    data0 = np.zeros(n, dtype=np.uint64)
+    data1 = np.zeros(n, dtype=np.uint64)
+
+    for i in range(timestamps_combined_indices.shape[0]):
+        data_combined[timestamps_combined_indices[i]] = timestamps_combined[i]
+
+    # State registers per link: the pending first package and the last complete pair,
+    # which might still be changed by the correction of the following pair
+    link_count = np.zeros(links, dtype=np.int64)
+    link_deleted = np.zeros(links, dtype=np.int64)
+    link_pairs = np.zeros(links, dtype=np.int64)
+    pending = np.zeros(links, dtype=np.bool_)
+    pending_word = np.zeros(links, dtype=np.uint64)
+    pending_index = np.zeros(links, dtype=np.int64)
+    last_index = np.zeros(links, dtype=np.int64)
+    last_word = np.zeros(links, dtype=np.uint64)
+
+    for i in range(n):
+        word = np.uint64(raw_data[i])
+        link = np.int64(word >> n25)
+        if link >= links:
+            continue
+        link_count[link] += 1
+
+        # package 0 of a pair should have a 0 at bit 24
+        action = _package_action(word, 1, pending[link], link_pairs[link] > 0, pending_word[link])
+        if action == _START_PAIR:
+            pending[link] = True
+            pending_word[link] = word
+            pending_index[link] = i
+        elif action == _COMPLETE_PAIR:
+            pending[link] = False
+            data_combined[pending_index[link]] = _combine_link_words(pending_word[link], word)
+            data0[pending_index[link]] = word
+            data1[pending_index[link]] = pending_word[link]
+            last_index[link] = pending_index[link]
+            last_word[link] = pending_word[link]
+            link_pairs[link] += 1
+        else:
+            link_deleted[link] += 1
+            if action == _DELETE_PACKAGE0:
+                data_combined[last_index[link]] = _combine_link_words(last_word[link], pending_word[link])
+                data0[last_index[link]] = pending_word[link]
+            if action != _DELETE_CURRENT:
+                pending_word[link] = word
+                pending_index[link] = i
+
+    leftover = np.zeros(links, dtype=np.uint32)
+    for link in range(links):
+        if pending[link]:
+            leftover[link] = np.uint32(pending_word[link])
+
+    # Remove array elements with no data - as all data is combined half of the array should be 0
+    n_words = 0
+    for i in range(n):
+        if data_combined[i] != 0:
+            n_words += 1
+    data_words = np.empty(n_words, dtype=np.uint64)
+    package0 = np.empty(n_words, dtype=np.uint64)
+    package1 = np.empty(n_words, dtype=np.uint64)
+    j = 0
+    for i in range(n):
+        if data_combined[i] != 0:
+            data_words[j] = data_combined[i]
+            package0[j] = data0[i]
+            package1[j] = data1[i]
+            j += 1
+
+    return data_words, package0, package1, link_count, link_deleted, pending, leftover
+
+
+def _link_data_to_dut(raw_data, timestamps_combined, timestamps_combined_indices, chunk_nr, leftoverpackage):
+    '''
+        Runs _raw_data_to_words and reports the per link corrections.
+        Left over packages are appended to leftoverpackage.
+    '''
+    data_words, data0, data1, link_count, link_deleted, pending, leftover = _raw_data_to_words(raw_data, timestamps_combined, timestamps_combined_indices)
+
+    for link in range(link_count.shape[0]):
+        if link_count[link] % 2 != 0:
+            logger.error("Missing one 32bit subword of the 2 link packages in link {}!".format(link)+" Chunk nr. "+str(chunk_nr)+ ", length "+str(link_count[link])+" correcting...")
+        if link_deleted[link] != 0:
+            logger.info("Deleted "+str(link_deleted[link])+" link packages!")
+        if pending[link]:
+            leftoverpackage.append(leftover[link])
+            logger.info("One link package left over at the end! Try to integrate in next chunk...")
+
+    return data_words, data0, data1
+
+
+def _log_delayed_hits(hits, data0, data1, hit_timestamps, n_extensions, chunk_nr):
+    '''
+        Logs all hits which are shifted by more than 1 with respect to the extension of their fpga timestamp
+    '''
+    toa = _gray_14_lut[(hits >> 14) & 0x3fff]
+    diff = ((toa & 0x3000) >> 12).astype(np.int64) - ((hit_timestamps & 0x3000) >> 12).astype(np.int64)
+    for i in np.where(~np.isin(diff, [-1, 0, 3]))[0]:
+        data = int(hits[i])
+        pixel = (data >> 28) & 0b111
+        super_pixel = (data >> 31) & 0x3f
+        right_col = pixel > 3
+        eoc = (data >> 37) & 0x7f
+
+        y = (super_pixel * 4) + (pixel - right_col * 4)
+        x = eoc * 2 + right_col * 1
+        logger.info("Chunk length: "+str(n_extensions))
+        logger.info("Found Hit, that is delayed by more than 1 w.r.t. the extension, i.e. by "+str(diff[i])+" Chunk nr. "+str(chunk_nr))
+        logger.info("Information to this hit: ToA="+str(toa[i])+", ToT="+str(_lfsr_10_lut[(data >> 4) & 0x3ff])+", x="+str(x)+", y="+str(y))
+        logger.info("Paket 0: "+bin(int(data0[i]) & 0x1ffffff))
+        logger.info("Paket 1: "+bin(int(data1[i]) & 0x1ffffff))
+
+def raw_data_to_dut(raw_data, last_timestamp, next_to_last_timestamp, chunk_nr=0, leftoverpackage=None, debug=False):
+    if leftoverpackage is None:
+        leftoverpackage = []
     # reintegrate leftover package if present
     if len(leftoverpackage):
         logger.info("Integrate package(s) in chunk nr. "+str(chunk_nr))
@@ -390,12 +661,6 @@ def raw_data_to_dut(raw_data, last_timestamp, next_to_last_timestamp, chunk_nr=0
             raw_data = np.insert(raw_data,0,leftoverpackage[m],axis= 0)
         leftoverpackage = []
 
-    # make arrays for results and debugging values
-    data_combined = np.zeros(raw_data.shape[0], dtype=np.uint64)
-    index_combined = np.zeros(raw_data.shape[0], dtype=np.uint64)
-    data0 = np.zeros(raw_data.shape[0], dtype=np.uint64)
-    data1 = np.zeros(raw_data.shape[0], dtype=np.uint64)
-
     # Get FPGA Timestamps and combine them to the full 48 bit timestamp
     timestamp_filter = (raw_data & 0xF0000000) >> 28 == 0b0101
 
@@ -406,12 +671,9 @@ def raw_data_to_dut(raw_data, last_timestamp, next_to_last_timestamp, chunk_nr=0
         if len(timestamps_raw)%2!=0:
             logger.error("Missing one 32bit subword of the 2 timer packages! Chunk nr. "+str(chunk_nr)+", chunk length = "+str(len(timestamps_raw)))
 
-            try:
-                timestamps_raw, timestamps_indices, num = save_and_correct_timer(timestamps_raw, timestamps_indices)
-                if num != 0:
-                    logger.info("Deleted "+str(num)+" timer packages!")
-            except RecursionError:
-                logger.error("Unable to correct the timestamp data of chunk nr. "+str(chunk_nr))
+            timestamps_raw, timestamps_indices, num = save_and_correct_timer(timestamps_raw, timestamps_indices)
+            if num != 0:
+                logger.info("Deleted "+str(num)+" timer packages!")
             if len(timestamps_raw) % 2 != 0:
                 leftoverpackage.append(timestamps_raw[-1])
                 timestamps_raw = timestamps_raw[:-1]
@@ -431,172 +693,49 @@ def raw_data_to_dut(raw_data, last_timestamp, next_to_last_timestamp, chunk_nr=0
             timestamps_combined = timestamps_combined | 0b0101 << 48
             timestamps_combined_indices = timestamps_indices[0::2]
 
-        # Put the FPGA timestamps in a new array on their initial positions
-        np.put(data_combined, timestamps_combined_indices, timestamps_combined)
-        np.put(index_combined, timestamps_combined_indices, timestamps_combined_indices)
+        # Put the FPGA timestamps and the combined chip data on their initial positions
+        data_combined, data0, data1 = _link_data_to_dut(raw_data, timestamps_combined, timestamps_combined_indices, chunk_nr, leftoverpackage)
 
-        links = 8
-        chunk_len = 0
-        # Get link-sorted data packages and combine the 32 bit words
-        for link in range(links):
-            link_filter = (raw_data & 0xfe000000) >> 25 == link
-            chunk_len+=np.sum(link_filter)
-            if np.sum(link_filter) == 0:
-                continue
-            if np.sum(link_filter) % 2 != 0:
-                logger.error("Missing one 32bit subword of the 2 link packages in link {}!".format(link)+" Chunk nr. "+str(chunk_nr)+ ", length "+str(np.sum(link_filter))+" correcting...")
-                #logger.info("len(link_filter) before correction: "+str(len(link_filter)))
-                #continue
-            link_raw_data = raw_data[link_filter]
-            link_indices = np.where(link_filter)[0]
-            link_combined,link_indices,package0,package1,leftoverpackage_pot = raw_data_to_dut_old(link_raw_data,link_indices)
-            if leftoverpackage_pot!=None:
-                leftoverpackage.append(leftoverpackage_pot)
-            #if len(link_filter) % 2 != 0:
-                #logger.info("len after correction: ",len(link_combined)*2)
-            if len(link_indices) % 2 != 0:
-                logger.error("Missing one 32bit subword of the 2 link packages in link {}!".format(link)+" Chunk nr. "+str(chunk_nr)+" after correction.")
-                continue
-            link_combined_indices = link_indices[0::2]
-            link_combined_indices2 = link_indices[1::2]
-            # Put the chip data in the new array on their initial positions
-            np.put(data_combined, link_combined_indices, link_combined)
-            np.put(data0, link_combined_indices, package0)
-            np.put(data1, link_combined_indices, package1)
-
-        # Delete array elements with no data - as all data is combined half of the array should be 0
-        data0 = np.delete(data0, data_combined == 0)
-        data1 = np.delete(data1, data_combined == 0)
-        data_combined = np.delete(data_combined, data_combined == 0)
-
-        # Split the array into smaller arrays starting with a fpga timestamp
+        # Separate the fpga timestamps from the chip data
         timestamp_combined_filter = (data_combined & 0xF000000000000) >> 48 == 0b0101
         timestamp_combined_indices = np.where(timestamp_combined_filter)[0]
-
-        # to create an additional empty array element in timestamp_splits at the beginning, for insertion of last timestamps
-        try:
-            if timestamp_combined_indices[0] != 0:
-                timestamp_combined_indices = np.insert(timestamp_combined_indices,0,0,axis= 0)
-        except IndexError:
-            pass
-
-        #timestamp_splits = np.zeros(timestamp_combined_filter.shape[0], dtype='object')
-        timestamp_splits = np.split(data_combined, timestamp_combined_indices)
-        data0_splits = np.split(data0, timestamp_combined_indices)
-        data1_splits = np.split(data1, timestamp_combined_indices)
-
-        # attach last and next to last_timestamp if necessary
-        minus = 0
-        if len(timestamp_splits) > 1 and len(timestamp_splits[1]) > 0 and ((int(timestamp_splits[1][0]) & 0xF000000000000) >> 48 != 0b0101):
-            timestamp_splits[1] = np.insert(timestamp_splits[1],0,np.uint64(last_timestamp),axis=0)
-            timestamp_splits[0] = np.insert(timestamp_splits[0],0,next_to_last_timestamp,axis=0)
-            data0_splits[1] = np.insert(data0_splits[1],0,0,axis=0)
-            data0_splits[0] = np.insert(data0_splits[0],0,0,axis=0)
-            data1_splits[1] = np.insert(data1_splits[1],0,0,axis=0)
-            data1_splits[0] = np.insert(data1_splits[0],0,0,axis=0)
-            minus = 2
+        hit_indices = np.where(~timestamp_combined_filter)[0]
+        hits = data_combined[hit_indices]
+
+        # The extensions start with the timestamp(s) of the previous chunk: hits before the first fpga
+        # timestamp belong to the last timestamp. In this case the next to last timestamp is added as well,
+        # so that hits of the first extension can still be moved to the previous one
+        if len(timestamp_combined_indices) and timestamp_combined_indices[0] != 0:
+            previous_timestamps = np.array([next_to_last_timestamp, last_timestamp], dtype=np.uint64)
         else:
-            # only insert last timestamp
-            timestamp_splits[0] = np.insert(timestamp_splits[0],0,last_timestamp,axis=0)
-            data0_splits[0] = np.insert(data0_splits[0],0,0,axis=0)
-            data1_splits[0] = np.insert(data1_splits[0],0,0,axis=0)
-            minus = 1
+            previous_timestamps = np.array([last_timestamp], dtype=np.uint64)
+        extension_timestamps = np.concatenate((previous_timestamps, data_combined[timestamp_combined_indices]))
+        extension = np.searchsorted(timestamp_combined_indices, hit_indices, side='right') + len(previous_timestamps) - 1
 
         # Check for packages that are shifted by more than 1 wrt the extension. Keep for future debugging
-        num = 0
-        wrong_hits = 0
-        for j in range(len(timestamp_splits)):
-            for l in range(1,len(timestamp_splits[j])):
-                if timestamp_splits[j][l]!=0:
-                    if not int((((int(timestamp_splits[j][0]) & 0x3000) >> 12) - ((int(_gray_14_lut[(int(timestamp_splits[j][l]) >> 14) & 0x3fff]) & 0x3000) >> 12))) in [1,0,-3]:
-                        print("Chunk length: ",len(timestamp_splits)-1)
-                        diff = int(-(((int(timestamp_splits[j][0]) & 0x3000) >> 12) - ((int(_gray_14_lut[(int(timestamp_splits[j][l]) >> 14) & 0x3fff]) & 0x3000) >> 12)))
-                        #diff = (diff+3)%3
-                        data = int(timestamp_splits[j][l])
-                        pixel = (data >> 28) & 0b111
-                        super_pixel = (data >> 31) & 0x3f
-                        right_col = pixel > 3
-                        eoc = (data >> 37) & 0x7f
-
-                        y = (super_pixel * 4) + (pixel - right_col * 4)
-                        x = eoc * 2 + right_col * 1
-                        logger.info("Found Hit, that is delayed by more than 1 w.r.t. the extension, i.e. by "+str(diff)+" Chunk nr. "+str(chunk_nr))
-                        logger.info("Information to this hit: ToA="+str(_gray_14_lut[(int(timestamp_splits[j][l]) >> 14) & 0x3fff])+", ToT="+str(_lfsr_10_lut[(int(timestamp_splits[j][l]) >> 4) & 0x3ff])+", x="+str(x)+", y="+str(y))
-                        logger.info("Paket 0: "+bin(int(data0_splits[j][l]) & 0x1ffffff))
-                        logger.info("Paket 1: "+bin(int(data1_splits[j][l]) & 0x1ffffff))
-                        wrong_hits += 1
-            num += len(timestamp_splits[j])
-
-        # Iterate over the smaller arrays and put chip data with wrong fpga overlap in the previous array
-        #for i in range(len(timestamp_splits)-1,0,-1):
-        for i in range(1,len(timestamp_splits)):
-            if len(timestamp_splits[i]) < 2:
-                continue
-            iteration_toas = timestamp_splits[i][1:]
-            old_toa_filter = (((int(timestamp_splits[i][0]) & 0x3000) >> 12) != ((_gray_14_lut[(iteration_toas >> 14) & 0x3fff] & 0x3000) >> 12))
-            if sum(old_toa_filter) == 0:
-                continue
-            old_toas = iteration_toas[old_toa_filter]
-            old_toas_indices = np.where(old_toa_filter)[0]
-            timestamp_splits[i-1] = np.append(timestamp_splits[i-1], old_toas)
-            timestamp_splits[i] = np.delete(timestamp_splits[i], old_toas_indices+1)
+        if debug:
+            _log_delayed_hits(hits, data0[hit_indices], data1[hit_indices], extension_timestamps[extension], len(extension_timestamps) - 1, chunk_nr)
 
-        try:
-            last = timestamp_splits[-1][0]
-        except IndexError:
-            last = 0
-        try:
-            nlast = timestamp_splits[-2][0]
-        except IndexError:
-            nlast = 0
+        # Put chip data with wrong fpga overlap in the previous extension, behind the chip data of this extension
+        old_toa_filter = (extension > 0) & (((extension_timestamps[extension] & 0x3000) >> 12) != ((_gray_14_lut[(hits >> 14) & 0x3fff] & 0x3000) >> 12))
+        extension = extension - old_toa_filter
+        order = np.argsort(2 * extension + old_toa_filter, kind='stable')
 
-        # Delete all arrays which only contain a fpga [timestamp]
-        output = list(filter(lambda x: len(x) > 1 , timestamp_splits))
+        last = extension_timestamps[-1]
+        if len(extension_timestamps) > 1:
+            nlast = extension_timestamps[-2]
+        else:
+            nlast = 0
 
-        if len(output) == 0:
+        if len(hits) == 0:
             return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64), 0, 0, []
 
-        timestamps = np.concatenate([np.full((len(el)-1),el[0],dtype=np.uint64) for el in output])
-        data_words = np.concatenate([el[1:] for el in output])
-
-        """if wrong_hits/len(data_words) > 0.2:
-            logger.error("Removed Chunk nr. "+str(chunk_nr)+" from data due to too many irregularities.")
-            return np.empty(0,dtype=np.uint64),np.empty(0,dtype=np.uint64),last,nlast"""
+        timestamps = extension_timestamps[extension[order]]
+        data_words = hits[order]
 
     else:
-        links = 8
-        chunk_len = 0
         # Get link-sorted data packages and combine the 32 bit words
-        for link in range(links):
-            link_filter = (raw_data & 0xfe000000) >> 25 == link
-            chunk_len+=np.sum(link_filter)
-            if np.sum(link_filter) == 0:
-                continue
-            if np.sum(link_filter) % 2 != 0:
-                logger.error("Missing one 32bit subword of the 2 link packages in link {}!".format(link)+" Chunk nr. "+str(chunk_nr)+ ", length "+str(np.sum(link_filter))+" correcting...")
-                #logger.info("len(link_filter) before correction: "+str(len(link_filter)))
-                #continue
-            link_raw_data = raw_data[link_filter]
-            link_indices = np.where(link_filter)[0]
-            link_combined,link_indices,package0,package1,leftoverpackage_pot = raw_data_to_dut_old(link_raw_data,link_indices)
-            if leftoverpackage_pot!=None:
-                leftoverpackage.append(leftoverpackage_pot)
-            #if len(link_filter) % 2 != 0:
-                #logger.info("len after correction: ",len(link_combined)*2)
-            if len(link_indices) % 2 != 0:
-                logger.error("Missing one 32bit subword of the 2 link packages in link {}!".format(link)+" Chunk nr. "+str(chunk_nr)+" after correction.")
-                continue
-            link_combined_indices = link_indices[0::2]
-            link_combined_indices2 = link_indices[1::2]
-            # Put the chip data in the new array on their initial positions
-            np.put(data_combined, link_combined_indices, link_combined)
-            np.put(data0, link_combined_indices, package0)
-            np.put(data1, link_combined_indices, package1)
-
-        # Delete array elements with no data - as all data is combined half of the array should be 0
-        data0 = np.delete(data0, data_combined == 0)
-        data1 = np.delete(data1, data_combined == 0)
-        data_combined = np.delete(data_combined, data_combined == 0)
+        data_combined, data0, data1 = _link_data_to_dut(raw_data, np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64), chunk_nr, leftoverpackage)
 
         data_words = data_combined
         timestamps = np.empty(0,dtype=np.uint64)
@@ -606,11 +745,143 @@ def raw_data_to_dut(raw_data, last_timestamp, next_to_last_timestamp, chunk_nr=0
 
     return data_words, timestamps, last, nlast, leftoverpackage
 
-def interpret_raw_data(raw_data, op_mode, vco, meta_data=[], chunk_start_time=None, split_fine=False, last_timestamp = 0, next_to_last_timestamp = 0, intern =False, chunk_nr = 0, leftoverpackage = [], progress = None):
+def _concatenate_chunks(chunks):
+    '''
+        Concatenates the interpreted data of all chunks at once instead of growing the
+        result chunk by chunk. Empty chunks are skipped; if all chunks are empty the last
+        one is returned and if there are no chunks an empty list.
+    '''
+    if not len(chunks):
+        return []
+    filled = [chunk for chunk in chunks if len(chunk)]
+    if not len(filled):
+        return chunks[-1]
+    if len(filled) == 1:
+        return filled[0]
+    return np.concatenate(filled)
+
+def _chunk_bounds(meta_data, split_fine, start=0):
+    '''
+        Returns the chunks in which interpret_raw_data splits a run as list of (index_start, index_stop, chunk_nr)
+        and the scan_param_id (split_fine=False) or timestamp_start (split_fine=True) of each chunk.
+        start is the index of the first raw data word of the run.
+    '''
+    if split_fine:
+        rows = np.where(meta_data['index_start'] < meta_data['index_stop'])[0]
+        bounds = [(int(meta_data['index_start'][l]), int(meta_data['index_stop'][l]), int(l)) for l in rows]
+        return bounds, meta_data['timestamp_start'][rows]
+
+    # the chunks end with the last row of each scan_param_id
+    param, index = np.unique(meta_data['scan_param_id'], return_index=True)
+    stops = meta_data['index_stop'][np.append(index[1:], meta_data.shape[0]) - 1]
+    starts = np.append(start, stops[:-1])
+    return [(int(index_start), int(index_stop), 0) for index_start, index_stop in zip(starts, stops)], param
+
+def _interpret_chunk(raw_data, op_mode, vco, split_fine, chunk_nr, state, debug, columns=None):
+    '''
+        Interprets one chunk of a run with meta data like interpret_raw_data. The state is the tuple
+        (last_timestamp, next_to_last_timestamp, leftoverpackage) after the previous chunk.
+    '''
+    last_timestamp, next_to_last_timestamp, leftoverpackage = state
+    int_pix_data, last_timestamp, next_to_last_timestamp, leftoverpackage = interpret_raw_data(raw_data, op_mode, vco, last_timestamp = last_timestamp, next_to_last_timestamp = next_to_last_timestamp, intern = True, chunk_nr = chunk_nr, leftoverpackage = list(leftoverpackage), debug = debug, columns = columns)
+    return int_pix_data, (last_timestamp, next_to_last_timestamp, leftoverpackage)
+
+def _equal_state(state, other):
+    '''
+        Compares two states of _interpret_chunk
+    '''
+    return (int(state[0]) == int(other[0]) and int(state[1]) == int(other[1]) and
+            [int(package) for package in state[2]] == [int(package) for package in other[2]])
+
+def _interpret_block(args):
+    '''
+        Worker of _interpret_chunks_parallel: interprets the warmup chunks to estimate the state
+        at the beginning of the block and afterwards all chunks of the block. Returns the estimated
+        state, the interpreted chunks and the state after each chunk.
+    '''
+    raw_data, bounds, n_warmup, op_mode, vco, split_fine, debug, columns = args
+    state = (0, 0, [])
+    for start, stop, chunk_nr in bounds[:n_warmup]:
+        _, state = _interpret_chunk(raw_data[start:stop], op_mode, vco, split_fine, chunk_nr, state, debug, columns)
+    start_state = state
+
+    chunks = []
+    states = []
+    for start, stop, chunk_nr in bounds[n_warmup:]:
+        int_pix_data, state = _interpret_chunk(raw_data[start:stop], op_mode, vco, split_fine, chunk_nr, state, debug, columns)
+        chunks.append(int_pix_data)
+        states.append(state)
+    return start_state, chunks, states
+
+def _interpret_chunks_parallel(raw_data, bounds, op_mode, vco, split_fine, state, n_processes=None, progress=None, debug=False, columns=None, n_warmup=4, pool=None):
+    '''
+        Interprets the chunks given by bounds (list of index_start, index_stop, chunk_nr) on a process pool.
+        The chunks are distributed in consecutive blocks and each worker estimates the state at the beginning
+        of its block from the n_warmup chunks before it. The blocks are stitched together in order: as long
+        as the state of the previous block differs from the estimated one, the chunks are interpreted again,
+        so the result is identical to the sequential interpretation.
+        With pool the given process pool is used, otherwise a pool with n_processes is spawned.
+        Returns the list of interpreted chunks and the state after the last chunk.
+    '''
+    if not len(bounds):
+        return [], state
+    if n_processes is None:
+        n_processes = mp.cpu_count()
+    n_blocks = min(len(bounds), 4 * n_processes)
+    edges = np.linspace(0, len(bounds), n_blocks + 1).astype(int)
+
+    def tasks():
+        for block in range(n_blocks):
+            warmup = min(n_warmup, edges[block])
+            block_bounds = bounds[edges[block] - warmup:edges[block + 1]]
+            offset = min(start for start, _, _ in block_bounds)
+            end = max(stop for _, stop, _ in block_bounds)
+            yield (raw_data[offset:end], [(start - offset, stop - offset, chunk_nr) for start, stop, chunk_nr in block_bounds],
+                   warmup, op_mode, vco, split_fine, debug, columns)
+
+    if progress == None:
+        pbar = tqdm(total = len(bounds))
+
+    # Spawned processes, as forked ones can hang after numba parallel kernels (TBB is not fork safe)
+    p = mp.get_context('spawn').Pool(n_processes) if pool is None else pool
+    chunks = []
+    try:
+        for block, (start_state, block_chunks, block_states) in enumerate(p.imap(_interpret_block, tasks())):
+            block_bounds = bounds[edges[block]:edges[block + 1]]
+            i = 0
+            # interpret chunks again until the state converges to the one of the worker
+            while i < len(block_bounds) and not _equal_state(state, start_state if i == 0 else block_states[i - 1]):
+                start, stop, chunk_nr = block_bounds[i]
+                block_chunks[i], state = _interpret_chunk(raw_data[start:stop], op_mode, vco, split_fine, chunk_nr, state, debug, columns)
+                i += 1
+            if i < len(block_bounds):
+                state = block_states[-1]
+            chunks.extend(block_chunks)
+
+            if progress == None:
+                pbar.update(len(block_bounds))
+            else:
+                progress.put(edges[block + 1] / len(bounds))
+    finally:
+        if pool is None:
+            p.terminate()
+            p.join()
+
+    if progress == None:
+        pbar.close()
+
+    return chunks, state
+
+def interpret_raw_data(raw_data, op_mode, vco, meta_data=[], chunk_start_time=None, split_fine=False, last_timestamp = 0, next_to_last_timestamp = 0, intern =False, chunk_nr = 0, leftoverpackage = None, progress = None, debug = False, n_processes = 1, columns = None, pool = None):
     '''
-    Chunk the data based on scan_param and interpret
+    Chunk the data based on scan_param and interpret. With n_processes != 1 the chunks are
+    interpreted on a process pool (None: one process per CPU core), with pool on the given
+    process pool. With columns only the given hit_data columns are created.
     '''
     ret = []
+    chunks = []
+    if leftoverpackage is None:
+        leftoverpackage = []
 
     if len(meta_data):
         # standard case: only split into bunches which have the same param_id
@@ -627,34 +898,53 @@ def interpret_raw_data(raw_data, op_mode, vco, meta_data=[], chunk_start_time=No
             index = index - 1
             # make list of the entries in 'index_stop' at the positions stored in index
             stops = meta_data['index_stop'][index]
-            # split raw_data according to these positions into sets that all consist of entries which belong to one scan_id
-            split = np.split(raw_data, stops)
-            # remove the last element (WHY?) and process each chunk individually
-            if progress == None:
-                pbar = tqdm(total = len(split[:-1]))
+            if n_processes != 1 or pool is not None:
+                # interpret the chunks on a process pool
+                bounds, _ = _chunk_bounds(meta_data, False)
+                int_pix_data_list, state = _interpret_chunks_parallel(raw_data, bounds, op_mode, vco, False, (last_timestamp, next_to_last_timestamp, leftoverpackage), n_processes, progress, debug, columns, pool=pool)
+                last_timestamp, next_to_last_timestamp, leftoverpackage = state
+                for i, int_pix_data in enumerate(int_pix_data_list):
+                    if 'scan_param_id' in int_pix_data.dtype.names:
+                        int_pix_data['scan_param_id'][:] = param[i]
+                    chunks.append(int_pix_data)
             else:
-                step_counter = 0
-            for i in range(len(split[:-1])):
-                # print param[i], stops[i], len(split[i]), split[i]
-                # sends split[i] (i.e. part of data that is currently treated) recursively
-                # to this function. Get pixel_data back (splitted in a readable way, not packages any more)
-                int_pix_data, last_timestamp, next_to_last_timestamp, leftoverpackage = interpret_raw_data(split[i], op_mode, vco, last_timestamp = last_timestamp, intern = True)
-                # reattach param_id TODO: good idea to also give timestamp here!
-                int_pix_data['scan_param_id'][:] = param[i]
-                # append data we got back to return array or create new if this is the fist bunch of data treated
-                if len(ret):
-                    ret = np.hstack((ret, int_pix_data))
-                else:
-                    ret = int_pix_data
+                # split raw_data according to these positions into sets that all consist of entries which belong to one scan_id
+                split = np.split(raw_data, stops)
+                # remove the last element (WHY?) and process each chunk individually
                 if progress == None:
-                    pbar.update(1)
+                    pbar = tqdm(total = len(split[:-1]))
                 else:
-                    step_counter += 1
-                    fraction = step_counter / (len(split[:-1]))
-                    progress.put(fraction)
-            if progress == None:
-                pbar.close()
+                    step_counter = 0
+                for i in range(len(split[:-1])):
+                    # print param[i], stops[i], len(split[i]), split[i]
+                    # sends split[i] (i.e. part of data that is currently treated) recursively
+                    # to this function. Get pixel_data back (splitted in a readable way, not packages any more)
+                    # the timestamps and the left over link packages are carried over to the next scan parameter
+                    int_pix_data, last_timestamp, next_to_last_timestamp, leftoverpackage = interpret_raw_data(split[i], op_mode, vco, last_timestamp = last_timestamp, next_to_last_timestamp = next_to_last_timestamp, intern = True, leftoverpackage = leftoverpackage, debug = debug, columns = columns)
+                    # reattach param_id TODO: good idea to also give timestamp here!
+                    if 'scan_param_id' in int_pix_data.dtype.names:
+                        int_pix_data['scan_param_id'][:] = param[i]
+                    # collect the data we got back, it is concatenated once all bunches are treated
+                    chunks.append(int_pix_data)
+                    if progress == None:
+                        pbar.update(1)
+                    else:
+                        step_counter += 1
+                        fraction = step_counter / (len(split[:-1]))
+                        progress.put(fraction)
+                if progress == None:
+                    pbar.close()
         # case used for clustering: split further into the time frames defined through one row in meta_data
+        elif n_processes != 1 or pool is not None:
+            # interpret the chunks on a process pool
+            bounds, timestamp_start = _chunk_bounds(meta_data, True)
+            int_pix_data_list, state = _interpret_chunks_parallel(raw_data, bounds, op_mode, vco, True, (last_timestamp, next_to_last_timestamp, leftoverpackage), n_processes, progress, debug, columns, pool=pool)
+            last_timestamp, next_to_last_timestamp, leftoverpackage = state
+            for i, int_pix_data in enumerate(int_pix_data_list):
+                # reattach timestamp
+                if 'chunk_start_time' in int_pix_data.dtype.names:
+                    int_pix_data['chunk_start_time'][:] = timestamp_start[i]
+                chunks.append(int_pix_data)
         else:
             if progress == None:
                 pbar = tqdm(total = meta_data.shape[0])
@@ -664,14 +954,12 @@ def interpret_raw_data(raw_data, op_mode, vco, meta_data=[], chunk_start_time=No
                 index_start = meta_data['index_start'][l]
                 index_stop = meta_data['index_stop'][l]
                 if index_start<index_stop:
-                    int_pix_data, last_timestamp, next_to_last_timestamp, leftoverpackage = interpret_raw_data(raw_data[index_start:index_stop], op_mode, vco, last_timestamp = last_timestamp, next_to_last_timestamp = next_to_last_timestamp, intern = True, chunk_nr = l, leftoverpackage = leftoverpackage)
+                    int_pix_data, last_timestamp, next_to_last_timestamp, leftoverpackage = interpret_raw_data(raw_data[index_start:index_stop], op_mode, vco, last_timestamp = last_timestamp, next_to_last_timestamp = next_to_last_timestamp, intern = True, chunk_nr = l, leftoverpackage = leftoverpackage, debug = debug, columns = columns)
                     # reattach timestamp
-                    int_pix_data['chunk_start_time'][:] = meta_data['timestamp_start'][l]
-                    # append data we got back to return array or create new if this is the fist bunch of data treated
-                    if len(ret):
-                        ret = np.hstack((ret, int_pix_data))
-                    else:
-                        ret = int_pix_data
+                    if 'chunk_start_time' in int_pix_data.dtype.names:
+                        int_pix_data['chunk_start_time'][:] = meta_data['timestamp_start'][l]
+                    # collect the data we got back, it is concatenated once all bunches are treated
+                    chunks.append(int_pix_data)
                     if progress == None:
                         pbar.update(1)
                     else:
@@ -680,96 +968,278 @@ def interpret_raw_data(raw_data, op_mode, vco, meta_data=[], chunk_start_time=No
                         progress.put(fraction)
             if progress == None:
                 pbar.close()
+
+        ret = _concatenate_chunks(chunks)
     else:
-        #it can be chunked and multithreaded here
-        data_words, timestamp, last_timestamp, next_to_last_timestamp,leftoverpackage  = raw_data_to_dut(raw_data, last_timestamp, next_to_last_timestamp, chunk_nr = chunk_nr, leftoverpackage=leftoverpackage)
-        ret = _interpret_raw_data(data_words, op_mode, vco, timestamp)
+        data_words, timestamp, last_timestamp, next_to_last_timestamp,leftoverpackage  = raw_data_to_dut(raw_data, last_timestamp, next_to_last_timestamp, chunk_nr = chunk_nr, leftoverpackage=leftoverpackage, debug = debug)
+        ret = _interpret_raw_data(data_words, op_mode, vco, timestamp, columns)
 
     if intern == True:
         return ret, last_timestamp, next_to_last_timestamp, leftoverpackage
     else:
         return ret
 
-def init_lfsr_4_lut():
-        """
-        Generates a 4bit LFSR according to Manual v1.9 page 19
-        """
-        lfsr = BitLogic(4)
-        lfsr[3:0] = 0xF
-        dummy = 0
-        for i in range(2**4):
-            _lfsr_4_lut[BitLogic.tovalue(lfsr)] = i
-            dummy = lfsr[3]
-            lfsr[3] = lfsr[2]
-            lfsr[2] = lfsr[1]
-            lfsr[1] = lfsr[0]
-            lfsr[0] = lfsr[3] ^ dummy
-        _lfsr_4_lut[2 ** 4 - 1] = 0
-
-
-def init_lfsr_10_lut():
-    """
-    Generates a 10bit LFSR according to Manual v1.9 page 19
-    """
+# Compression and chunkshape of the datasets in the HDF5 files. A storage dict maps the dataset names to
+# settings which replace these defaults, e.g. {'raw_data': {'complib': 'blosc:zstd', 'complevel': 9}}
+default_storage = {
+    'raw_data': {'complib': 'blosc', 'complevel': 5, 'shuffle': True, 'bitshuffle': False, 'chunkshape': None},
+    'meta_data': {'complib': 'zlib', 'complevel': 5, 'shuffle': True, 'bitshuffle': False, 'chunkshape': None},
+    'hit_data': {'complib': 'zlib', 'complevel': 5, 'shuffle': True, 'bitshuffle': False, 'chunkshape': None},
+    'cluster_data': {'complib': 'zlib', 'complevel': 5, 'shuffle': True, 'bitshuffle': False, 'chunkshape': None},
+}
 
-    lfsr = BitLogic(10)
-    lfsr[7:0] = 0xFF
-    lfsr[9:8] = 0b11
-    dummy = 0
-    for i in range(2 ** 10):
-        _lfsr_10_lut[BitLogic.tovalue(lfsr)] = i
-        dummy = lfsr[9]
-        lfsr[9] = lfsr[8]
-        lfsr[8] = lfsr[7]
-        lfsr[7] = lfsr[6]
-        lfsr[6] = lfsr[5]
-        lfsr[5] = lfsr[4]
-        lfsr[4] = lfsr[3]
-        lfsr[3] = lfsr[2]
-        lfsr[2] = lfsr[1]
-        lfsr[1] = lfsr[0]
-        lfsr[0] = lfsr[7] ^ dummy
-    _lfsr_10_lut[2 ** 10 - 1] = 0
-
-def init_lfsr_14_lut():
-    """
-    Generates a 14bit LFSR according to Manual v1.9 page 19
-    """
-    lfsr = BitLogic(14)
-    lfsr[7:0] = 0xFF
-    lfsr[13:8] = 63
-    dummy = 0
-    for i in range(2**14):
-        _lfsr_14_lut[BitLogic.tovalue(lfsr)] = i
-        dummy = lfsr[13]
-        lfsr[13] = lfsr[12]
-        lfsr[12] = lfsr[11]
-        lfsr[11] = lfsr[10]
-        lfsr[10] = lfsr[9]
-        lfsr[9] = lfsr[8]
-        lfsr[8] = lfsr[7]
-        lfsr[7] = lfsr[6]
-        lfsr[6] = lfsr[5]
-        lfsr[5] = lfsr[4]
-        lfsr[4] = lfsr[3]
-        lfsr[3] = lfsr[2]
-        lfsr[2] = lfsr[1]
-        lfsr[1] = lfsr[0]
-        lfsr[0] = lfsr[2] ^ dummy ^ lfsr[12] ^ lfsr[13]
-    _lfsr_14_lut[2 ** 14 - 1] = 0
-
-def init_gray_14_lut():
-    """
-    Generates a 14bit gray according to Manual v1.9 page 19
-    """
-    for j in range(2**14):
-        encoded_value = BitLogic(14) #48
-        encoded_value[13:0]=j #47
-        gray_decrypt_v = BitLogic(14) #48
-        gray_decrypt_v[13]=encoded_value[13] #47
-        for i in range (12, -1, -1): #46
-            gray_decrypt_v[i]=gray_decrypt_v[i+1]^encoded_value[i]
-        _gray_14_lut[j] = gray_decrypt_v.tovalue()
+def storage_options(dataset, storage=None):
+    '''
+        Returns the filters and the chunkshape for creating the dataset ('raw_data', 'meta_data', 'hit_data' or
+        'cluster_data', the vlarrays of the clusters)
+        with the settings of storage (see default_storage). bitshuffle replaces the byte shuffle.
+    '''
+    settings = dict(default_storage[dataset])
+    if storage is not None and dataset in storage:
+        unknown = set(storage[dataset]) - set(settings)
+        if unknown:
+            raise ValueError('Unknown storage settings for %s: %s' % (dataset, ', '.join(sorted(unknown))))
+        settings.update(storage[dataset])
+    filters = tb.Filters(complib=settings['complib'], complevel=settings['complevel'], shuffle=settings['shuffle'] and not settings['bitshuffle'],
+                         bitshuffle=settings['bitshuffle'], fletcher32=False)
+    chunkshape = settings['chunkshape']
+    if chunkshape is not None and not isinstance(chunkshape, int):
+        chunkshape = tuple(chunkshape)
+    return {'filters': filters, 'chunkshape': chunkshape}
+
+def iter_interpreted_hits(h5_file, chunk_words=5000000, raw_data=None, meta_data=None, split_fine=False,
+                          hit_data_group=None, hit_data_name='hit_data', columns=None, progress=None, storage=None):
+    '''
+        Interprets the raw data of h5_file in windows of up to chunk_words 32 bit words and yields the hit data
+        (data_header == 1) of each window. The windows are aligned to the chunks of interpret_raw_data (scan
+        parameters or meta data rows with split_fine=True) and the timestamps and leftover packages are carried
+        over, so the hits are the same as from interpret_raw_data on the whole raw data. A single chunk larger
+        than chunk_words is read at once.
+        raw_data is the raw data node (default: raw_data) and meta_data the meta data indexing it (default: meta_data).
+        The hits are appended to the table hit_data_name in hit_data_group (default: interpreted) with the
+        hit_data settings of storage (see storage_options); with hit_data_name = None they are not stored.
+        By default the hit data contains the columns with data in the op_mode of the run, columns selects
+        the columns explicitly. data_header is always included.
+    '''
+    general_config = h5_file.root.configuration.generalConfig[:]
+    op_mode = [row[1] for row in general_config if row[0]==b'Op_mode'][0]
+    vco = [row[1] for row in general_config if row[0]==b'Fast_Io_en'][0]
+
+    if columns is None:
+        columns = _op_mode_columns(op_mode, vco)
+    elif 'data_header' not in columns:
+        columns = ['data_header'] + list(columns)
+
+    if raw_data is None:
+        raw_data = h5_file.root.raw_data
+    if meta_data is None:
+        meta_data = h5_file.root.meta_data[:]
+
+    if hit_data_name is not None:
+        if hit_data_group is None:
+            hit_data_group = h5_file.root.interpreted
+        hit_table = h5_file.create_table(hit_data_group, hit_data_name, description=_hit_data_dtype(columns), **storage_options('hit_data', storage))
+
+    if not len(meta_data):
+        return
+    bounds, values = _chunk_bounds(meta_data, split_fine, start=int(meta_data['index_start'][0]))
+
+    if progress == None:
+        pbar = tqdm(total = len(bounds))
+
+    state = (0, 0, [])
+    window_start = 0
+    while window_start < len(bounds):
+        # add chunks to the window as long as it stays below chunk_words
+        offset = bounds[window_start][0]
+        window_stop = window_start + 1
+        while window_stop < len(bounds) and bounds[window_stop][1] - offset <= chunk_words:
+            window_stop += 1
+        window_data = raw_data[offset:bounds[window_stop - 1][1]]
+
+        chunks = []
+        for i in range(window_start, window_stop):
+            start, stop, chunk_nr = bounds[i]
+            int_pix_data, state = _interpret_chunk(window_data[start - offset:stop - offset], op_mode, vco, split_fine, chunk_nr, state, False, columns)
+            # reattach timestamp or param_id
+            if split_fine and 'chunk_start_time' in int_pix_data.dtype.names:
+                int_pix_data['chunk_start_time'][:] = values[i]
+            elif not split_fine and 'scan_param_id' in int_pix_data.dtype.names:
+                int_pix_data['scan_param_id'][:] = values[i]
+            chunks.append(int_pix_data)
+        window_data = None
+
+        hit_data = _concatenate_chunks(chunks)
+        hit_data = hit_data[hit_data['data_header'] == 1]
+        if hit_data_name is not None:
+            hit_table.append(hit_data)
+            hit_table.flush()
+
+        if progress == None:
+            pbar.update(window_stop - window_start)
+        else:
+            progress.put(window_stop / len(bounds))
+
+        yield hit_data
+        window_start = window_stop
+
+    if progress == None:
+        pbar.close()
+
+def store_interpreted_hits(h5_file, **kwargs):
+    '''
+        Interprets the raw data of h5_file and only stores the hit data, e.g. if the histograms of the scan
+        were already created while it was running. Takes the arguments of iter_interpreted_hits.
+    '''
+    for _ in iter_interpreted_hits(h5_file, **kwargs):
+        pass
+
+@njit(nogil=True, cache=True)
+def _histogram_link_words(package1, package0, column, scurves, pix_occ):
+    '''
+        Adds the pixel hit of a pair of link packages to the S-curve and occupancy histograms
+    '''
+    data = _combine_link_words(package1, package0)
+    if (data >> np.uint64(47)) == 0:
+        return
+    pixel = (data >> np.uint64(28)) & np.uint64(0b111)
+    super_pixel = (data >> np.uint64(31)) & np.uint64(0x3f)
+    right_col = np.uint64(1) if pixel > 3 else np.uint64(0)
+    eoc = (data >> np.uint64(37)) & np.uint64(0x7f)
+    x = eoc * np.uint64(2) + right_col
+    y = super_pixel * np.uint64(4) + pixel - right_col * np.uint64(4)
+    pixel_index = np.int64(x * np.uint64(256) + y)
+    scurves[pixel_index, column] += _lfsr_10_lut[np.int64((data >> np.uint64(4)) & np.uint64(0x3ff))]
+    pix_occ[pixel_index] += 1
+
+
+def _scurve_hist_state():
+    '''
+        Returns the link state of _scurve_hist_words: per link the pending first package and the
+        last complete pair, which might still be changed by the correction of the following pair
+    '''
+    links = 8
+    return (np.zeros(links, dtype=np.bool_), np.zeros(links, dtype=np.uint64),
+            np.zeros(links, dtype=np.bool_), np.zeros(links, dtype=np.uint64), np.zeros(links, dtype=np.uint64))
+
+
+@njit(nogil=True, cache=True)
+def _scurve_hist_words(raw_data, column, scurves, pix_occ, pending, pending_word, last, last_word1, last_word0):
+    '''
+        Fused version of _raw_data_to_words, _interpret_raw_data and scurve_hist for the Event/iToT mode.
+        The words are demultiplexed and corrected like in _raw_data_to_words and the EventCounter of each
+        pixel hit is added to column of scurves (uint32, like scurve_hist) and the hit to pix_occ. A pair is only added once it can
+        not be changed by the correction anymore, so the words of one chunk can be passed in several parts.
+    '''
+    links = 8
+    n25 = np.uint64(25)
+
+    for i in range(raw_data.shape[0]):
+        word = np.uint64(raw_data[i])
+        link = np.int64(word >> n25)
+        if link >= links:
+            continue
+
+        # package 0 of a pair should have a 0 at bit 24
+        action = _package_action(word, 1, pending[link], last[link], pending_word[link])
+        if action == _START_PAIR:
+            pending[link] = True
+            pending_word[link] = word
+        elif action == _COMPLETE_PAIR:
+            if last[link]:
+                _histogram_link_words(last_word1[link], last_word0[link], column, scurves, pix_occ)
+            pending[link] = False
+            last[link] = True
+            last_word1[link] = pending_word[link]
+            last_word0[link] = word
+        elif action == _DELETE_PACKAGE0:
+            last_word0[link] = pending_word[link]
+            pending_word[link] = word
+        elif action == _DELETE_FIRST:
+            pending_word[link] = word
+
+
+@njit(nogil=True, cache=True)
+def _scurve_hist_flush(column, scurves, pix_occ, pending, pending_word, last, last_word1, last_word0):
+    '''
+        Ends a chunk of _scurve_hist_words: adds the last pairs. The left over packages stay pending
+        for the next chunk, like the leftoverpackage of interpret_raw_data.
+    '''
+    for link in range(last.shape[0]):
+        if last[link]:
+            _histogram_link_words(last_word1[link], last_word0[link], column, scurves, pix_occ)
+        last[link] = False
+
+
+@njit(nogil=True, cache=True)
+def _raw_data_to_scurve_hist(raw_data, starts, stops, columns, scurves, pix_occ, pending, pending_word, last, last_word1, last_word0):
+    '''
+        Histograms every chunk (starts[i]:stops[i]) like a scan parameter chunk of interpret_raw_data
+        into column columns[i] of scurves
+    '''
+    for chunk in range(starts.shape[0]):
+        _scurve_hist_words(raw_data[starts[chunk]:stops[chunk]], columns[chunk], scurves, pix_occ, pending, pending_word, last, last_word1, last_word0)
+        _scurve_hist_flush(columns[chunk], scurves, pix_occ, pending, pending_word, last, last_word1, last_word0)
+
+
+def raw_data_to_scurve_hist(raw_data, meta_data, n_params, param_offset=0, chunk_words=5000000, progress=None):
+    '''
+        Creates the S-curve histogram (65536 x n_params, column scan_param_id - param_offset) and the
+        occupancy of a scan in the Event/iToT mode directly from the raw data, without hit data.
+        The result is the same as scurve_hist on the hit data of interpret_raw_data.
+        raw_data can be the raw data node of the h5 file, which is read in windows of up to chunk_words words.
+        meta_data are the meta data rows of the scan parameters to histogram.
+    '''
+    scurves = np.zeros((256 * 256, n_params), dtype=np.uint32)
+    pix_occ = np.zeros(256 * 256, dtype=np.int64)
+    if not len(meta_data):
+        return scurves, pix_occ
+
+    bounds, params = _chunk_bounds(meta_data, False, start=int(meta_data['index_start'][0]))
+    columns = params.astype(np.int64) - param_offset
+    if np.any(columns < 0) or np.any(columns >= n_params):
+        raise ValueError("The scan_param_ids of the meta data do not fit in %d histogram columns starting at %d" % (n_params, param_offset))
+
+    if progress == None:
+        pbar = tqdm(total = len(bounds))
+
+    state = _scurve_hist_state()
+    window_start = 0
+    while window_start < len(bounds):
+        # add chunks to the window as long as it stays below chunk_words
+        offset = bounds[window_start][0]
+        window_stop = window_start + 1
+        while window_stop < len(bounds) and bounds[window_stop][1] - offset <= chunk_words:
+            window_stop += 1
+        window_data = raw_data[offset:bounds[window_stop - 1][1]]
+
+        starts = np.array([start - offset for start, _, _ in bounds[window_start:window_stop]], dtype=np.int64)
+        stops = np.array([stop - offset for _, stop, _ in bounds[window_start:window_stop]], dtype=np.int64)
+        _raw_data_to_scurve_hist(window_data, starts, stops, columns[window_start:window_stop], scurves, pix_occ, *state)
+        window_data = None
+
+        if progress == None:
+            pbar.update(window_stop - window_start)
+        else:
+            progress.put(window_stop / len(bounds))
+        window_start = window_stop
+
+    if progress == None:
+        pbar.close()
+
+    return scurves, pix_occ
+
+# Status of the fit of a pixel in the fit diagnostics
+FIT_OK = 0
+FIT_NO_DATA = 1         # no hits or too few steps
+FIT_LOW_SIGNAL = 2      # less than 0.2 * n_injections hits per step
+FIT_NOT_CONVERGED = 3   # the fit failed or did not converge within max_iter
+FIT_REJECTED = 4        # the result does not describe an S-curve
+fit_status_names = {FIT_OK: 'ok', FIT_NO_DATA: 'no data', FIT_LOW_SIGNAL: 'low signal',
+                    FIT_NOT_CONVERGED: 'not converged', FIT_REJECTED: 'rejected'}
+
+# Fit diagnostics per pixel, n_iter is 0 for fits without iteration count (curve_fit and fitless)
+fit_diagnostics_dtype = [('x', np.uint8), ('y', np.uint8), ('status', np.uint8), ('n_iter', np.uint16), ('chi2ndf', np.float32)]
 
 def scurve(x, A, mu, sigma):
     return 0.5 * A * erf((x - mu) / (np.sqrt(2) * sigma)) + 0.5 * A
@@ -815,31 +1285,88 @@ def get_noise(x, y, n_injections, invert_x=False):
         Parameters
         ----------
         x, y : numpy array like
-            Data in x and y
+            Data in x and y, y can be 2D with one s-curve per row
         n_injections: integer
             Number of injections
     '''
 
-    mu = get_threshold(x, y, n_injections, invert_x)
+    x = np.asarray(x)
+    y = np.asarray(y)
+    # Threshold per s-curve with a trailing axis to compare it with all x values
+    mu = np.expand_dims(get_threshold(x, y, n_injections, invert_x), -1)
     d = np.abs(np.diff(x)[0])
 
     if invert_x:
-        mu1 = y[x > mu].sum()
-        mu2 = (n_injections - y[x < mu]).sum()
+        below, above = x > mu, x < mu
     else:
-        mu1 = y[x < mu].sum()
-        mu2 = (n_injections - y[x > mu]).sum()
+        below, above = x < mu, x > mu
+    mu1 = np.where(below, y, 0).sum(axis=-1).astype(float)
+    # Sum of n_injections - y above the threshold
+    mu2 = n_injections * above.sum(axis=-1) - np.where(above, y, 0).sum(axis=-1).astype(float)
 
-    return d * (mu1 + mu2).astype(float) / n_injections * np.sqrt(np.pi / 2.)
+    return d * (mu1 + mu2) / n_injections * np.sqrt(np.pi / 2.)
 
 
-def fit_scurve(scurve_data, scan_param_range, n_injections, sigma_0, invert_x):
+def fitless_scurves(scurves, scan_param_range, n_injections, invert_x=False):
+    '''
+        Threshold and noise of all S-curves (one row per pixel) with get_threshold and get_noise
+        in one pass without fitting. The x values have to be equidistant.
+        Returns the arrays of mu and sigma, which are 0 for pixels the fit would not accept
+        (no hits or less than 0.2 * n_injections hits per step).
+    '''
+    scurves = np.asarray(scurves)
+    x = np.array(scan_param_range)
+
+    thr = get_threshold(x, scurves, n_injections, invert_x).astype(float)
+    sig = get_noise(x, scurves, n_injections, invert_x)
+
+    # Same data selection as the S-curve fit
+    curve_max = scurves.max(axis=-1)
+    invalid = (curve_max == 0) | (curve_max < 0.2 * n_injections)
+    thr[invalid] = 0.
+    sig[invalid] = 0.
+    return thr, sig
+
+
+def scurve_errors(y, n_injections):
+    '''
+        Binomial errors of the S-curve data y for the fit, with a minimum error of 0.5 injections
+        and high errors for additional hits which do not follow the fit model
+    '''
+    y = np.asarray(y, dtype=float)
+    with np.errstate(invalid='ignore'):
+        yerr = np.sqrt(y * (1. - y / n_injections))
+    # Set minimum error != 0, needed for fit minimizers
+    # Set arbitrarily to error of 0.5 injections
+    min_err = np.sqrt(0.5 - 0.5 / n_injections)
+    yerr[yerr < min_err] = min_err
+    # Additional hits not following fit model set high error
+    sel_bad = y > n_injections
+    yerr[sel_bad] = (y - n_injections)[sel_bad]
+    return yerr
+
+
+def scurve_chi2ndf(scurves, scan_param_range, n_injections, A, mu, sigma, invert_x=False):
+    '''
+        chi2/ndf of the S-curves (one row per pixel) to the fit results A, mu and sigma per pixel,
+        calculated for all pixels at once. Pixels with sigma 0 (no valid fit) get 0.
+    '''
+    scurves = np.asarray(scurves, dtype=float)
+    x = np.asarray(scan_param_range, dtype=float)
+    A, mu, sigma = [np.expand_dims(np.asarray(par, dtype=float), -1) for par in (A, mu, sigma)]
+    fitted = (sigma != 0).reshape(sigma.shape[:-1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y_fit = (zcurve if invert_x else scurve)(x, A, mu, sigma)
+    return np.where(fitted, chi2ndf(scurves, y_fit, scurve_errors(scurves, n_injections), 3), 0.)
+
+
+def _fit_scurve_params(scurve_data, scan_param_range, n_injections, sigma_0, invert_x):
     '''
         Fit one pixel data with Scurve.
         Has to be global function for the multiprocessing module.
 
         Returns:
-            (mu, sigma, chi2/ndf)
+            (A, mu, sigma, status), the parameters are 0 if the status is not FIT_OK
     '''
 
     scurve_data = np.array(scurve_data, dtype=float)
@@ -850,19 +1377,12 @@ def fit_scurve(scurve_data, scan_param_range, n_injections, sigma_0, invert_x):
 
     # Only fit data that is fittable
     if np.all(y == 0) or np.all(np.isnan(y)) or x.shape[0] < 3:
-        return (0., 0., 0.)
+        return (0., 0., 0., FIT_NO_DATA)
     if y.max() < 0.2 * n_injections:
-        return (0., 0., 0.)
+        return (0., 0., 0., FIT_LOW_SIGNAL)
 
     # Calculate data errors, Binomial errors
-    yerr = np.sqrt(y * (1. - y.astype(float) / n_injections))
-    # Set minimum error != 0, needed for fit minimizers
-    # Set arbitrarily to error of 0.5 injections
-    min_err = np.sqrt(0.5 - 0.5 / n_injections)
-    yerr[yerr < min_err] = min_err
-    # Additional hits not following fit model set high error
-    sel_bad = y > n_injections
-    yerr[sel_bad] = (y - n_injections)[sel_bad]
+    yerr = scurve_errors(y, n_injections)
 
     # Calculate threshold start value:
     mu = get_threshold(x=x, y=y,
@@ -877,136 +1397,531 @@ def fit_scurve(scurve_data, scan_param_range, n_injections, sigma_0, invert_x):
             popt = curve_fit(f=zcurve, xdata=x,
                              ydata=y, p0=p0, sigma=yerr,
                              absolute_sigma=True if np.any(yerr) else False)[0]
-            chi2 , ndof= Chi_square(x_values = x, y_values = y, sigma = yerr, function = zcurve, function_parameters = popt, chi_red = True)
         else:
             popt = curve_fit(f=scurve, xdata=x,
                              ydata=y, p0=p0, sigma=yerr,
                              absolute_sigma=True if np.any(yerr) else False,
                              method='lm')[0]
-            chi2, ndof = Chi_square(x_values = x, y_values = y, sigma = yerr, function = scurve, function_parameters = popt, chi_red = True)
     except RuntimeError:  # fit failed
-        return (0., 0., 0.)
+        return (0., 0., 0., FIT_NOT_CONVERGED)
 
     # Treat data that does not follow an S-Curve, every fit result is possible here but not meaningful
     max_threshold = x.max() + 5. * np.abs(popt[2])
     min_threshold = x.min() - 5. * np.abs(popt[2])
     if popt[2] <= 0 or not min_threshold < popt[1] < max_threshold:
-        return (0., 0., 0.)
+        return (0., 0., 0., FIT_REJECTED)
 
-    return (popt[1], popt[2], chi2)
+    return (popt[0], popt[1], popt[2], FIT_OK)
 
 
-def imap_bar(func, args, n_processes=None, progress = None):
+def fit_scurve(scurve_data, scan_param_range, n_injections, sigma_0, invert_x):
     '''
-        Apply function (func) to interable (args) with progressbar based on tqdm or 'progress'
-        in case of a GUI
+        Fit one pixel data with Scurve.
+        Has to be global function for the multiprocessing module.
+
+        Returns:
+            (mu, sigma, chi2/ndf)
     '''
-    p = mp.Pool(n_processes)
-    res_list = []
+    A, mu, sigma, status = _fit_scurve_params(scurve_data, scan_param_range, n_injections, sigma_0, invert_x)
+    if status != FIT_OK:
+        return (0., 0., 0.)
+    return (mu, sigma, float(scurve_chi2ndf(scurve_data, scan_param_range, n_injections, A, mu, sigma, invert_x)))
 
-    if progress == None:
-        pbar = tqdm(total=len(args))
+
+@njit(nogil=True, cache=True)
+def _fit_scurve_lm(x, y, yerr, sign, A, mu, sigma, max_iter):
+    '''
+        Levenberg-Marquardt fit of the S-curve (sign = 1) or Z-curve (sign = -1) with the start values
+        A, mu, sigma to the data y with the errors yerr. Returns the fit parameters, the chi2, if the
+        fit converged and the number of iterations.
+    '''
+    n = x.shape[0]
+    sqrt2 = math.sqrt(2.)
+    erf_scale = 2. / math.sqrt(math.pi)
+    p = np.array([A, mu, sigma])
+    trial = np.empty(3)
+    step = np.empty(3)
+    jtj = np.empty((3, 3))
+    jtr = np.empty(3)
+    jac = np.empty(3)
+    lam = 1e-3
+
+    chi2 = 0.
+    for i in range(n):
+        r = (y[i] - (0.5 * p[0] * sign * math.erf((x[i] - p[1]) / (sqrt2 * p[2])) + 0.5 * p[0])) / yerr[i]
+        chi2 += r * r
+
+    for iteration in range(max_iter):
+        if p[2] == 0.:
+            return p, chi2, False, iteration
+
+        # Normal equations of the weighted residuals
+        jtj[:, :] = 0.
+        jtr[:] = 0.
+        for i in range(n):
+            z = (x[i] - p[1]) / (sqrt2 * p[2])
+            erf_z = math.erf(z)
+            gauss = 0.5 * p[0] * sign * erf_scale * math.exp(-z * z)
+            jac[0] = 0.5 * (1. + sign * erf_z) / yerr[i]
+            jac[1] = -gauss / (sqrt2 * p[2]) / yerr[i]
+            jac[2] = -gauss * z / p[2] / yerr[i]
+            r = (y[i] - (0.5 * p[0] * sign * erf_z + 0.5 * p[0])) / yerr[i]
+            for j in range(3):
+                jtr[j] += jac[j] * r
+                for k in range(j + 1):
+                    jtj[j, k] += jac[j] * jac[k]
+        for j in range(3):
+            for k in range(j):
+                jtj[k, j] = jtj[j, k]
+
+        # Increase the damping until the step decreases the chi2
+        while True:
+            damped = jtj.copy()
+            for j in range(3):
+                damped[j, j] += lam * max(jtj[j, j], 1e-300)
+            # Solve the damped 3x3 normal equations with Cramer's rule
+            cof0 = damped[1, 1] * damped[2, 2] - damped[1, 2] * damped[2, 1]
+            cof1 = damped[1, 2] * damped[2, 0] - damped[1, 0] * damped[2, 2]
+            cof2 = damped[1, 0] * damped[2, 1] - damped[1, 1] * damped[2, 0]
+            det = damped[0, 0] * cof0 + damped[0, 1] * cof1 + damped[0, 2] * cof2
+            if det == 0. or not np.isfinite(det):
+                lam *= 10.
+                if lam > 1e16:
+                    return p, chi2, False, iteration
+                continue
+            step[0] = (jtr[0] * cof0
+                       + damped[0, 1] * (damped[1, 2] * jtr[2] - jtr[1] * damped[2, 2])
+                       + damped[0, 2] * (jtr[1] * damped[2, 1] - damped[1, 1] * jtr[2])) / det
+            step[1] = (damped[0, 0] * (jtr[1] * damped[2, 2] - damped[1, 2] * jtr[2])
+                       + jtr[0] * cof1
+                       + damped[0, 2] * (damped[1, 0] * jtr[2] - jtr[1] * damped[2, 0])) / det
+            step[2] = (damped[0, 0] * (damped[1, 1] * jtr[2] - jtr[1] * damped[2, 1])
+                       + damped[0, 1] * (jtr[1] * damped[2, 0] - damped[1, 0] * jtr[2])
+                       + jtr[0] * cof2) / det
+            trial[:] = p + step
+            trial_chi2 = 0.
+            if trial[2] != 0.:
+                for i in range(n):
+                    r = (y[i] - (0.5 * trial[0] * sign * math.erf((x[i] - trial[1]) / (sqrt2 * trial[2])) + 0.5 * trial[0])) / yerr[i]
+                    trial_chi2 += r * r
+            if trial[2] != 0. and trial_chi2 <= chi2:
+                break
+            lam *= 10.
+            if lam > 1e16:
+                # no step decreases the chi2 anymore: not a converged fit
+                return p, chi2, False, iteration
+
+        decrease = chi2 - trial_chi2
+        small_step = True
+        for j in range(3):
+            if abs(step[j]) > 1.49012e-08 * (abs(p[j]) + 1.49012e-08):
+                small_step = False
+        # The chi2 of a step function decreases by a fraction of itself with sigma, but mu does not change
+        small_mu_step = abs(step[1]) <= 1.49012e-08 * (abs(p[1]) + 1.49012e-08)
+        p[:] = trial
+        chi2 = trial_chi2
+        lam = max(lam / 10., 1e-12)
+        if small_step or decrease <= 1.49012e-08 * chi2 or (chi2 <= 1.49012e-08 and small_mu_step):
+            return p, chi2, True, iteration + 1
+
+    return p, chi2, False, max_iter
+
+
+@njit(nogil=True, cache=True)
+def _fit_scurves_lm(scurves, x, n_injections, sigma_0, invert_x, max_iter, mu_start, sigma_start):
+    '''
+        Fits all rows of scurves like fit_scurve and returns the arrays of mu, sigma, chi2/ndf and the
+        fit status and number of iterations. Pixels with sigma_start > 0 start from mu_start and
+        sigma_start instead of the threshold estimate and sigma_0, if sigma_start is at least half a step
+        and the threshold estimate is within 3 sigma_start of mu_start. If this fit does not converge
+        within 10 iterations, the pixel is fitted again from the threshold estimate and sigma_0.
+    '''
+    n_pixels = scurves.shape[0]
+    n = x.shape[0]
+    thr = np.zeros(n_pixels)
+    sig = np.zeros(n_pixels)
+    chi2ndf = np.zeros(n_pixels)
+    status = np.full(n_pixels, FIT_NO_DATA, dtype=np.uint8)
+    n_iter = np.zeros(n_pixels, dtype=np.uint16)
+    if n < 3:
+        return thr, sig, chi2ndf, status, n_iter
+
+    sign = -1. if invert_x else 1.
+    d = x[1] - x[0]
+    x_min = x.min()
+    x_max = x.max()
+    min_err = math.sqrt(0.5 - 0.5 / n_injections)
+
+    for pixel in range(n_pixels):
+        y = scurves[pixel].astype(np.float64)
+        # Only fit data that is fittable
+        if y.max() == 0.:
+            continue
+        if y.max() < 0.2 * n_injections:
+            status[pixel] = FIT_LOW_SIGNAL
+            continue
+
+        # Binomial errors with a minimum error of 0.5 injections, additional hits get a high error
+        yerr = np.empty(n)
+        for i in range(n):
+            if y[i] > n_injections:
+                yerr[i] = y[i] - n_injections
+            else:
+                yerr[i] = max(math.sqrt(y[i] * (1. - y[i] / n_injections)), min_err)
+
+        # Threshold start value
+        if invert_x:
+            mu = x_min + d * y.sum() / n_injections
+        else:
+            mu = x_max - d * y.sum() / n_injections
+
+        # Start from the last fit only if it still describes the S-curve, the fit of a shifted
+        # S-curve with a small sigma does not find the minimum. A start from the last fit that
+        # needs more iterations than a fit from the threshold estimate is stopped.
+        converged = False
+        if sigma_start[pixel] >= 0.5 * abs(d) and abs(mu_start[pixel] - mu) < 3. * sigma_start[pixel]:
+            p, chi2, converged, n_iter[pixel] = _fit_scurve_lm(x, y, yerr, sign, float(n_injections), mu_start[pixel], sigma_start[pixel], min(max_iter, 10))
+        if not converged:
+            p, chi2, converged, iterations = _fit_scurve_lm(x, y, yerr, sign, float(n_injections), mu, sigma_0, max_iter)
+            n_iter[pixel] += iterations
+        if not converged:
+            status[pixel] = FIT_NOT_CONVERGED
+            continue
+
+        # Treat data that does not follow an S-Curve, every fit result is possible here but not meaningful
+        if p[2] <= 0 or not x_min - 5. * abs(p[2]) < p[1] < x_max + 5. * abs(p[2]):
+            status[pixel] = FIT_REJECTED
+            continue
+        status[pixel] = FIT_OK
+        thr[pixel] = p[1]
+        sig[pixel] = p[2]
+        chi2ndf[pixel] = chi2 / (n - 3) if n > 3 else 0.
+
+    return thr, sig, chi2ndf, status, n_iter
+
+
+def fit_scurves_batch(scurves, scan_param_range, n_injections, sigma_0, invert_x=False, max_iter=200, progress=None, p0=None, diagnostics=False):
+    '''
+        Fits all S-curves (one row per pixel) at once with a Levenberg-Marquardt fit with the same
+        model, errors and acceptance cuts as fit_scurve. The x values have to be equidistant.
+        p0 can be a tuple of the mu and sigma arrays of a previous fit to start from them, pixels
+        with a sigma below half a step (no valid fit or a step function) or a threshold estimate that
+        is not within 3 sigma of the previous mu start from the threshold estimate and sigma_0.
+        Returns the arrays of mu, sigma and chi2/ndf, which are 0 for pixels without a valid fit.
+        With diagnostics also the arrays of the fit status (FIT_*) and the number of iterations.
+    '''
+    scurves = np.asarray(scurves)
+    x = np.array(scan_param_range, dtype=np.float64)
+    if x.shape[0] > 1 and not np.all(np.diff(x) == x[1] - x[0]):
+        raise NotImplementedError('Threshold can only be calculated for equidistant x values!')
+    if p0 is None:
+        mu_start = np.zeros(scurves.shape[0])
+        sigma_start = np.zeros(scurves.shape[0])
     else:
-        step_counter = 0
+        mu_start = np.asarray(p0[0], dtype=np.float64).reshape(-1)
+        sigma_start = np.asarray(p0[1], dtype=np.float64).reshape(-1)
 
-    for _, res in enumerate(p.imap(func, args)):
+    # Fit in blocks of pixels for the progress
+    blocks = np.array_split(np.arange(scurves.shape[0]), min(100, max(scurves.shape[0], 1)))
+    thr = np.zeros(scurves.shape[0])
+    sig = np.zeros(scurves.shape[0])
+    chi2ndf = np.zeros(scurves.shape[0])
+    status = np.full(scurves.shape[0], FIT_NO_DATA, dtype=np.uint8)
+    n_iter = np.zeros(scurves.shape[0], dtype=np.uint16)
+
+    if progress == None:
+        pbar = tqdm(total=scurves.shape[0])
+
+    for i, block in enumerate(blocks):
+        if not len(block):
+            continue
+        rows = slice(block[0], block[-1] + 1)
+        thr[rows], sig[rows], chi2ndf[rows], status[rows], n_iter[rows] = _fit_scurves_lm(scurves[rows], x, n_injections, float(sigma_0), invert_x, max_iter,
+                                                                                          mu_start[rows], sigma_start[rows])
         if progress == None:
-            pbar.update(1)
+            pbar.update(len(block))
         else:
-            step_counter += 1
-            fraction = step_counter / len(args)
-            progress.put(fraction)
-        res_list.append(res)
+            progress.put((i + 1) / len(blocks))
 
     if progress == None:
         pbar.close()
 
-    p.close()
-    p.join()
-    return res_list
+    if diagnostics:
+        return thr, sig, chi2ndf, status, n_iter
+    return thr, sig, chi2ndf
 
 
-def fit_scurves_multithread(scurves, scan_param_range,
-                            n_injections, invert_x=False, progress = None):
-    _scurves = np.zeros((256*256, len(scan_param_range)), dtype=np.uint16)
+class ScurveFitCache(object):
+    '''
+        Keeps the S-curves and fit results per pixel of the last fit_scurves_batch for repeated fits
+        of the same pixels. Pixels with an unchanged S-curve keep their result, all other pixels are
+        refitted like in fit_scurves_batch with p0.
+        The cache is reset if the scan parameters, n_injections or invert_x change.
+    '''
 
-    # Set all values above n_injections to n_injections. This is necessary, as the noise peak can lead to problems in the scurve fits.
-    # As we are only interested in the position of the scurve (which lays below n_injections) this should not cause a problem.
-    logger.info("Cut S-curves to %i hits for S-curve fit", n_injections)
-    pulse_check = scurves > n_injections
-    _scurves[pulse_check] = n_injections
-    _scurves[np.invert(pulse_check)] = scurves[np.invert(pulse_check)]
+    def __init__(self):
+        self.scurves = None
+        self.key = None
+        self.results = None
+
+    def fit(self, scurves, scan_param_range, n_injections, sigma_0, invert_x=False, max_iter=200, progress=None, diagnostics=False):
+        '''
+            Fits the S-curves like fit_scurves_batch and updates the cache. Unchanged pixels keep
+            the fit status and number of iterations of their last fit.
+        '''
+        scurves = np.asarray(scurves)
+        key = (tuple(np.asarray(scan_param_range).tolist()), n_injections, invert_x)
+        if self.scurves is None or self.key != key or self.scurves.shape != scurves.shape:
+            results = fit_scurves_batch(scurves, scan_param_range, n_injections, sigma_0,
+                                        invert_x=invert_x, max_iter=max_iter, progress=progress, diagnostics=True)
+        else:
+            results = [res.copy() for res in self.results]
+            changed = np.flatnonzero(np.any(scurves != self.scurves, axis=1))
+            logger.info("Refit %i of %i S-curves starting from the last fit", len(changed), scurves.shape[0])
+            refit = fit_scurves_batch(scurves[changed], scan_param_range, n_injections, sigma_0,
+                                      invert_x=invert_x, max_iter=max_iter, progress=progress,
+                                      p0=(results[0][changed], results[1][changed]), diagnostics=True)
+            for res, res_changed in zip(results, refit):
+                res[changed] = res_changed
+
+        self.scurves = scurves.copy()
+        self.key = key
+        self.results = tuple(results)
+        return tuple(res.copy() for res in self.results[:5 if diagnostics else 3])
+
+
+def _fit_block(task):
+    '''
+        Applies func to the rows start to stop of the curves in the shared memory block.
+        Has to be global function for the multiprocessing module.
+    '''
+    from multiprocessing import shared_memory
+    func, shm_name, shape, dtype, start, stop = task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    curves = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    block = np.array(curves[start:stop])
+    del curves
+    shm.close()
+    return func(block)
 
-    _scurves = np.ma.masked_array(_scurves)
-    scan_param_range = np.array(scan_param_range)
 
-    # Calculate noise median for fit start value
-    logger.info("Calculate S-curve fit start parameters")
-    sigmas = []
+def _fit_rows(func, block):
+    '''
+        Applies func to every row of block
+    '''
+    return [func(curve) for curve in block]
 
-    if progress == None:
-        pbar = tqdm(total=_scurves.shape[0])
-    else:
-        step_counter = 0
 
-    for curve in _scurves:
-        # Calculate from pixels with valid data (maximum = n_injections)
-        if curve.max() == n_injections:
-            if np.all(curve.mask == np.ma.nomask):
-                x = scan_param_range
-            else:
-                x = scan_param_range[~curve.mask]
+class FitExecutor(object):
+    '''
+        Process pool for the fits of all pixels. The curves are placed in shared memory once per
+        fit and the processes get blocks of pixels instead of every pixel as pickled list.
+        The pool is started with the first fit and kept for the following fits. The processes are
+        spawned, as forked processes can hang after numba parallel kernels (TBB is not fork safe).
+        Needs Python 3.8 or newer for multiprocessing.shared_memory.
+    '''
 
-            y = curve
+    def __init__(self, n_processes=None, blocks_per_process=16):
+        self.n_processes = n_processes if n_processes else mp.cpu_count()
+        self.blocks_per_process = blocks_per_process
+        self._pool = None
+
+    def map_blocks(self, func, curves, progress=None):
+        '''
+            Applies func to blocks of rows of curves and returns the list of the results of the blocks.
+            If progress is None a tqdm progress bar is used else progress should be a Multiprocess Queue
+            which stores the progress as fraction of 1
+        '''
+        from multiprocessing import shared_memory
+        curves = np.ascontiguousarray(curves)
+        n_curves = curves.shape[0]
+        block_size = max(1, -(-n_curves // (self.n_processes * self.blocks_per_process)))
+        bounds = [(start, min(start + block_size, n_curves)) for start in range(0, n_curves, block_size)]
+
+        # The shared memory is created before the pool, so that the processes use the resource tracker of this process
+        shm = shared_memory.SharedMemory(create=True, size=max(curves.nbytes, 1))
+        try:
+            if self._pool is None:
+                self._pool = mp.get_context('spawn').Pool(self.n_processes)
 
-            sigma = get_noise(x=x,
-                              y=y.compressed(),
-                              n_injections=n_injections,
-                              invert_x=invert_x)
-            sigmas.append(sigma)
+            shared = np.ndarray(curves.shape, dtype=curves.dtype, buffer=shm.buf)
+            shared[:] = curves
+            del shared
 
-        if progress == None:
-            pbar.update(1)
-        else:
-            step_counter += 1
-            if step_counter % int(_scurves.shape[0] / 100) == 0:
-                fraction = step_counter / (_scurves.shape[0])
-                progress.put(fraction)
+            if progress == None:
+                pbar = tqdm(total=n_curves)
 
-    if progress == None:
-        pbar.close()
+            results = []
+            tasks = [(func, shm.name, curves.shape, curves.dtype.str, start, stop) for start, stop in bounds]
+            for (start, stop), res in zip(bounds, self._pool.imap(_fit_block, tasks)):
+                if progress == None:
+                    pbar.update(stop - start)
+                else:
+                    progress.put(stop / n_curves)
+                results.append(res)
+
+            if progress == None:
+                pbar.close()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return results
+
+    def map(self, func, curves, progress=None):
+        '''
+            Applies func to every row of curves and returns the list of the results
+        '''
+        results = []
+        for block in self.map_blocks(partial(_fit_rows, func), curves, progress=progress):
+            results.extend(block)
+        return results
+
+    def close(self):
+        '''
+            Stops the processes of the pool
+        '''
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+_fit_executor = None
+
+
+def get_fit_executor():
+    '''
+        Returns the fit executor which is shared by all fits of the process
+    '''
+    global _fit_executor
+    if _fit_executor is None:
+        _fit_executor = FitExecutor()
+        atexit.register(_fit_executor.close)
+    return _fit_executor
+
+
+def fit_diagnostics(status, n_iter, chi2ndf):
+    '''
+        Table of the fit diagnostics (fit_diagnostics_dtype) of all pixels with one row per pixel
+        in the order of the S-curve histogram (x * 256 + y)
+    '''
+    diagnostics = np.zeros(256 * 256, dtype=fit_diagnostics_dtype)
+    pixels = np.arange(256 * 256)
+    diagnostics['x'] = pixels // 256
+    diagnostics['y'] = pixels % 256
+    diagnostics['status'] = status
+    diagnostics['n_iter'] = n_iter
+    diagnostics['chi2ndf'] = chi2ndf
+    return diagnostics
+
+
+def fit_scurves_multithread(scurves, scan_param_range,
+                            n_injections, invert_x=False, progress = None, method = 'batch', cache = None, diagnostics = False):
+    '''
+        Fits the S-curves of all pixels and returns the threshold, noise and chi2/ndf maps.
+        With method 'batch' all pixels are fitted at once with fit_scurves_batch, with method
+        'curve_fit' every pixel is fitted with fit_scurve in a process pool. With method 'fitless'
+        the maps are calculated without a fit by fitless_scurves and the chi2/ndf map is 0.
+        With a ScurveFitCache as cache the batch fit starts from the results of the last fit.
+        With diagnostics the table of the fit diagnostics (see fit_diagnostics) is returned as
+        fourth value.
+    '''
+    if method not in ('batch', 'curve_fit', 'fitless'):
+        raise ValueError("Unknown S-curve fit method '%s'" % method)
+
+    # Set all values above n_injections to n_injections. This is necessary, as the noise peak can lead to problems in the scurve fits.
+    # As we are only interested in the position of the scurve (which lays below n_injections) this should not cause a problem.
+    logger.info("Cut S-curves to %i hits for S-curve fit", n_injections)
+    _scurves = np.minimum(scurves, n_injections).astype(np.uint16)
+    scan_param_range = np.array(scan_param_range)
 
+    if method == 'fitless':
+        logger.info("Calculate thresholds and noise without S-curve fit")
+        thr, sig = fitless_scurves(_scurves, scan_param_range, n_injections, invert_x)
+        if progress != None:
+            progress.put(1.)
+        curve_max = _scurves.max(axis=1)
+        status = np.where(curve_max == 0, FIT_NO_DATA, np.where(curve_max < 0.2 * n_injections, FIT_LOW_SIGNAL, FIT_OK))
+        if diagnostics:
+            return np.reshape(thr, (256, 256)), np.reshape(sig, (256, 256)), np.zeros((256, 256)), fit_diagnostics(status, 0, 0.)
+        return np.reshape(thr, (256, 256)), np.reshape(sig, (256, 256)), np.zeros((256, 256))
+
+    # Calculate noise median for fit start value from pixels with valid data (maximum = n_injections)
+    logger.info("Calculate S-curve fit start parameters")
+    sigmas = get_noise(x=scan_param_range,
+                       y=_scurves[_scurves.max(axis=1) == n_injections],
+                       n_injections=n_injections,
+                       invert_x=invert_x)
     sigma_0 = np.median(sigmas)
 
-    logger.info("Start S-curve fit on %d CPU core(s)", mp.cpu_count())
+    if method == 'batch' and cache is not None:
+        logger.info("Start batch S-curve fit from the last fit results")
+        thr, sig, chi2ndf, status, n_iter = cache.fit(_scurves,
+                                                      scan_param_range=scan_param_range,
+                                                      n_injections=n_injections,
+                                                      sigma_0=sigma_0,
+                                                      invert_x=invert_x,
+                                                      progress=progress,
+                                                      diagnostics=True)
+    elif method == 'batch':
+        logger.info("Start batch S-curve fit")
+        thr, sig, chi2ndf, status, n_iter = fit_scurves_batch(_scurves,
+                                                              scan_param_range=scan_param_range,
+                                                              n_injections=n_injections,
+                                                              sigma_0=sigma_0,
+                                                              invert_x=invert_x,
+                                                              progress=progress,
+                                                              diagnostics=True)
+    else:
+        logger.info("Start S-curve fit on %d CPU core(s)", get_fit_executor().n_processes)
 
-    partialfit_scurve = partial(fit_scurve,
-                                scan_param_range=scan_param_range,
-                                n_injections=n_injections,
-                                sigma_0=sigma_0,
-                                invert_x=invert_x)
+        partialfit_scurve = partial(_fit_scurve_params,
+                                    scan_param_range=scan_param_range,
+                                    n_injections=n_injections,
+                                    sigma_0=sigma_0,
+                                    invert_x=invert_x)
 
-    result_list = imap_bar(partialfit_scurve, _scurves.tolist(), progress = progress)
-    result_array = np.array(result_list)
-    logger.info("S-curve fit finished")
+        result_list = get_fit_executor().map(partialfit_scurve, _scurves, progress = progress)
+        result_array = np.array(result_list)
 
-    thr = result_array[:, 0]
-    sig = result_array[:, 1]
-    chi2ndf = result_array[:, 2]
+        thr = result_array[:, 1]
+        sig = result_array[:, 2]
+        status = result_array[:, 3].astype(np.uint8)
+        n_iter = 0
+        # chi2/ndf of all pixels at once from the residuals to the fit results
+        chi2ndf = scurve_chi2ndf(_scurves, scan_param_range, n_injections, result_array[:, 0], thr, sig, invert_x)
+    logger.info("S-curve fit finished: %s", ', '.join('%i %s' % (np.count_nonzero(status == code), name) for code, name in fit_status_names.items()))
 
     thr2D = np.reshape(thr, (256, 256))
     sig2D = np.reshape(sig, (256, 256))
     chi2ndf2D = np.reshape(chi2ndf, (256, 256))
+    if diagnostics:
+        return thr2D, sig2D, chi2ndf2D, fit_diagnostics(status, n_iter, chi2ndf)
     return thr2D, sig2D, chi2ndf2D
 
 
-def fit_ToT(tot_data, scan_param_range, t_est):
+def totcurve_chi2ndf(totcurves, a, b, c, t):
+    '''
+        chi2/ndf with the Poisson errors sqrt(y) of the totcurves (one row per pixel, steps without
+        data are 0 or nan) to the fit results a, b, c and t per pixel, calculated for all pixels at once
+    '''
+    totcurves = np.asarray(totcurves, dtype=float)
+    y = np.where(totcurves != 0, totcurves, np.nan)
+    x = np.arange(totcurves.shape[-1], dtype=float)
+    a, b, c, t = [np.expand_dims(np.asarray(par, dtype=float), -1) for par in (a, b, c, t)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y_fit = totcurve(x, a, b, c, t)
+    return chi2ndf(y, y_fit, np.sqrt(y), 4)
+
+
+def _fit_ToT_params(tot_data, scan_param_range, t_est):
     '''
         Fit one pixel data with totcurve.
         Has to be global function for the multiprocessing module.
 
         Returns:
-            (a, b, c, t, chi2/ndf)
+            (a, b, c, t, status), the parameters are 0 if the status is not FIT_OK
     '''
 
     tot_data = np.array(tot_data, dtype=float)
@@ -1017,39 +1932,275 @@ def fit_ToT(tot_data, scan_param_range, t_est):
 
     # Only fit data that is fittable
     if np.all(y == 0) or np.all(np.isnan(y)) or x.shape[0] < 3:
-        return (0., 0., 0., 0., 0.)
+        return (0., 0., 0., 0., FIT_NO_DATA)
 
     try:
         popt_lin = curve_fit(f=linear, xdata=x, ydata=y)[0]
         a = popt_lin[0]
         b = popt_lin[1]
     except RuntimeError:  # fit failed
-        return (0., 0., 0., 0., 0.)
+        return (0., 0., 0., 0., FIT_NOT_CONVERGED)
 
     p0 = [a, b, 500, t_est]
 
     try:
         popt = curve_fit(f=totcurve, xdata=x, ydata=y, p0=p0)[0]
-        chi2, ndof = Chi_square(x_values = x, y_values = y, sigma = np.sqrt(y), function = totcurve, function_parameters = popt, chi_red = True)
     except RuntimeError:  # fit failed
-        return (0., 0., 0., 0., 0.)
+        return (0., 0., 0., 0., FIT_NOT_CONVERGED)
     except ValueError:  # fit failed
+        return (0., 0., 0., 0., FIT_NOT_CONVERGED)
+
+    return (popt[0], popt[1], popt[2], popt[3], FIT_OK)
+
+
+def fit_ToT(tot_data, scan_param_range, t_est):
+    '''
+        Fit one pixel data with totcurve.
+        Has to be global function for the multiprocessing module.
+
+        Returns:
+            (a, b, c, t, chi2/ndf)
+    '''
+    a, b, c, t, status = _fit_ToT_params(tot_data, scan_param_range, t_est)
+    if status != FIT_OK:
         return (0., 0., 0., 0., 0.)
+    return (a, b, c, t, float(totcurve_chi2ndf(np.array(tot_data, dtype=float), a, b, c, t)))
 
-    return (popt[0], popt[1], popt[2], popt[3], chi2)
 
+@njit(nogil=True, cache=True)
+def _solve_linear(m, v, out):
+    '''
+        Solves the small linear system m * out = v by Gaussian elimination with partial pivoting.
+        Returns False if the system is singular.
+    '''
+    n = v.shape[0]
+    a = m.copy()
+    b = v.copy()
+    for col in range(n):
+        pivot = col
+        for row in range(col + 1, n):
+            if abs(a[row, col]) > abs(a[pivot, col]):
+                pivot = row
+        if a[pivot, col] == 0. or not np.isfinite(a[pivot, col]):
+            return False
+        if pivot != col:
+            for k in range(n):
+                a[col, k], a[pivot, k] = a[pivot, k], a[col, k]
+            b[col], b[pivot] = b[pivot], b[col]
+        for row in range(col + 1, n):
+            factor = a[row, col] / a[col, col]
+            for k in range(col, n):
+                a[row, k] -= factor * a[col, k]
+            b[row] -= factor * b[col]
+    for row in range(n - 1, -1, -1):
+        rest = b[row]
+        for k in range(row + 1, n):
+            rest -= a[row, k] * out[k]
+        out[row] = rest / a[row, row]
+    return True
+
+
+@njit(nogil=True, error_model='numpy', cache=True)
+def _totcurve_ssr(x, y, p):
+    '''
+        Sum of the squared residuals of the totcurve with the parameters p
+    '''
+    ssr = 0.
+    for i in range(x.shape[0]):
+        r = y[i] - (p[0] * x[i] + p[1] - p[2] / (x[i] - p[3]))
+        ssr += r * r
+    return ssr
+
+
+@njit(nogil=True, error_model='numpy', cache=True)
+def _fit_totcurve_lm(x, y, p0, max_iter):
+    '''
+        Levenberg-Marquardt least squares fit of the totcurve a*x + b - c/(x - t) with the start values
+        p0 = (a, b, c, t) and the analytic Jacobian. Returns the fit parameters, the sum of the squared
+        residuals and if the fit converged.
+    '''
+    n = x.shape[0]
+    p = p0.copy()
+    trial = np.empty(4)
+    step = np.empty(4)
+    jtj = np.empty((4, 4))
+    damped = np.empty((4, 4))
+    jtr = np.empty(4)
+    jac = np.empty(4)
+    lam = 1e-3
+
+    ssr = _totcurve_ssr(x, y, p)
+    if not np.isfinite(ssr):
+        return p, ssr, False
+
+    for _ in range(max_iter):
+        # Normal equations of the residuals
+        jtj[:, :] = 0.
+        jtr[:] = 0.
+        for i in range(n):
+            inv = 1. / (x[i] - p[3])
+            jac[0] = x[i]
+            jac[1] = 1.
+            jac[2] = -inv
+            jac[3] = -p[2] * inv * inv
+            r = y[i] - (p[0] * x[i] + p[1] - p[2] * inv)
+            for j in range(4):
+                jtr[j] += jac[j] * r
+                for k in range(j + 1):
+                    jtj[j, k] += jac[j] * jac[k]
+        for j in range(4):
+            for k in range(j):
+                jtj[k, j] = jtj[j, k]
+
+        # Increase the damping until the step decreases the sum of the squared residuals
+        while True:
+            damped[:, :] = jtj
+            for j in range(4):
+                damped[j, j] += lam * max(jtj[j, j], 1e-300)
+            if _solve_linear(damped, jtr, step):
+                trial[:] = p + step
+                trial_ssr = _totcurve_ssr(x, y, trial)
+                if np.isfinite(trial_ssr) and trial_ssr <= ssr:
+                    break
+            lam *= 10.
+            if lam > 1e16:
+                # no step decreases the residuals anymore: minimum reached
+                return p, ssr, True
+
+        decrease = ssr - trial_ssr
+        small_step = True
+        for j in range(4):
+            if abs(step[j]) > 1.49012e-08 * (abs(p[j]) + 1.49012e-08):
+                small_step = False
+        p[:] = trial
+        ssr = trial_ssr
+        lam = max(lam / 10., 1e-12)
+        if small_step or decrease <= 1.49012e-08 * ssr:
+            return p, ssr, True
+
+    return p, ssr, False
+
+
+@njit(nogil=True, error_model='numpy', cache=True)
+def _fit_totcurves_lm(totcurves, a_start, b_start, t_est, max_iter):
+    '''
+        Fits all rows of totcurves like fit_ToT and returns an array with a, b, c, t and chi2/ndf per row
+    '''
+    n_pixels = totcurves.shape[0]
+    result = np.zeros((n_pixels, 5))
+    p0 = np.empty(4)
+
+    for pixel in range(n_pixels):
+        # Deselect steps without ToT data (0 or nan)
+        n = 0
+        for i in range(totcurves.shape[1]):
+            if totcurves[pixel, i] != 0 and not np.isnan(totcurves[pixel, i]):
+                n += 1
+        # Only fit data that is fittable
+        if n < 4:
+            continue
+        x = np.empty(n)
+        y = np.empty(n)
+        n = 0
+        for i in range(totcurves.shape[1]):
+            if totcurves[pixel, i] != 0 and not np.isnan(totcurves[pixel, i]):
+                x[n] = i
+                y[n] = totcurves[pixel, i]
+                n += 1
+
+        p0[0] = a_start[pixel]
+        p0[1] = b_start[pixel]
+        p0[2] = 500.
+        p0[3] = t_est
+        p, _, converged = _fit_totcurve_lm(x, y, p0, max_iter)
+        if not converged:
+            continue
+
+        # chi2/ndf with the Poisson errors sqrt(y) as in fit_ToT
+        chi2 = 0.
+        for i in range(n):
+            r = y[i] - (p[0] * x[i] + p[1] - p[2] / (x[i] - p[3]))
+            chi2 += r * r / y[i]
+        result[pixel, :4] = p
+        result[pixel, 4] = chi2 / (n - 4) if n > 4 else 0.
+
+    return result
+
+
+def fit_totcurves_batch(totcurves, t_est, max_iter=200, progress=None):
+    '''
+        Fits the totcurves (one row per pixel, steps without data are 0 or nan) of all pixels at once
+        like fit_ToT. The linear start values are calculated for all pixels with a closed form least
+        squares fit, the totcurve is fitted with a Levenberg-Marquardt fit with analytic Jacobian.
+        Returns the arrays of a, b, c, t and chi2/ndf, which are 0 for pixels without a valid fit.
+    '''
+    totcurves = np.asarray(totcurves, dtype=np.float64)
+
+    # Linear fit of the data of all pixels in closed form for the start values of a and b
+    valid = (totcurves != 0) & ~np.isnan(totcurves)
+    x = np.arange(totcurves.shape[1], dtype=np.float64)
+    y = np.where(valid, totcurves, 0.)
+    n = valid.sum(axis=1)
+    sum_x = valid.dot(x)
+    sum_xx = valid.dot(x * x)
+    sum_y = y.sum(axis=1)
+    sum_xy = y.dot(x)
+    denominator = n * sum_xx - sum_x ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a_start = np.where(denominator != 0, (n * sum_xy - sum_x * sum_y) / denominator, 0.)
+        b_start = np.where(n > 0, (sum_y - a_start * sum_x) / n, 0.)
+
+    # Fit in blocks of pixels for the progress
+    blocks = np.array_split(np.arange(totcurves.shape[0]), min(100, max(totcurves.shape[0], 1)))
+    result = np.zeros((totcurves.shape[0], 5))
+
+    if progress == None:
+        pbar = tqdm(total=totcurves.shape[0])
+
+    for i, block in enumerate(blocks):
+        if not len(block):
+            continue
+        rows = slice(block[0], block[-1] + 1)
+        result[rows] = _fit_totcurves_lm(totcurves[rows], a_start[rows], b_start[rows], float(t_est), max_iter)
+        if progress == None:
+            pbar.update(len(block))
+        else:
+            progress.put((i + 1) / len(blocks))
+
+    if progress == None:
+        pbar.close()
+
+    return result[:, 0], result[:, 1], result[:, 2], result[:, 3], result[:, 4]
+
+
+def fit_totcurves_multithread(totcurves, scan_param_range, progress = None, method = 'batch'):
+    '''
+        Fits the ToT curves of all pixels and returns the a, b, c, t and chi2/ndf maps.
+        With method 'batch' all pixels are fitted at once with fit_totcurves_batch, with method
+        'curve_fit' every pixel is fitted with fit_ToT in a process pool.
+    '''
+    if method not in ('batch', 'curve_fit'):
+        raise ValueError("Unknown ToT-curve fit method '%s'" % method)
 
-def fit_totcurves_multithread(totcurves, scan_param_range, progress = None):
     totcurves = np.ma.masked_array(totcurves)
     scan_param_range = np.array(scan_param_range)
 
-    logger.info("Start ToT-curve fit on %d CPU core(s)", mp.cpu_count())
-
     t_est = np.average(np.where((totcurves > 0) & (totcurves <= 5))[1])
-    partialfit_totcurves = partial(fit_ToT, scan_param_range=scan_param_range, t_est = t_est)
 
-    result_list = imap_bar(partialfit_totcurves, totcurves.tolist(), progress = progress)
-    result_array = np.array(result_list)
+    if method == 'batch':
+        logger.info("Start batch ToT-curve fit")
+        result_array = np.array(fit_totcurves_batch(totcurves.astype(float).filled(np.nan), t_est, progress = progress)).T
+    else:
+        logger.info("Start ToT-curve fit on %d CPU core(s)", get_fit_executor().n_processes)
+
+        partialfit_totcurves = partial(_fit_ToT_params, scan_param_range=scan_param_range, t_est = t_est)
+
+        result_list = get_fit_executor().map(partialfit_totcurves, totcurves.astype(float).filled(np.nan), progress = progress)
+        result_array = np.array(result_list)
+        # chi2/ndf of all pixels at once from the residuals to the fit results
+        fitted = result_array[:, 4] == FIT_OK
+        result_array[:, 4] = 0.
+        result_array[fitted, 4] = totcurve_chi2ndf(totcurves.astype(float).filled(np.nan)[fitted], *result_array[fitted, :4].T)
     logger.info("ToT-curve fit finished")
 
     a = result_array[:, 0]
@@ -1120,11 +2271,60 @@ def fit_totcurves_mean(totcurves, scan_param_range, progress = None):
     return mean, popt, pcov
 
 
-# init LUTs
-init_lfsr_4_lut()
-init_lfsr_10_lut()
-init_lfsr_14_lut()
-init_gray_14_lut()
+def _kernel_signatures():
+    '''
+        Explicit signatures of the histogram kernels for the column types of the hit_data
+    '''
+    def column(name):
+        # Columns of the structured hit_data are strided views
+        return numba.types.Array(numba.from_dtype(np.dtype(_hit_data_type['formats'][_hit_data_type['names'].index(name)])), 1, 'A')
+
+    x, y, param_id, counter, tot = column('x'), column('y'), column('scan_param_id'), column('EventCounter'), column('TOT')
+    return [(_scurve_hist, (x, y, param_id, counter, numba.int64, numba.int64)),
+            (_totcurve_hist, (x, y, tot, numba.int64)),
+            (_noise_pixel_count, (x, y, param_id, counter, numba.int64, numba.int64))]
+
+
+def warmup_kernels():
+    '''
+        Compiles the numba kernels of the analysis into the on-disk cache of numba, so that the
+        first analysis in a new process loads them instead of compiling them. The histogram
+        kernels are compiled for their explicit signatures, the interpretation and fit kernels
+        by running them on a small synthetic data set.
+    '''
+    start = time.time()
+    for kernel, signature in _kernel_signatures():
+        kernel.compile(signature)
+
+    # Hits of all links: pairs of 32 bit packages with the link number in bits 25 to 27 and bit 24
+    # set in the first package. The first scan parameter starts with two FPGA timestamps.
+    links = np.repeat(np.arange(8, dtype=np.uint32), 16) << np.uint32(25)
+    payload = np.arange(1, 129, dtype=np.uint32)
+    raw_data = np.empty(260, dtype=np.uint32)
+    raw_data[0:4] = [(0b0101 << 28), (0b0101 << 28) | (1 << 24) | 1000, (0b0101 << 28), (0b0101 << 28) | (1 << 24) | 2000]
+    raw_data[4::2] = links | np.uint32(1 << 24) | payload
+    raw_data[5::2] = links | payload
+    meta_data = np.zeros(2, dtype=[('index_start', 'u8'), ('index_stop', 'u8'), ('timestamp_start', 'f8'), ('scan_param_id', 'u4')])
+    meta_data['index_start'] = [0, 132]
+    meta_data['index_stop'] = [132, 260]
+    meta_data['scan_param_id'] = [0, 1]
+    progress = Queue()
+    for op_mode in (0, 2):
+        interpret_raw_data(raw_data, op_mode, False, meta_data, progress=progress)
+    raw_data_to_scurve_hist(raw_data, meta_data, 2, progress=progress)
+    # Online histogramming of the readouts
+    scurves = np.zeros((256 * 256, 2), dtype=np.uint32)
+    pix_occ = np.zeros(256 * 256, dtype=np.int64)
+    state = _scurve_hist_state()
+    _scurve_hist_words(raw_data[4:], 0, scurves, pix_occ, *state)
+    _scurve_hist_flush(0, scurves, pix_occ, *state)
+    save_and_correct(raw_data, np.arange(raw_data.shape[0]))
+
+    th_means(np.ones(11, dtype=np.uint16), np.ones(11, dtype=np.uint16), 0, 10)
+    fit_scurves_batch(np.full((1, 4), 100, dtype=np.uint16), np.arange(4), 100, 1., progress=progress)
+    fit_totcurves_batch(np.arange(8, dtype=float).reshape(1, 8) + 1, 1., progress=progress)
+    logger.info("Compiled the analysis kernels in %.1f s", time.time() - start)
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,102 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Writing of the readouts to the HDF5 file while a scan is running
+'''
+from __future__ import absolute_import
+from __future__ import division
+import numpy as np
+from threading import Lock
+from time import time
+
+
+class DataWriter(object):
+    '''
+        Writes the readouts to the raw data earray and the meta data table of the HDF5 file.
+        The readouts are collected in a batch, which is appended and flushed when it contains
+        batch_words words or batch_rows readouts, or flush_interval seconds after its first
+        readout. The age of the batch is checked with every readout and with flush_due(), which
+        the FifoReadout calls while there are no readouts. Readouts with more than batch_words
+        words are appended directly.
+        index_start and index_stop of the meta data refer to the words in the raw data earray.
+    '''
+
+    def __init__(self, raw_data_earray, meta_data_table, batch_words=2**20, batch_rows=1000, flush_interval=1.):
+        self.raw_data_earray = raw_data_earray
+        self.meta_data_table = meta_data_table
+        self.batch_words = batch_words
+        self.flush_interval = flush_interval
+        self.total_words = raw_data_earray.nrows
+        self.n_writes = 0
+
+        self._words = np.empty(batch_words, dtype=np.uint32)
+        self._rows = np.zeros(batch_rows, dtype=meta_data_table.dtype)
+        self._n_words = 0
+        self._n_rows = 0
+        self._batch_start = None
+        self._lock = Lock()
+
+    def add(self, data_tuple, scan_param_id):
+        '''
+            Adds a readout (the data tuple of the FifoReadout) to the batch. The raw data is copied.
+        '''
+        raw_data = data_tuple[0]
+        len_raw_data = raw_data.shape[0]
+        with self._lock:
+            if self._n_words + len_raw_data > self.batch_words or self._n_rows == self._rows.shape[0]:
+                self._write()
+            if self._batch_start is None:
+                self._batch_start = time()
+
+            if len_raw_data > self.batch_words:
+                self.raw_data_earray.append(raw_data)
+            else:
+                self._words[self._n_words:self._n_words + len_raw_data] = raw_data
+                self._n_words += len_raw_data
+
+            row = self._rows[self._n_rows:self._n_rows + 1]
+            row['timestamp_start'] = data_tuple[1]
+            row['timestamp_stop'] = data_tuple[2]
+            row['discard_error'] = data_tuple[3]
+            row['decode_error'] = data_tuple[4]
+            row['data_length'] = len_raw_data
+            row['index_start'] = self.total_words
+            self.total_words += len_raw_data
+            row['index_stop'] = self.total_words
+            row['scan_param_id'] = scan_param_id
+            self._n_rows += 1
+
+            if time() - self._batch_start >= self.flush_interval:
+                self._write()
+
+    def flush_due(self):
+        '''
+            Writes the batch to the file if its first readout was added flush_interval seconds ago
+        '''
+        with self._lock:
+            if self._batch_start is not None and time() - self._batch_start >= self.flush_interval:
+                self._write()
+
+    def flush(self):
+        '''
+            Writes the batch to the file, all added readouts are in the file afterwards
+        '''
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        if not self._n_rows:
+            return
+        self.raw_data_earray.append(self._words[:self._n_words])
+        self.meta_data_table.append(self._rows[:self._n_rows])
+        self.raw_data_earray.flush()
+        self.meta_data_table.flush()
+        self._n_words = 0
+        self._n_rows = 0
+        self._batch_start = None
+        self.n_writes += 1
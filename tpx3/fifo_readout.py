@@ -12,9 +12,9 @@ import datetime
 import logging
 import numpy as np
 from time import sleep, time, mktime
-from threading import Thread, Event
+from threading import Thread, Event, Lock, current_thread
 from collections import deque
-from six.moves.queue import Queue, Empty
+from six.moves.queue import Queue, Empty, Full
 
 loglevel = logging.getLogger('RD53A').getEffectiveLevel()
 
@@ -41,9 +41,120 @@ class StopTimeout(Exception):
     pass
 
 
-class FifoReadout(object):
+class RingBuffer(object):
+    '''
+        Preallocated buffer for the 32 bit words of the readouts. The words of a readout are written
+        contiguously into the buffer and the readout is handed over as a view on them. The space of
+        a readout is reused after it is released, the readouts have to be released in the order of
+        their commit.
+    '''
+
+    def __init__(self, size):
+        self._buffer = np.empty(size, dtype=np.uint32)
+        self._lock = Lock()
+        self._chunks = deque()  # (start, stop) of the committed readouts which are not released
+        self._tail = 0  # end of the last committed readout
+        self._wrapped = False  # the committed readouts continue at the beginning of the buffer
+        self._start = 0  # start of the readout which is written
+        self._stop = 0  # end of the words written to this readout
+
+    @property
+    def size(self):
+        return self._buffer.shape[0]
+
+    def _fits(self, start, stop):
+        '''
+            Checks if the words from start to stop are not used by committed readouts. As the readouts
+            are released in order, they use the words from the start of the oldest one to _tail.
+        '''
+        if stop > self._buffer.shape[0]:
+            return False
+        with self._lock:
+            if not self._chunks:
+                return True
+            head = self._chunks[0][0]
+            if self._wrapped:
+                return start >= self._tail and stop <= head
+            return stop <= head or start >= self._tail
+
+    def write(self, words):
+        '''
+            Appends the words to the readout which is written. Returns False if there is no
+            contiguous space for them, the readout is not changed then.
+        '''
+        n_words = words.shape[0]
+        if self._fits(self._stop, self._stop + n_words):
+            self._buffer[self._stop:self._stop + n_words] = words
+            self._stop += n_words
+            return True
+        # Wrap around: the readout is moved to the beginning of the buffer
+        n_old = self._stop - self._start
+        if self._start > 0 and self._fits(0, n_old + n_words):
+            self._buffer[:n_old] = self._buffer[self._start:self._stop]
+            self._buffer[n_old:n_old + n_words] = words
+            self._start, self._stop = 0, n_old + n_words
+            return True
+        return False
+
+    def discard(self):
+        '''
+            Removes the words of the readout which is written from the buffer. Returns a view on them,
+            which is valid until the next write.
+        '''
+        words = self._buffer[self._start:self._stop]
+        self._stop = self._start
+        return words
 
-    def __init__(self, chip, readout_interval, moving_average_time_period):
+    def commit(self):
+        '''
+            Completes the readout which is written and returns a view on its words, which is valid
+            until the readout is released
+        '''
+        data = self._buffer[self._start:self._stop]
+        with self._lock:
+            if self._chunks and self._start < self._tail:
+                self._wrapped = True
+            self._chunks.append((self._start, self._stop))
+            self._tail = self._stop
+        self._start = self._stop
+        return data
+
+    def release(self):
+        '''
+            Releases the oldest committed readout
+        '''
+        with self._lock:
+            start, _ = self._chunks.popleft()
+            if not self._chunks or self._chunks[0][0] < start:
+                self._wrapped = False
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+            self._tail = 0
+            self._wrapped = False
+        self._start = self._stop = 0
+
+
+class FifoReadout(object):
+    '''
+        Reads the FIFO in a readout thread and hands the data of every readout_interval to the
+        callbacks. Every callback is a consumer with its own worker thread and a queue of at most
+        queue_size readouts. All consumers get the same readouts: the words are collected in a
+        RingBuffer of ring_buffer_size words and the callbacks get a view on them, which is only
+        valid until the callback returns. Consumers which keep the data after the callback have
+        to copy it. If the queue of a consumer is full the readout thread waits for it, so the
+        data is buffered in the FIFO of the hardware meanwhile.
+        With adaptive the interval of the readouts is doubled after every readout without data up to
+        max_readout_interval and is reset to readout_interval as soon as there is data. The empty
+        FIFO is only read once per interval. The RX error counters are read at most every
+        error_read_interval seconds and with the last readout. The errors of a read are reported with
+        the readout in which they are read and with the following readouts until the next read, so a
+        readout without errors is only reported as such after a read of the counters without errors.
+    '''
+
+    def __init__(self, chip, readout_interval, moving_average_time_period, ring_buffer_size=2**24, queue_size=1000,
+                 adaptive=False, max_readout_interval=0.1, error_read_interval=0.):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(loglevel)
 
@@ -51,13 +162,25 @@ class FifoReadout(object):
         self.callback = None
         self.errback = None
         self.readout_thread = None
-        self.worker_thread = None
+        self.worker_threads = []
         self.watchdog_thread = None
         self.fill_buffer = False
         self.readout_interval = readout_interval
+        self.adaptive = adaptive
+        self.max_readout_interval = max(max_readout_interval, readout_interval)
+        self.error_read_interval = error_read_interval
+        self._interval = readout_interval
+        self._last_error_read = 0.
+        self._last_errors = (0, 0)
         self._moving_average_time_period = moving_average_time_period
-        self._data_deque = deque()
+        self.queue_size = queue_size
+        self._data_queues = []
+        self._queue_high_water = []
+        self._queue_full_count = 0
+        self._release_lock = Lock()
         self._data_buffer = deque()
+        self._ring_buffer = RingBuffer(ring_buffer_size)
+        self._ring_buffer_overflows = 0
         self._words_per_read = deque(maxlen=int(self._moving_average_time_period / self.readout_interval))
         self._result = Queue(maxsize=1)
         self._calculate = Event()
@@ -76,10 +199,21 @@ class FifoReadout(object):
 
     @property
     def is_alive(self):
-        if self.worker_thread:
-            return self.worker_thread.is_alive()
-        else:
-            False
+        return any(worker_thread.is_alive() for worker_thread in self.worker_threads)
+
+    @property
+    def queue_depth(self):
+        '''
+            Number of readouts waiting in the queue of every consumer
+        '''
+        return [data_queue.qsize() for data_queue in self._data_queues]
+
+    @property
+    def queue_high_water(self):
+        '''
+            Maximum number of readouts which waited in the queue of every consumer since start()
+        '''
+        return list(self._queue_high_water)
 
     @property
     def data(self):
@@ -99,7 +233,12 @@ class FifoReadout(object):
             return None
         return result / float(self._moving_average_time_period)
 
-    def start(self, callback=None, errback=None, reset_rx=False, reset_sram_fifo=False, reset_errors=True, clear_buffer=False, fill_buffer=False, no_data_timeout=None):
+    def start(self, callback=None, errback=None, reset_rx=False, reset_sram_fifo=False, reset_errors=True, clear_buffer=False, fill_buffer=False, no_data_timeout=None, idle=None):
+        '''
+            Starts the readout. callback is a function or a list of functions, which get the data tuple of every readout.
+            idle is a function for the first callback or a list of functions (None for callbacks without one),
+            which the worker of the callback calls when there was no readout for readout_interval seconds.
+        '''
         if self._is_running:
             raise RuntimeError('Readout already running: use stop() before start()')
 
@@ -121,18 +260,40 @@ class FifoReadout(object):
                 self.logger.warning('FIFO not empty when starting FIFO readout: size = %i', fifo_size)
         self._words_per_read.clear()
         if clear_buffer:
-            self._data_deque.clear()
             self._data_buffer.clear()
+        self._ring_buffer.clear()
+        self._ring_buffer_overflows = 0
+        if callback is None:
+            callbacks = []
+        elif isinstance(callback, (list, tuple)):
+            callbacks = list(callback)
+        else:
+            callbacks = [callback]
+        if idle is None:
+            idles = [None] * len(callbacks)
+        elif isinstance(idle, (list, tuple)):
+            idles = list(idle)
+        else:
+            idles = [idle]
+        self._data_queues = [Queue(maxsize=self.queue_size) for _ in callbacks]
+        self._queue_high_water = [0] * len(callbacks)
+        self._queue_full_count = 0
+        self._interval = self.readout_interval
+        self._last_error_read = 0.
+        self._last_errors = (0, 0)
         self.stop_readout.clear()
         self.force_stop.clear()
         if self.errback:
             self.watchdog_thread = Thread(target=self.watchdog, name='WatchdogThread')
             self.watchdog_thread.daemon = True
             self.watchdog_thread.start()
-        if self.callback:
-            self.worker_thread = Thread(target=self.worker, name='WorkerThread')
-            self.worker_thread.daemon = True
-            self.worker_thread.start()
+        self.worker_threads = []
+        for i, (consumer, consumer_idle, data_queue) in enumerate(zip(callbacks, idles, self._data_queues)):
+            name = 'WorkerThread' if len(callbacks) == 1 else 'WorkerThread-%s' % getattr(consumer, '__name__', i)
+            worker_thread = Thread(target=self.worker, name=name, args=(consumer, data_queue, consumer_idle))
+            worker_thread.daemon = True
+            worker_thread.start()
+            self.worker_threads.append(worker_thread)
         self.readout_thread = Thread(target=self.readout, name='ReadoutThread', kwargs={'no_data_timeout': no_data_timeout})
         self.readout_thread.daemon = True
         self.readout_thread.start()
@@ -160,8 +321,8 @@ class FifoReadout(object):
             self.readout_thread.join()
         if self.errback:
             self.watchdog_thread.join()
-        if self.callback:
-            self.worker_thread.join()
+        for worker_thread in self.worker_threads:
+            worker_thread.join()
         self.callback = None
         self.errback = None
         self.logger.debug('Stopped FIFO readout')
@@ -179,7 +340,14 @@ class FifoReadout(object):
             self.logger.warning('RX errors detected')
 
         self.logger.info('Received words:              %d', self._record_count)
-        self.logger.info('Data queue size:             %d', len(self._data_deque))
+        self.logger.info('Data queue size:             %s', " | ".join([repr(depth) for depth in self.queue_depth]))
+        self.logger.info('Data queue high water:       %s', " | ".join([repr(depth) for depth in self.queue_high_water]))
+        self.logger.info('Data queue full:             %d', self._queue_full_count)
+        self.logger.info('Ring buffer overflows:       %d', self._ring_buffer_overflows)
+        if self.adaptive:
+            self.logger.info('Readout interval:            %0.3f s (%0.3f s - %0.3f s)', self._interval, self.readout_interval, self.max_readout_interval)
+        else:
+            self.logger.info('Readout interval:            %0.3f s', self.readout_interval)
         self.logger.info('FIFO size:                   %d', self.chip['FIFO']['FIFO_SIZE'])
         self.logger.info('Channel:                     %s', " | ".join([channel.name.rjust(3) for channel in self.chip.get_modules('tpx3_rx')]))
         self.logger.info('RX sync:                     %s', " | ".join(["YES".rjust(3) if status is True else "NO".rjust(3) for status in sync_status]))
@@ -190,9 +358,48 @@ class FifoReadout(object):
         self.logger.info('RX FIFO discard counter:     %s', " | ".join([repr(count).rjust(3) for count in discard_count]))
         self.logger.info('RX decode errors:            %s', " | ".join([repr(count).rjust(3) for count in decode_error_count]))
 
+    def _read_interval(self, time_read):
+        '''
+            Reads the FIFO until readout_interval after time_read into the ring buffer and returns the
+            data. If the ring buffer is full the data is collected in a separate array.
+            With adaptive and an empty FIFO the thread waits for the end of the current interval instead
+            of polling the FIFO.
+        '''
+        interval = self._interval if self.adaptive and not self.stop_readout.is_set() else self.readout_interval
+        overflow = None
+        n_words = 0
+        while True:
+            words = self.read_data()
+            elapsed = time() - time_read
+            if not words.shape[0]:
+                if self.adaptive and not n_words and not self.stop_readout.is_set():
+                    if not self.stop_readout.wait(interval - elapsed):
+                        break
+                    time_read = time()  # stopped while waiting, read the remaining data as without adaptive
+                    continue
+                if elapsed >= self.readout_interval:
+                    break
+                continue
+            n_words += words.shape[0]
+            if overflow is None and not self._ring_buffer.write(words):
+                overflow = [self._ring_buffer.discard()]
+                self._ring_buffer_overflows += 1
+            if overflow is not None:
+                overflow.append(words)
+            if elapsed >= self.readout_interval:
+                break
+        if self.adaptive:
+            self._interval = self.readout_interval if n_words else min(2 * self._interval, self.max_readout_interval)
+        data = self._ring_buffer.commit()
+        if overflow is not None:
+            # The empty readout in the ring buffer keeps the order of the releases
+            data = np.concatenate(overflow)
+        return data
+
     def readout(self, no_data_timeout=None):
         '''
-            Readout thread continuously reading FIFO. Uses read_data() and appends data to self._data_deque (collection.deque).
+            Readout thread continuously reading FIFO. Uses read_data() to fill the ring buffer and puts
+            the data of every readout_interval into the queues of the consumers.
         '''
         self.logger.debug('Starting %s', self.readout_thread.name)
         curr_time = self.get_float_time()
@@ -203,14 +410,11 @@ class FifoReadout(object):
                 if no_data_timeout and curr_time + no_data_timeout < self.get_float_time():
                     raise NoDataTimeout('Received no data for %0.1f second(s)' % no_data_timeout)
 
-                # TODO: maybe not best solution?
-                dlist = []
-                while time() - time_read < self.readout_interval:
-                    dlist.extend(self.read_data())
-                data = np.asarray(dlist, dtype=np.uint32)
+                data = self._read_interval(time_read)
 
                 self._record_count += len(data)
             except Exception:
+                self._ring_buffer.discard()  # drop the words of the incomplete readout
                 no_data_timeout = None  # raise exception only once
                 if self.errback:
                     self.errback(sys.exc_info())
@@ -221,17 +425,24 @@ class FifoReadout(object):
             else:
                 n_words = data.shape[0]
                 last_time, curr_time = self.update_timestamp()
-                discard_error = int(np.sum(self.get_rx_fifo_discard_count(), dtype=np.uint32))
-                decode_error = int(np.sum(self.get_rx_decode_error_count(), dtype=np.uint32))
-                if self.callback:
-                    self._data_deque.append((data, last_time, curr_time, discard_error, decode_error))
+                read_errors = self.stop_readout.is_set() or time() - self._last_error_read >= self.error_read_interval
+                if read_errors:
+                    self._last_error_read = time()
+                    self._last_errors = (int(np.sum(self.get_rx_fifo_discard_count(), dtype=np.uint32)),
+                                         int(np.sum(self.get_rx_decode_error_count(), dtype=np.uint32)))
+                # Readouts without a read of the counters get the values of the last read
+                discard_error, decode_error = self._last_errors
                 if self.fill_buffer:
-                    self._data_buffer.append((data, last_time, curr_time, discard_error, decode_error))
+                    self._data_buffer.append((data.copy(), last_time, curr_time, discard_error, decode_error))
+                if self._data_queues:
+                    self._put((data, last_time, curr_time, discard_error, decode_error))
+                else:
+                    self._ring_buffer.release()
                 self._words_per_read.append(n_words)
                 # FIXME: busy FE prevents scan termination? To be checked
                 if n_words == 0 and self.stop_readout.is_set():
                     break
-                if discard_error > 0 or decode_error > 0:
+                if read_errors and (discard_error > 0 or decode_error > 0):
                     self.logger.warning('There were {} discard errors and {} decode errors - Resetting error counters'.format(discard_error, decode_error))
                     self.rx_error_reset()
             finally:
@@ -239,30 +450,63 @@ class FifoReadout(object):
             if self._calculate.is_set():
                 self._calculate.clear()
                 self._result.put(sum(self._words_per_read))
-        if self.callback:
-            self._data_deque.append(None)  # last item, will stop worker
+        for data_queue in self._data_queues:
+            data_queue.put(None)  # last item, will stop worker
         self.logger.debug('Stopped %s', self.readout_thread.name)
 
-    def worker(self):
+    def _put(self, data):
         '''
-            Worker thread continuously calling callback function when data is available.
+            Puts a readout into the queues of all consumers. Waits while a queue is full, until the
+            consumer takes a readout or the readout is stopped by force.
         '''
-        self.logger.debug('Starting %s', self.worker_thread.name)
-        while True:
+        item = (data, [len(self._data_queues)])  # the readout is released when no consumer uses it anymore
+        for i, data_queue in enumerate(self._data_queues):
             try:
-                data = self._data_deque.popleft()
-            except IndexError:
-                self.stop_readout.wait(self.readout_interval)  # sleep a little bit, reducing CPU usage
-            else:
-                if data is None:  # if None then exit
-                    break
-                else:
+                data_queue.put(item, block=False)
+            except Full:
+                self._queue_full_count += 1
+                while True:
                     try:
-                        self.callback(data)
-                    except Exception:
-                        self.errback(sys.exc_info())
+                        data_queue.put(item, timeout=self.readout_interval)
+                        break
+                    except Full:
+                        if self.force_stop.is_set():
+                            self._release(item)
+                            break
+            self._queue_high_water[i] = max(self._queue_high_water[i], data_queue.qsize())
+
+    def _release(self, item):
+        with self._release_lock:
+            item[1][0] -= 1
+            if item[1][0] == 0:
+                self._ring_buffer.release()
+
+    def worker(self, callback, data_queue, idle=None):
+        '''
+            Worker thread calling the callback function for every readout of its queue and idle
+            while the queue stays empty.
+        '''
+        name = current_thread().name
+        self.logger.debug('Starting %s', name)
+        while True:
+            try:
+                item = data_queue.get(timeout=None if idle is None else self.readout_interval)
+            except Empty:
+                try:
+                    idle()
+                except Exception:
+                    self.errback(sys.exc_info())
+                continue
+            if item is None:  # if None then exit
+                break
+            try:
+                callback(item[0])
+            except Exception:
+                self.errback(sys.exc_info())
+            finally:
+                self._release(item)
 
-        self.logger.debug('Stopped %s', self.worker_thread.name)
+        self.logger.debug('Stopped %s', name)
 
     def watchdog(self):
         self.logger.debug('Starting %s', self.watchdog_thread.name)
@@ -286,8 +530,8 @@ class FifoReadout(object):
 
             Returns
             ----------
-            data : list
-                    A list of FIFO data words.
+            data : numpy.ndarray
+                    Array of the FIFO data words (32 bit).
         '''
         return self.chip['FIFO'].get_data()
 
@@ -0,0 +1,103 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Look up tables for the decoding of the Timepix3 LFSR and gray counters
+    (Manual v1.9 page 19). The tables are generated with plain integer arithmetic
+    on first use and shared by all users in the process.
+'''
+from __future__ import absolute_import
+from __future__ import division
+import numpy as np
+from six.moves import range
+
+# Bits of the previous LFSR state which are combined by XOR into the new bit 0
+_lfsr_taps = {4: (2, 3),
+              10: (6, 9),
+              14: (1, 11, 12, 13)}
+
+_luts = {}
+
+
+def lfsr_states(bits):
+    '''
+        Returns the LFSR states of 2**bits counting steps starting with all bits set,
+        the state at index i corresponds to the count i
+    '''
+    mask = (1 << bits) - 1
+    taps = _lfsr_taps[bits]
+    states = np.empty(2 ** bits, dtype=np.uint16)
+    lfsr = mask
+    for i in range(2 ** bits):
+        states[i] = lfsr
+        feedback = 0
+        for tap in taps:
+            feedback ^= lfsr >> tap
+        lfsr = ((lfsr << 1) & mask) | (feedback & 1)
+    return states
+
+
+def _lfsr_lut(bits):
+    states = lfsr_states(bits)
+    lut = np.zeros(2 ** bits, dtype=np.uint16)
+    lut[states] = np.arange(2 ** bits, dtype=np.uint16)
+    lut[2 ** bits - 1] = 0
+    return lut
+
+
+def _gray_lut(bits):
+    lut = np.arange(2 ** bits, dtype=np.uint16)
+    shift = 1
+    while shift < bits:
+        lut ^= lut >> shift
+        shift *= 2
+    return lut
+
+
+def _get(name, generator, bits):
+    if name not in _luts:
+        lut = generator(bits)
+        lut.flags.writeable = False
+        _luts[name] = lut
+    return _luts[name]
+
+
+def lfsr_4_lut():
+    '''
+        Returns the 4 bit LFSR look up table (hit counter)
+    '''
+    return _get('lfsr_4', _lfsr_lut, 4)
+
+
+def lfsr_10_lut():
+    '''
+        Returns the 10 bit LFSR look up table (ToT and event counter)
+    '''
+    return _get('lfsr_10', _lfsr_lut, 10)
+
+
+def lfsr_14_lut():
+    '''
+        Returns the 14 bit LFSR look up table (integral ToT)
+    '''
+    return _get('lfsr_14', _lfsr_lut, 14)
+
+
+def gray_14_lut():
+    '''
+        Returns the 14 bit gray decoding look up table (ToA)
+    '''
+    return _get('gray_14', _gray_lut, 14)
+
+
+def lfsr_dict(bits):
+    '''
+        Returns the LFSR look up table as dict from state to count, containing only the
+        states which the LFSR runs through
+    '''
+    lut = _get('lfsr_%d' % bits, _lfsr_lut, bits)
+    return {int(state): int(lut[state]) for state in np.unique(lfsr_states(bits))}
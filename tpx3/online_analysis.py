@@ -0,0 +1,100 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Histogramming of the raw data while a scan is running
+'''
+from __future__ import absolute_import
+from __future__ import division
+import logging
+import numpy as np
+
+import tpx3.analysis as analysis
+
+
+class OnlineHistogramming(object):
+    '''
+        Histograms the readouts of a scan while the scan is running. The readouts are histogrammed with
+        histogram() on the thread of the caller (e.g. a consumer of the FifoReadout) with the scan_param_id
+        they belong to, all readouts of one scan parameter have to follow one another. After the last readout
+        stop() completes the histograms. The histograms are the same as the ones of the offline analysis of the scan:
+        - scurves and pix_occ as from analysis.raw_data_to_scurve_hist (Event/iToT mode), the readouts are
+          histogrammed as they arrive
+        - totcurves_means and totcurves_hits as from analysis.totcurve_hist per scan parameter (ToT mode).
+          The ToT histogram depends on the order of the hits, so the readouts are only copied as they arrive
+          and all readouts of a scan parameter are interpreted and histogrammed when the scan parameter changes.
+    '''
+
+    def __init__(self, n_params, op_mode=2, vco=False, scurve=True, tot=False):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.n_params = n_params
+        self.op_mode = op_mode
+        self.vco = vco
+        self.pix_occ = np.zeros(256 * 256, dtype=np.int64)
+        self.scurves = np.zeros((256 * 256, n_params), dtype=np.uint32) if scurve else None
+        self.totcurves_means = np.zeros((256 * 256, n_params), dtype=np.uint32) if tot else None
+        self.totcurves_hits = np.zeros((256 * 256, n_params), dtype=np.uint32) if tot else None
+
+        self.complete = False
+        self._failed = False
+        self._state = analysis._scurve_hist_state()
+        self._scan_param_id = None
+        self._tot_data = []
+
+    def histogram(self, raw_data, scan_param_id):
+        '''
+            Histograms a readout in the calling thread. The readout is only copied in ToT mode.
+        '''
+        if self._failed:
+            return
+        try:
+            if scan_param_id != self._scan_param_id:
+                self._finish_param()
+                self._scan_param_id = scan_param_id
+            if scan_param_id < 0 or scan_param_id >= self.n_params:
+                raise ValueError('Readout with scan_param_id %d is outside of the %d histogram columns' % (scan_param_id, self.n_params))
+
+            if self.scurves is not None:
+                analysis._scurve_hist_words(raw_data, scan_param_id, self.scurves, self.pix_occ, *self._state)
+            if self.totcurves_means is not None:
+                self._tot_data.append(np.array(raw_data, dtype=np.uint32))
+        except Exception:
+            self.logger.exception('Histogramming of the scan data failed, the histograms have to be created offline')
+            self._failed = True
+
+    def stop(self):
+        '''
+            Completes the histograms after the last readout. Afterwards complete tells if the histograms
+            contain all readouts.
+        '''
+        if not self._failed:
+            try:
+                self._finish_param()
+            except Exception:
+                self.logger.exception('Histogramming of the scan data failed, the histograms have to be created offline')
+                self._failed = True
+        self.complete = not self._failed
+
+    def _finish_param(self):
+        '''
+            Completes the histograms of the current scan parameter
+        '''
+        if self._scan_param_id is None:
+            return
+
+        if self.scurves is not None:
+            analysis._scurve_hist_flush(self._scan_param_id, self.scurves, self.pix_occ, *self._state)
+
+        # The ToT histogram depends on the order of the hits, so all data of the scan parameter is interpreted at once
+        if self.totcurves_means is not None and len(self._tot_data):
+            hit_data = analysis.interpret_raw_data(np.concatenate(self._tot_data), self.op_mode, self.vco, columns = ['data_header', 'x', 'y', 'TOT'])
+            hit_data = hit_data[hit_data['data_header'] == 1]
+            self.totcurves_means[:, self._scan_param_id], self.totcurves_hits[:, self._scan_param_id] = analysis.totcurve_hist(hit_data)
+            if self.scurves is None:
+                self.pix_occ += np.bincount(hit_data['x'].astype(np.uint32) * 256 + hit_data['y'].astype(np.uint32), minlength=256 * 256)
+        self._tot_data = []
@@ -10,26 +10,12 @@ from online_monitor.utils import utils
 from zmq.utils import jsonapi
 
 import tpx3.analysis as analysis
+import tpx3.lut as lut
 from numba.tests.npyufunc.test_ufunc import dtype
 
 logger = logging.getLogger('Online_Interpreter')
 
-_lfsr_10_lut = np.zeros((2 ** 10), dtype=np.uint16)
-
-def init_lfsr_10_lut():
-    """
-    Generates a 10bit LFSR according to Manual v1.9 page 19
-    """
-    lfsr = 1023
-    dummy = 0
-    for i in range(2 ** 10):
-        _lfsr_10_lut[lfsr] = i
-        dummy = lfsr >> 9
-        lfsr = (lfsr << 1) & 0b1111111111
-        lfsr += ((lfsr & 0b10000000) >> 7) ^ dummy
-    _lfsr_10_lut[2 ** 10 - 1] = 0
-
-init_lfsr_10_lut()
+_lfsr_10_lut = lut.lfsr_10_lut()
 
 def _interpret_raw_data(data):
     pixel = np.uint32(data >> np.uint32(28)) & np.uint32(0b111)
@@ -21,6 +21,9 @@ from basil.utils.BitLogic import BitLogic
 from contextlib import contextmanager
 from .tpx3 import TPX3
 from .fifo_readout import FifoReadout
+from .online_analysis import OnlineHistogramming
+from .data_writer import DataWriter
+import tpx3.analysis as analysis
 from tpx3.utils import check_user_folders, get_equal_path, get_software_version
 from tables.exceptions import NoSuchNodeError
 import six
@@ -39,6 +42,7 @@ class MetaTable(tb.IsDescription):
     timestamp_start = tb.Float64Col(pos=3)
     timestamp_stop = tb.Float64Col(pos=4)
     scan_param_id = tb.UInt32Col(pos=5)
+    # RX error counters of the last read of the counters, see FifoReadout.error_read_interval
     discard_error = tb.UInt32Col(pos=6)
     decode_error = tb.UInt32Col(pos=7)
     trigger = tb.Float64Col(pos=8)
@@ -100,6 +104,9 @@ class ScanBase(object):
     '''
 
     def __init__(self, dut_conf=None, no_chip=False, run_name = None):
+        self.histogramming = None
+        self.storage = None
+
         # Initialize the chip
         if no_chip == False:
             self.chip = TPX3(dut_conf)
@@ -594,23 +601,27 @@ class ScanBase(object):
             Setup the HDF5 file by creating the earrays and tables for raw_data and meta_data
             If a scan has multiple iterations individual earrays and tables can be created for
             each iteration
+            The compression and chunkshape of the datasets are set by self.storage (see analysis.storage_options)
         '''
 
-        filter_raw_data = tb.Filters(complib='blosc', complevel=5, fletcher32=False)
-        self.filter_tables = tb.Filters(complib='zlib', complevel=5, fletcher32=False)
+        raw_data_options = analysis.storage_options('raw_data', self.storage)
+        meta_data_options = analysis.storage_options('meta_data', self.storage)
 
         # Scans without multiple iterations
         if iteration == None:
             self.raw_data_earray = self.h5_file.create_earray(self.h5_file.root, name='raw_data', atom=tb.UIntAtom(),
-                                                            shape=(0,), title='raw_data', filters=filter_raw_data)
+                                                            shape=(0,), title='raw_data', **raw_data_options)
             self.meta_data_table = self.h5_file.create_table(self.h5_file.root, name='meta_data', description=MetaTable,
-                                                            title='meta_data', filters=self.filter_tables)
+                                                            title='meta_data', **meta_data_options)
         # Scans with multiple iterations
         else:
             self.raw_data_earray = self.h5_file.create_earray(self.h5_file.root, name='raw_data_' + str(iteration), atom=tb.UIntAtom(),
-                                                            shape=(0,), title='raw_data_' + str(iteration), filters=filter_raw_data)
+                                                            shape=(0,), title='raw_data_' + str(iteration), **raw_data_options)
             self.meta_data_table = self.h5_file.create_table(self.h5_file.root, name='meta_data_' + str(iteration), description=MetaTable,
-                                                            title='meta_data_' + str(iteration), filters=self.filter_tables)
+                                                            title='meta_data_' + str(iteration), **meta_data_options)
+
+        # The readouts are written in batches to the new earray and table
+        self.data_writer = DataWriter(self.raw_data_earray, self.meta_data_table)
 
     def configure(self, **kwargs):
         '''
@@ -622,9 +633,16 @@ class ScanBase(object):
         self.load_mask_matrix(**kwargs)
         self.load_thr_matrix(**kwargs)
 
-    def start(self, readout_interval = 0.005, moving_average_time_period = 10, iteration = None, status = None, **kwargs):
+    def start(self, readout_interval = 0.005, moving_average_time_period = 10, iteration = None, status = None, online_analysis = False,
+              adaptive_readout = False, max_readout_interval = 0.1, error_read_interval = 0.1, storage = None, **kwargs):
         '''
             Prepares the scan and starts the actual test routine
+            With online_analysis scans which support it histogram the data while it is taken (see start_histogramming),
+            the analysis then uses these histograms and interprets the raw data only to store the hit data
+            With adaptive_readout the readout interval grows up to max_readout_interval while there is no data
+            and the RX error counters are read every error_read_interval seconds (see FifoReadout)
+            storage sets the compression and chunkshape of raw_data, meta_data, hit_data and cluster_data (see analysis.storage_options),
+            e.g. {'raw_data': {'complib': 'blosc:lz4', 'complevel': 1}}
         '''
 
         if status != None:
@@ -632,9 +650,13 @@ class ScanBase(object):
 
         self._first_read = False
         self.scan_param_id = 0
+        self.online_analysis = online_analysis
+        self.histogramming = None
+        self.storage = storage
 
         # Initialize the communication with the chip and read the board name and firmware version
-        self.fifo_readout = FifoReadout(chip = self.chip, readout_interval = readout_interval, moving_average_time_period = moving_average_time_period)
+        self.fifo_readout = FifoReadout(chip = self.chip, readout_interval = readout_interval, moving_average_time_period = moving_average_time_period,
+                                        adaptive = adaptive_readout, max_readout_interval = max_readout_interval, error_read_interval = error_read_interval)
         self.board_name = self.chip.board_version
         self.firmware_version = self.chip.fw_version
 
@@ -729,8 +751,15 @@ class ScanBase(object):
         else:
             self.socket = None
 
-        # Start the scan
-        self.scan(status = status, **kwargs)
+        # Start the scan, the data of the readouts is written to the file also if the scan fails
+        try:
+            self.scan(status = status, **kwargs)
+        finally:
+            self.data_writer.flush()
+
+        # Wait for the histogramming of the remaining data
+        if self.histogramming is not None:
+            self.histogramming.stop()
 
         # Print the readout status and disable the receiver after the scan
         self.fifo_readout.print_readout_status()
@@ -763,9 +792,13 @@ class ScanBase(object):
         timeout = kwargs.pop('timeout', 30.0)
 
         self.start_readout(*args, **kwargs)
-        yield
+        try:
+            yield
+        finally:
+            self.fifo_readout.stop(timeout=timeout)
 
-        self.fifo_readout.stop(timeout=timeout)
+            # All readouts are in the file after the readout context
+            self.data_writer.flush()
 
     @contextmanager
     def shutter(self):
@@ -780,7 +813,12 @@ class ScanBase(object):
 
     def start_readout(self, scan_param_id=0, *args, **kwargs):
         # Pop parameters for fifo_readout.start
-        callback = kwargs.pop('callback', self.handle_data)
+        callback = kwargs.pop('callback', None)
+        idle = kwargs.pop('idle', None)
+        if callback is None:
+            # The worker of the HDF5 file writes the batch of the DataWriter when it is due also without readouts
+            callback = self.readout_consumers()
+            idle = self.data_writer.flush_due
         clear_buffer = kwargs.pop('clear_buffer', False)
         fill_buffer = kwargs.pop('fill_buffer', False)
         reset_sram_fifo = kwargs.pop('reset_sram_fifo', True)
@@ -789,38 +827,81 @@ class ScanBase(object):
         self.scan_param_id = scan_param_id
         time.sleep(0.02)  # sleep here for a while
         self.fifo_readout.start(reset_sram_fifo=reset_sram_fifo, fill_buffer=fill_buffer, clear_buffer=clear_buffer,
-                                callback=callback, errback=errback, no_data_timeout=no_data_timeout)
+                                callback=callback, errback=errback, no_data_timeout=no_data_timeout, idle=idle)
+
+    def start_histogramming(self, n_params, scurve=True, tot=False):
+        '''
+            Starts histogramming the data of the scan while it is taken, if the scan is started with online_analysis.
+            n_params is the number of scan parameters, scurve selects the S-curve histogram (Event/iToT mode)
+            and tot the ToT histogram per scan parameter (ToT mode). After the scan the histograms are in
+            self.histogramming, if histogramming.complete is True they can be used instead of the offline analysis.
+        '''
+        if not self.online_analysis:
+            return
+        self.histogramming = OnlineHistogramming(n_params, op_mode=self.chip.configs['Op_mode'], vco=self.chip.configs['Fast_Io_en'], scurve=scurve, tot=tot)
+
+    def scurve_histograms(self, h5_file, meta_data, n_params, store_hit_data, raw_data=None, hit_data_group=None, hit_data_name='hit_data', param_offset=0, progress=None):
+        '''
+            Returns the S-curve histogram (65536 x n_params, column scan_param_id - param_offset) and the occupancy
+            of the scan parameters in meta_data. The histograms of the online analysis are used if they are complete
+            (their occupancy contains all scan parameters), otherwise they are created from raw_data (default: raw_data
+            of h5_file). With store_hit_data the hit data is stored in hit_data_group/hit_data_name (see
+            analysis.iter_interpreted_hits), the raw data is only interpreted for this if the online histograms are used.
+        '''
+        if raw_data is None:
+            raw_data = h5_file.root.raw_data
+        hit_data_options = {'raw_data': raw_data, 'meta_data': meta_data, 'hit_data_group': hit_data_group, 'hit_data_name': hit_data_name,
+                            'progress': progress, 'storage': self.storage}
+
+        if self.histogramming is not None and self.histogramming.complete and param_offset + n_params <= self.histogramming.n_params:
+            # The histograms were already created while the scan was running
+            if store_hit_data:
+                analysis.store_interpreted_hits(h5_file, **hit_data_options)
+            return self.histogramming.scurves[:, param_offset:param_offset + n_params], self.histogramming.pix_occ
+
+        if not store_hit_data:
+            # Create the histograms directly from the raw data without creating the hit data
+            return analysis.raw_data_to_scurve_hist(raw_data, meta_data, n_params, param_offset=param_offset, progress=progress)
+
+        # Interpret the raw data (2x 32 bit to 1x 48 bit) in chunks and create the histograms from the hit data
+        pix_occ = np.zeros(256 * 256, dtype=np.int64)
+        scurve = np.zeros((256 * 256, n_params), dtype=np.uint32)
+        for hit_data in analysis.iter_interpreted_hits(h5_file, **hit_data_options):
+            pix_occ += np.bincount(hit_data['x'].astype(np.uint32) * 256 + hit_data['y'].astype(np.uint32), minlength=256 * 256)
+            if param_offset:
+                hit_data['scan_param_id'] -= param_offset
+            scurve += analysis.scurve_hist(hit_data, np.arange(n_params))
+        return scurve, pix_occ
+
+    def readout_consumers(self):
+        '''
+            Returns the callbacks for the readouts: the data is written to the HDF5 file and, if active,
+            sent to the socket and histogrammed. Every callback runs on its own FifoReadout worker thread.
+        '''
+        consumers = [self.handle_data]
+        if self.socket:
+            consumers.append(self.send_readout)
+        if self.histogramming is not None:
+            consumers.append(self.histogram_readout)
+        return consumers
 
     def handle_data(self, data_tuple):
         '''
-            Handling of a chunk of data.
+            Handling of a chunk of data: writes it to the HDF5 file (see DataWriter).
         '''
+        self.data_writer.add(data_tuple, self.scan_param_id)
 
-        total_words = self.raw_data_earray.nrows
-
-        # Append the data to the raw data earray in the HDF5 file
-        self.raw_data_earray.append(data_tuple[0])
-        self.raw_data_earray.flush()
-
-        # Get the meta data of the raw data and create a new row with it
-        len_raw_data = data_tuple[0].shape[0]
-        self.meta_data_table.row['timestamp_start'] = data_tuple[1]
-        self.meta_data_table.row['timestamp_stop'] = data_tuple[2]
-        self.meta_data_table.row['discard_error'] = data_tuple[3]
-        self.meta_data_table.row['decode_error'] = data_tuple[4]
-        self.meta_data_table.row['data_length'] = len_raw_data
-        self.meta_data_table.row['index_start'] = total_words
-        total_words += len_raw_data
-        self.meta_data_table.row['index_stop'] = total_words
-        self.meta_data_table.row['scan_param_id'] = self.scan_param_id
-
-        # Write the new meta data row to the meta data table in the HDF5 file
-        self.meta_data_table.row.append()
-        self.meta_data_table.flush()
+    def send_readout(self, data_tuple):
+        '''
+            Sends a chunk of data to the socket (eg. for the event display)
+        '''
+        send_data(self.socket, data=data_tuple, scan_par_id=self.scan_param_id)
 
-        # Send the data to the socket (eg. for the event display)
-        if self.socket:
-            send_data(self.socket, data=data_tuple, scan_par_id=self.scan_param_id)
+    def histogram_readout(self, data_tuple):
+        '''
+            Histograms a chunk of data while the scan is running
+        '''
+        self.histogramming.histogram(data_tuple[0], self.scan_param_id)
 
     def handle_err(self, exc):
         '''
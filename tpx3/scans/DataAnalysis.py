@@ -16,6 +16,7 @@ import numpy as np
 import time
 import tables as tb
 import math
+import multiprocessing as mp
 
 from numpy.lib.recfunctions import merge_arrays
 
@@ -270,96 +271,99 @@ class DataAnalysis(ScanBase):
             hit_sum_b = 0
 
             hit_index = 0
-            # iterate over all sets of chunks
-            for num, i in enumerate(iteration_array):
-                # Split meta_data
-                if big == False: # take all data
-                    self.logger.info("Start analysis of part 1/1")
-                    meta_data_tmp = meta_data[:]
-                elif i < meta_length-chunk_length: # take all data in chunks
-                    self.logger.info("Start analysis of part %d/%d" % (num+1,math.ceil(meta_length/chunk_length)))
-                    meta_data_tmp = meta_data[i:i+chunk_length]
-                else: # take all data until the end
-                    self.logger.info("Start analysis of part %d/%d" % (num+1,math.ceil(meta_length/chunk_length)))
-                    meta_data_tmp = meta_data[i:]
-                # get raw_data
-                raw_data_tmp = h5_file_in.root.raw_data[meta_data_tmp['index_start'][0]:meta_data_tmp['index_stop'][-1]]
-                # shift indices in meta_data to start a zero
-                start = meta_data_tmp['index_start'][0]
-                meta_data_tmp['index_start'] = meta_data_tmp['index_start']-start
-                meta_data_tmp['index_stop'] = meta_data_tmp['index_stop']-start
-                # analyze data
-                hit_data_tmp = analysis.interpret_raw_data(raw_data_tmp, op_mode, vco, meta_data_tmp, split_fine=True)
-
-                print(hit_data_tmp.shape[0])
-                if hit_data_tmp.shape[0] != 0:
-                    hit_data_tmp = hit_data_tmp[hit_data_tmp['data_header'] == 1]
-                    hit_data_tmp['hit_index'] = range(hit_index,hit_index+hit_data_tmp.shape[0])
-                    hit_index += hit_data_tmp.shape[0]
-
-                    # cluster data
-                    self.logger.info("Start clustering...")
-                    cluster_data = self.cluster(hit_data_tmp, cluster_radius, cluster_dt)
-                    self.logger.info("Done with clustering.")
-
-                    # save hit_data
-                    h5_file.create_table(h5_file.root.interpreted, 'hit_data_'+str(num), hit_data_tmp, filters=tb.Filters(complib='zlib', complevel=5))
-
-                    # create group for cluster data
-                    group = h5_file.create_group(h5_file.root.reconstruction, 'run_'+str(num), 'Cluster Data of Chunk '+str(num))
-
-                    # write cluster data into h5 file
-                    self.logger.info("Start writing into h5 file...")
-                    vlarray = h5_file.create_vlarray(group, 'x', tb.Int32Atom(shape=()), "x-values", filters=tb.Filters(complib='zlib', complevel=5))
-                    for i in range(cluster_data.shape[0]):
-                        vlarray.append(cluster_data['x'][i])
-
-                    vlarray = h5_file.create_vlarray(group, 'y', tb.Int32Atom(shape=()), "y-values", filters=tb.Filters(complib='zlib', complevel=5))
-                    for i in range(cluster_data.shape[0]):
-                        vlarray.append(cluster_data['y'][i])
-
-                    vlarray = h5_file.create_vlarray(group, 'TOA', tb.Int64Atom(shape=()), "TOA-values", filters=tb.Filters(complib='zlib', complevel=5))
-                    for i in range(cluster_data.shape[0]):
-                        vlarray.append(cluster_data['TOA'][i])
-
-                    vlarray = h5_file.create_vlarray(group, 'TOT', tb.Int32Atom(shape=()), "TOT-values", filters=tb.Filters(complib='zlib', complevel=5))
-                    for i in range(cluster_data.shape[0]):
-                        vlarray.append(cluster_data['TOT'][i])
-
-                    vlarray = h5_file.create_vlarray(group, 'EventCounter', tb.Int32Atom(shape=()), "EventCounter-values", filters=tb.Filters(complib='zlib', complevel=5))
-                    for i in range(cluster_data.shape[0]):
-                        vlarray.append(cluster_data['EventCounter'][i])
-
-                    vlarray = h5_file.create_vlarray(group, 'TOA_Extension', tb.Int64Atom(shape=()), "TOA_Extension-values", filters=tb.Filters(complib='zlib', complevel=5))
-                    for i in range(cluster_data.shape[0]):
-                        vlarray.append(cluster_data['TOA_Extension'][i])
-
-                    vlarray = h5_file.create_vlarray(group, 'hit_index', tb.Int64Atom(shape=()), "hit_index-values", filters=tb.Filters(complib='zlib', complevel=5))
-                    for i in range(cluster_data.shape[0]):
-                        vlarray.append(cluster_data['hit_index'][i])
-
-                    vlarray = h5_file.create_array(group, 'cluster_nr', cluster_data['cluster_nr'], "cluster_nr-values")
-
-                    h5_file.create_array(group, 'chunk_start_time', cluster_data['chunk_start_time'], "chunk_start_time-values")
-
-                    h5_file.create_array(group, 'hits', cluster_data['hits'], "size of cluster")
-
-                    h5_file.create_array(group, 'centerX', cluster_data['centerX'], "mean of the x values")
-
-                    h5_file.create_array(group, 'centerY', cluster_data['centerY'], "mean of the y values")
-
-                    h5_file.create_array(group, 'sumTOT', cluster_data['sumTOT'], "sum of the ToT in the cluster")
-
-                    # print out cluster information
-                    print("# cluster in chunk: "+str(len(cluster_data['hits'])))
-                    if len(cluster_data['hits']) != 0:
-                        print("average size: "+str(np.mean(cluster_data['hits'])))
-                    print("total hits in chunk: "+str(np.sum(cluster_data['hits'])))
-
-                    cluster_sum += len(cluster_data['hits'])
-                    cluster_sum_g1 += len(cluster_data['hits'][cluster_data['hits']>1])
-                    hit_sum += np.sum(cluster_data['hits'])
-                    hit_sum_b += hit_data_tmp.shape[0]
+            # Interpret all parts on the same process pool
+            with mp.get_context('spawn').Pool() as pool:
+                # iterate over all sets of chunks
+                for num, i in enumerate(iteration_array):
+                    # Split meta_data
+                    if big == False: # take all data
+                        self.logger.info("Start analysis of part 1/1")
+                        meta_data_tmp = meta_data[:]
+                    elif i < meta_length-chunk_length: # take all data in chunks
+                        self.logger.info("Start analysis of part %d/%d" % (num+1,math.ceil(meta_length/chunk_length)))
+                        meta_data_tmp = meta_data[i:i+chunk_length]
+                    else: # take all data until the end
+                        self.logger.info("Start analysis of part %d/%d" % (num+1,math.ceil(meta_length/chunk_length)))
+                        meta_data_tmp = meta_data[i:]
+                    # get raw_data
+                    raw_data_tmp = h5_file_in.root.raw_data[meta_data_tmp['index_start'][0]:meta_data_tmp['index_stop'][-1]]
+                    # shift indices in meta_data to start a zero
+                    start = meta_data_tmp['index_start'][0]
+                    meta_data_tmp['index_start'] = meta_data_tmp['index_start']-start
+                    meta_data_tmp['index_stop'] = meta_data_tmp['index_stop']-start
+                    # analyze data
+                    hit_data_tmp = analysis.interpret_raw_data(raw_data_tmp, op_mode, vco, meta_data_tmp, split_fine=True, pool=pool)
+
+                    print(hit_data_tmp.shape[0])
+                    if hit_data_tmp.shape[0] != 0:
+                        hit_data_tmp = hit_data_tmp[hit_data_tmp['data_header'] == 1]
+                        hit_data_tmp['hit_index'] = range(hit_index,hit_index+hit_data_tmp.shape[0])
+                        hit_index += hit_data_tmp.shape[0]
+
+                        # cluster data
+                        self.logger.info("Start clustering...")
+                        cluster_data = self.cluster(hit_data_tmp, cluster_radius, cluster_dt)
+                        self.logger.info("Done with clustering.")
+
+                        # save hit_data
+                        h5_file.create_table(h5_file.root.interpreted, 'hit_data_'+str(num), hit_data_tmp, **analysis.storage_options('hit_data', self.storage))
+
+                        # create group for cluster data
+                        group = h5_file.create_group(h5_file.root.reconstruction, 'run_'+str(num), 'Cluster Data of Chunk '+str(num))
+
+                        # write cluster data into h5 file
+                        self.logger.info("Start writing into h5 file...")
+                        cluster_data_options = analysis.storage_options('cluster_data', self.storage)
+                        vlarray = h5_file.create_vlarray(group, 'x', tb.Int32Atom(shape=()), "x-values", **cluster_data_options)
+                        for i in range(cluster_data.shape[0]):
+                            vlarray.append(cluster_data['x'][i])
+
+                        vlarray = h5_file.create_vlarray(group, 'y', tb.Int32Atom(shape=()), "y-values", **cluster_data_options)
+                        for i in range(cluster_data.shape[0]):
+                            vlarray.append(cluster_data['y'][i])
+
+                        vlarray = h5_file.create_vlarray(group, 'TOA', tb.Int64Atom(shape=()), "TOA-values", **cluster_data_options)
+                        for i in range(cluster_data.shape[0]):
+                            vlarray.append(cluster_data['TOA'][i])
+
+                        vlarray = h5_file.create_vlarray(group, 'TOT', tb.Int32Atom(shape=()), "TOT-values", **cluster_data_options)
+                        for i in range(cluster_data.shape[0]):
+                            vlarray.append(cluster_data['TOT'][i])
+
+                        vlarray = h5_file.create_vlarray(group, 'EventCounter', tb.Int32Atom(shape=()), "EventCounter-values", **cluster_data_options)
+                        for i in range(cluster_data.shape[0]):
+                            vlarray.append(cluster_data['EventCounter'][i])
+
+                        vlarray = h5_file.create_vlarray(group, 'TOA_Extension', tb.Int64Atom(shape=()), "TOA_Extension-values", **cluster_data_options)
+                        for i in range(cluster_data.shape[0]):
+                            vlarray.append(cluster_data['TOA_Extension'][i])
+
+                        vlarray = h5_file.create_vlarray(group, 'hit_index', tb.Int64Atom(shape=()), "hit_index-values", **cluster_data_options)
+                        for i in range(cluster_data.shape[0]):
+                            vlarray.append(cluster_data['hit_index'][i])
+
+                        vlarray = h5_file.create_array(group, 'cluster_nr', cluster_data['cluster_nr'], "cluster_nr-values")
+
+                        h5_file.create_array(group, 'chunk_start_time', cluster_data['chunk_start_time'], "chunk_start_time-values")
+
+                        h5_file.create_array(group, 'hits', cluster_data['hits'], "size of cluster")
+
+                        h5_file.create_array(group, 'centerX', cluster_data['centerX'], "mean of the x values")
+
+                        h5_file.create_array(group, 'centerY', cluster_data['centerY'], "mean of the y values")
+
+                        h5_file.create_array(group, 'sumTOT', cluster_data['sumTOT'], "sum of the ToT in the cluster")
+
+                        # print out cluster information
+                        print("# cluster in chunk: "+str(len(cluster_data['hits'])))
+                        if len(cluster_data['hits']) != 0:
+                            print("average size: "+str(np.mean(cluster_data['hits'])))
+                        print("total hits in chunk: "+str(np.sum(cluster_data['hits'])))
+
+                        cluster_sum += len(cluster_data['hits'])
+                        cluster_sum_g1 += len(cluster_data['hits'][cluster_data['hits']>1])
+                        hit_sum += np.sum(cluster_data['hits'])
+                        hit_sum_b += hit_data_tmp.shape[0]
 
             # print out final information on clustering
             print("# cluster in total: "+str(cluster_sum))
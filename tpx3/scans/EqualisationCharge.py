@@ -32,7 +32,12 @@ local_configuration = {
     'mask_step'        : 16,
     'Vthreshold_start' : 1500,
     'Vthreshold_stop'  : 2000,
-    'n_injections'     : 100
+    'n_injections'     : 100,
+
+    # Analysis parameters
+    'online_analysis'  : False,
+    'store_hit_data'   : True,
+    'method'           : 'batch'
 }
 
 
@@ -98,6 +103,9 @@ class EqualisationCharge(ScanBase):
             # Initialize counter for progress
             step_counter = 0
 
+        # Histogram the data of THR = 0 and THR = 15 while it is taken, if the scan is started with online_analysis
+        self.start_histogramming(2 * len(thresholds))
+
         scan_param_id = 0
         for threshold in thresholds:
             # Set the threshold
@@ -191,11 +199,13 @@ class EqualisationCharge(ScanBase):
 
         self.logger.info('Scan finished')
 
-    def analyze(self, progress = None, status = None, result_path = None, **kwargs):
+    def analyze(self, progress = None, status = None, result_path = None, store_hit_data = True, method = 'batch', **kwargs):
         '''
             Analyze the data of the equalisation and calculate the equalisation matrix
             If progress is None a tqdm progress bar is used else progress should be a Multiprocess Queue which stores the progress as fraction of 1
             If there is a status queue information about the status of the scan are put into it
+            With store_hit_data the interpreted hit data is stored in interpreted/hit_data_th0 and hit_data_th15, otherwise only the histograms are created
+            method selects the S-curve analysis of analysis.fit_scurves_multithread ('batch', 'curve_fit' or 'fitless' without fit)
         '''
 
         h5_filename = self.output_filename + '.h5'
@@ -206,12 +216,10 @@ class EqualisationCharge(ScanBase):
 
         # Open the HDF5 which contains all data of the equalisation
         with tb.open_file(h5_filename, 'r+') as h5_file:
-            # Read raw data, meta data and configuration parameters
+            # Read meta data and configuration parameters, the raw data is read in chunks
             meta_data = h5_file.root.meta_data[:]
             run_config = h5_file.root.configuration.run_config[:]
             general_config = h5_file.root.configuration.generalConfig[:]
-            op_mode = [row[1] for row in general_config if row[0]==b'Op_mode'][0]
-            vco = [row[1] for row in general_config if row[0]==b'Fast_Io_en'][0]
 
             # Create group to save all data and histograms to the HDF file
             h5_file.create_group(h5_file.root, 'interpreted', 'Interpreted Data')
@@ -227,24 +235,15 @@ class EqualisationCharge(ScanBase):
             meta_data_th15 = meta_data[meta_data['scan_param_id'] >= len(param_range) // 2]
             param_range_th15 = np.unique(meta_data_th15['scan_param_id'])
 
-            # shift indices so that they start with zero
-            start = meta_data_th15['index_start'][0]
-            meta_data_th15['index_start'] = meta_data_th15['index_start']-start
-            meta_data_th15['index_stop'] = meta_data_th15['index_stop']-start
-
+            # Create histograms for number of detected hits for individual thresholds, with store_hit_data the hit data is stored in interpreted/hit_data_th0 and hit_data_th15
             self.logger.info('THR = 0')
             #THR = 0
-            raw_data_thr0 = h5_file.root.raw_data[:meta_data_th0['index_stop'][-1]]
-            hit_data_thr0 = analysis.interpret_raw_data(raw_data_thr0, op_mode, vco, meta_data_th0, progress = progress)
-            h5_file.create_table(h5_file.root.interpreted, 'hit_data_th0', hit_data_thr0, filters=tb.Filters(complib='zlib', complevel=5))
-            raw_data_thr0 = None
+            scurve_th0, _ = self.scurve_histograms(h5_file, meta_data_th0, len(param_range) // 2, store_hit_data, hit_data_name = 'hit_data_th0', progress = progress)
 
             self.logger.info('THR = 15')
             #THR = 15
-            raw_data_thr15 = h5_file.root.raw_data[meta_data_th0['index_stop'][-1]:]
-            hit_data_thr15 = analysis.interpret_raw_data(raw_data_thr15, op_mode, vco, meta_data_th15, progress = progress)
-            h5_file.create_table(h5_file.root.interpreted, 'hit_data_th15', hit_data_thr15, filters=tb.Filters(complib='zlib', complevel=5))
-            raw_data_thr15 = None
+            scurve_th15, _ = self.scurve_histograms(h5_file, meta_data_th15, len(param_range) - len(param_range) // 2, store_hit_data, hit_data_name = 'hit_data_th15', param_offset = len(param_range) // 2, progress = progress)
+            meta_data = None
 
             # Read needed configuration parameters
             Vthreshold_start = [int(item[1]) for item in run_config if item[0] == b'Vthreshold_start'][0]
@@ -254,35 +253,20 @@ class EqualisationCharge(ScanBase):
             chip_x = [item[1].decode() for item in run_config if item[0] == b'chip_x'][0]
             chip_y = [int(item[1]) for item in run_config if item[0] == b'chip_y'][0]
 
-            # Select only data which is hit data
-            hit_data_thr0 = hit_data_thr0[hit_data_thr0['data_header'] == 1]
-            hit_data_thr15 = hit_data_thr15[hit_data_thr15['data_header'] == 1]
-
-            # Divide the data into two parts - data for pixel threshold 0 and 15
-            param_range = np.unique(meta_data['scan_param_id'])
-            meta_data = None
-            param_range_th0 = np.unique(hit_data_thr0['scan_param_id'])
-            param_range_th15 = np.unique(hit_data_thr15['scan_param_id'])
-
-            # Create histograms for number of detected hits for individual thresholds
-            self.logger.info('Get the global threshold distributions for all pixels...')
-            scurve_th0 = analysis.scurve_hist(hit_data_thr0, np.arange(len(param_range) // 2))
-            hit_data_thr0 = None
-            scurve_th15 = analysis.scurve_hist(hit_data_thr15, np.arange(len(param_range) // 2, len(param_range)))
-            hit_data_thr15 = None
-
             # Get the polarity to spcify if s or z curve is fitted
             neg_polarity = [int(item[1]) for item in general_config if item[0] == b'Polarity'][0] == 1
 
             # Fit S-Curves to the histograms for all pixels
             self.logger.info('Fit the scurves for all pixels...')
-            thr2D_th0, sig2D_th0, chi2ndf2D_th0 = analysis.fit_scurves_multithread(scurve_th0, scan_param_range=list(range(Vthreshold_start, Vthreshold_stop + 1)), n_injections=n_injections, invert_x=neg_polarity, progress = progress)
+            thr2D_th0, sig2D_th0, chi2ndf2D_th0, fit_diagnostics_th0 = analysis.fit_scurves_multithread(scurve_th0, scan_param_range=list(range(Vthreshold_start, Vthreshold_stop + 1)), n_injections=n_injections, invert_x=neg_polarity, progress = progress, method = method, diagnostics = True)
             h5_file.create_carray(h5_file.root.interpreted, name='HistSCurve_th0', obj=scurve_th0)
             h5_file.create_carray(h5_file.root.interpreted, name='ThresholdMap_th0', obj=thr2D_th0.T)
+            h5_file.create_table(h5_file.root.interpreted, name='FitDiagnostics_th0', obj=fit_diagnostics_th0)
             scurve_th0 = None
-            thr2D_th15, sig2D_th15, chi2ndf2D_th15 = analysis.fit_scurves_multithread(scurve_th15, scan_param_range=list(range(Vthreshold_start, Vthreshold_stop + 1)), n_injections=n_injections, invert_x=neg_polarity, progress = progress)
+            thr2D_th15, sig2D_th15, chi2ndf2D_th15, fit_diagnostics_th15 = analysis.fit_scurves_multithread(scurve_th15, scan_param_range=list(range(Vthreshold_start, Vthreshold_stop + 1)), n_injections=n_injections, invert_x=neg_polarity, progress = progress, method = method, diagnostics = True)
             h5_file.create_carray(h5_file.root.interpreted, name='HistSCurve_th15', obj=scurve_th15)
             h5_file.create_carray(h5_file.root.interpreted, name='ThresholdMap_th15', obj=thr2D_th15.T)
+            h5_file.create_table(h5_file.root.interpreted, name='FitDiagnostics_th15', obj=fit_diagnostics_th15)
             scurve_th15 = None
 
             # Put the threshold distribution based on the fit results in two histograms
@@ -358,5 +342,5 @@ class EqualisationCharge(ScanBase):
 if __name__ == "__main__":
     scan = EqualisationCharge()
     scan.start(**local_configuration)
-    scan.analyze()
+    scan.analyze(store_hit_data = local_configuration['store_hit_data'], method = local_configuration['method'])
     scan.plot()
\ No newline at end of file
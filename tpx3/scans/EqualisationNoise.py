@@ -192,8 +192,6 @@ class EqualisationNoise(ScanBase):
             meta_data = h5_file.root.meta_data[:]
             run_config = h5_file.root.configuration.run_config[:]
             general_config = h5_file.root.configuration.generalConfig[:]
-            op_mode = [row[1] for row in general_config if row[0]==b'Op_mode'][0]
-            vco = [row[1] for row in general_config if row[0]==b'Fast_Io_en'][0]
 
             self.logger.info('Interpret raw data...')
 
@@ -206,22 +204,16 @@ class EqualisationNoise(ScanBase):
             meta_data_th15 = meta_data[meta_data['scan_param_id'] >= len(param_range) // 2]
             param_range_th15 = np.unique(meta_data_th15['scan_param_id'])
 
-            # shift indices so that they start with zero
-            start = meta_data_th15['index_start'][0]
-            meta_data_th15['index_start'] = meta_data_th15['index_start']-start
-            meta_data_th15['index_stop'] = meta_data_th15['index_stop']-start
-
+            # Create histograms for number of detected hits for individual thresholds directly from the raw data
+            self.logger.info('Get the global threshold distributions for all pixels...')
             self.logger.info('THR = 0')
             #THR = 0
-            raw_data_thr0 = h5_file.root.raw_data[:meta_data_th0['index_stop'][-1]]
-            hit_data_thr0 = analysis.interpret_raw_data(raw_data_thr0, op_mode, vco, meta_data_th0, progress = progress)
-            raw_data_thr0 = None
+            scurve_th0, _ = analysis.raw_data_to_scurve_hist(h5_file.root.raw_data, meta_data_th0, len(param_range_th0), progress = progress)
 
             self.logger.info('THR = 15')
             #THR = 15
-            raw_data_thr15 = h5_file.root.raw_data[meta_data_th0['index_stop'][-1]:]
-            hit_data_thr15 = analysis.interpret_raw_data(raw_data_thr15, op_mode, vco, meta_data_th15, progress = progress)
-            raw_data_thr15 = None
+            scurve_th15, _ = analysis.raw_data_to_scurve_hist(h5_file.root.raw_data, meta_data_th15, len(param_range_th15), param_offset = len(param_range) // 2, progress = progress)
+            meta_data = None
 
         # Read needed configuration parameters
         Vthreshold_start = [int(item[1]) for item in run_config if item[0] == b'Vthreshold_start'][0]
@@ -230,23 +222,6 @@ class EqualisationNoise(ScanBase):
         chip_x = [item[1].decode() for item in run_config if item[0] == b'chip_x'][0]
         chip_y = [int(item[1]) for item in run_config if item[0] == b'chip_y'][0]
 
-        # Select only data which is hit data
-        hit_data_thr0 = hit_data_thr0[hit_data_thr0['data_header'] == 1]
-        hit_data_thr15 = hit_data_thr15[hit_data_thr15['data_header'] == 1]
-
-        # Divide the data into two parts - data for pixel threshold 0 and 15
-        param_range = np.unique(meta_data['scan_param_id'])
-        meta_data = None
-        param_range_th0 = np.unique(hit_data_thr0['scan_param_id'])
-        param_range_th15 = np.unique(hit_data_thr15['scan_param_id'])
-
-        # Create histograms for number of detected hits for individual thresholds
-        self.logger.info('Get the global threshold distributions for all pixels...')
-        scurve_th0 = analysis.scurve_hist(hit_data_thr0, param_range_th0)
-        hit_data_thr0 = None
-        scurve_th15 = analysis.scurve_hist(hit_data_thr15, param_range_th15)
-        hit_data_thr15 = None
-
         # Calculate the mean of the threshold distributions for all pixels
         self.logger.info('Calculate the mean of the global threshold distributions for all pixels...')
         vths_th0 = analysis.vths(scurve_th0, param_range_th0, Vthreshold_start)
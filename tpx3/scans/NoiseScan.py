@@ -28,6 +28,9 @@ local_configuration = {
     'Vthreshold_start' : 1335,
     'Vthreshold_stop'  : 1700,
     #'thrfile'        : './output_data/equal_?.h5'
+
+    # Analysis parameters
+    'store_hit_data'   : True
 }
 
 
@@ -126,11 +129,12 @@ class NoiseScan(ScanBase):
 
         self.logger.info('Scan finished')
 
-    def analyze(self, progress = None, status = None, **kwargs):
+    def analyze(self, progress = None, status = None, store_hit_data = True, **kwargs):
         '''
             Analyze the data of the scan
             If progress is None a tqdm progress bar is used else progress should be a Multiprocess Queue which stores the progress as fraction of 1
             If there is a status queue information about the status of the scan are put into it
+            With store_hit_data the interpreted hit data is stored in interpreted/hit_data
         '''
 
         h5_filename = self.output_filename + '.h5'
@@ -142,38 +146,42 @@ class NoiseScan(ScanBase):
         # Open the HDF5 which contains all data of the scan
         with tb.open_file(h5_filename, 'r+') as h5_file:
             # Read raw data, meta data and configuration parameters
-            raw_data = h5_file.root.raw_data[:]
             meta_data = h5_file.root.meta_data[:]
             run_config = h5_file.root.configuration.run_config[:]
-            general_config = h5_file.root.configuration.generalConfig[:]
-            op_mode = [row[1] for row in general_config if row[0]==b'Op_mode'][0]
-            vco = [row[1] for row in general_config if row[0]==b'Fast_Io_en'][0]
 
             # Create a group to save all data and histograms to the HDF file
             h5_file.create_group(h5_file.root, 'interpreted', 'Interpreted Data')
 
+            # Read needed configuration parameters
+            Vthreshold_start = [int(item[1]) for item in run_config if item[0] == b'Vthreshold_start'][0]
+            Vthreshold_stop = [int(item[1]) for item in run_config if item[0] == b'Vthreshold_stop'][0]
+
             self.logger.info('Interpret raw data...')
-            # Interpret the raw data (2x 32 bit to 1x 48 bit)
-            hit_data = analysis.interpret_raw_data(raw_data, op_mode, vco, meta_data, progress = progress)
-            raw_data = None
-
-            # Select only data which is hit data
-            hit_data = hit_data[hit_data['data_header'] == 1]
-            h5_file.create_table(h5_file.root.interpreted, 'hit_data', hit_data, filters=tb.Filters(complib='zlib', complevel=5))
-            pix_occ = np.bincount(hit_data['x'].astype(np.uint32) * 256 + hit_data['y'].astype(np.uint32), minlength=256 * 256)
-            hist_occ = np.reshape(pix_occ, (256, 256)).T
-            h5_file.create_carray(h5_file.root.interpreted, name='HistOcc', obj=hist_occ)
             param_range = np.unique(meta_data['scan_param_id'])
+            pix_occ = np.zeros(256 * 256, dtype=np.int64)
+            noise_curve_pixel = np.zeros(len(param_range) + Vthreshold_start, dtype=np.uint16)
+            noise_curve_hits = np.zeros(len(param_range) + Vthreshold_start, dtype=np.uint16)
+
+            # Interpret the raw data (2x 32 bit to 1x 48 bit) in chunks, with store_hit_data the hit data is stored in interpreted/hit_data
+            # The chunks contain complete thresholds, so the noise curves of the chunks can be added
+            if store_hit_data:
+                hit_data_chunks = analysis.iter_interpreted_hits(h5_file, meta_data=meta_data, progress = progress, storage = self.storage)
+            else:
+                hit_data_chunks = analysis.iter_interpreted_hits(h5_file, meta_data=meta_data, hit_data_name=None, columns=['x', 'y', 'scan_param_id', 'EventCounter'], progress = progress, storage = self.storage)
+            for hit_data in hit_data_chunks:
+                pix_occ += np.bincount(hit_data['x'].astype(np.uint32) * 256 + hit_data['y'].astype(np.uint32), minlength=256 * 256)
+                # Create histograms for number of active pixels and number of hits for individual thresholds
+                chunk_pixel, chunk_hits = analysis.noise_pixel_count(hit_data, param_range, Vthreshold_start)
+                noise_curve_pixel += chunk_pixel
+                noise_curve_hits += chunk_hits
+            hit_data = None
             meta_data = None
+
+            hist_occ = np.reshape(pix_occ, (256, 256)).T
+            h5_file.create_carray(h5_file.root.interpreted, name='HistOcc', obj=hist_occ)
             pix_occ = None
             hist_occ = None
 
-            # Read needed configuration parameters
-            Vthreshold_start = [int(item[1]) for item in run_config if item[0] == b'Vthreshold_start'][0]
-            Vthreshold_stop = [int(item[1]) for item in run_config if item[0] == b'Vthreshold_stop'][0]
-
-            # Create histograms for number of active pixels and number of hits for individual thresholds
-            noise_curve_pixel, noise_curve_hits = analysis.noise_pixel_count(hit_data, param_range, Vthreshold_start)
             h5_file.create_carray(h5_file.root.interpreted, name='NoiseCurvePixel', obj=noise_curve_pixel)
             h5_file.create_carray(h5_file.root.interpreted, name='NoiseCurveHits', obj=noise_curve_hits)
 
@@ -217,5 +225,5 @@ class NoiseScan(ScanBase):
 if __name__ == "__main__":
     scan = NoiseScan()
     scan.start(**local_configuration)
-    scan.analyze()
+    scan.analyze(store_hit_data = local_configuration['store_hit_data'])
     scan.plot()
@@ -35,7 +35,11 @@ local_configuration = {
     'offset'           : 0,
     'Vthreshold_start' : 1600,
     'Vthreshold_stop'  : 2200,
-    'n_injections'     : 100
+    'n_injections'     : 100,
+
+    # Analysis parameters
+    'online_analysis'  : False,
+    'method'           : 'batch'
 }
 
 class IterationTable(tb.IsDescription):
@@ -109,7 +113,7 @@ class PixelDACopt(ScanBase):
             self.scan_iteration(progress = progress, status = status, **args)
 
             # Analyse the data of the current iteration
-            opt_results = self.analyze_iteration(iteration, progress = progress, status = status)
+            opt_results = self.analyze_iteration(iteration, progress = progress, status = status, method = kwargs.get('method', 'batch'))
             last_pixeldac = pixeldac
 
             # Store results of iteration
@@ -193,6 +197,9 @@ class PixelDACopt(ScanBase):
         # Write the pixel matrix for the current step plus the read_pixel_matrix_datadriven command
         self.chip.write(mask_cmds)
 
+        # Histogram the data of the iteration (THR = 0 and THR = 15) while it is taken, if the scan is started with online_analysis
+        self.start_histogramming(2 * len(thresholds))
+
         scan_param_id = 0
         for threshold in thresholds:
             # Set the threshold
@@ -270,17 +277,22 @@ class PixelDACopt(ScanBase):
             # Close the progress bar
             pbar.close()
 
+        # Wait for the histogramming of the remaining data of the iteration
+        if self.histogramming is not None:
+            self.histogramming.stop()
+
         if status != None:
             status.put("iteration_finish_symbol")
 
         self.logger.info('Scan finished')
 
-    def analyze_iteration(self, iteration = 0, progress = None, status = None):
+    def analyze_iteration(self, iteration = 0, progress = None, status = None, method = 'batch'):
         '''
             Analyze the data of the iteration and calculate the new Ibias_PixelDAC value.
             In the last iteration the data is also used to calculate an equalisation matrix.
             If progress is None a tqdm progress bar is used else progress should be a Multiprocess Queue which stores the progress as fraction of 1
             If there is a status queue information about the status of the scan are put into it
+            method selects the S-curve analysis of analysis.fit_scurves_multithread ('batch', 'curve_fit' or 'fitless' without fit)
         '''
 
         h5_filename = self.output_filename + '.h5'
@@ -291,14 +303,14 @@ class PixelDACopt(ScanBase):
 
         # Open the HDF5 which contains all data of the optimization iteration
         with tb.open_file(h5_filename, 'r+') as h5_file:
-            # Read raw data, meta data and configuration parameters for the current iteration
+            # Read meta data and configuration parameters for the current iteration, the raw data is read in chunks
+            raw_data_call = ('h5_file.root.' + 'raw_data_' + str(iteration))
+            raw_data = eval(raw_data_call)
             meta_data_call = ('h5_file.root.' + 'meta_data_' + str(iteration) + '[:]')
             meta_data = eval(meta_data_call)
             run_config_call = ('h5_file.root.' + 'configuration.run_config_' + str(iteration) + '[:]')
             run_config = eval(run_config_call)
             general_config = h5_file.root.configuration.generalConfig[:]
-            op_mode = [row[1] for row in general_config if row[0]==b'Op_mode'][0]
-            vco = [row[1] for row in general_config if row[0]==b'Fast_Io_en'][0]
 
             if iteration == 0:
                 # Create group to save all data and histograms to the HDF file
@@ -315,24 +327,21 @@ class PixelDACopt(ScanBase):
             meta_data_th15 = meta_data[meta_data['scan_param_id'] >= len(param_range) // 2]
             param_range_th15 = np.unique(meta_data_th15['scan_param_id'])
 
-            # shift indices so that they start with zero
-            start = meta_data_th15['index_start'][0]
-            meta_data_th15['index_start'] = meta_data_th15['index_start']-start
-            meta_data_th15['index_stop'] = meta_data_th15['index_stop']-start
-
-            self.logger.info('THR = 0')
-            #THR = 0
-            raw_data_call = ('h5_file.root.' + 'raw_data_' + str(iteration) + '[:' + str(meta_data_th0['index_stop'][-1]) + ']')
-            raw_data_thr0 = eval(raw_data_call)
-            hit_data_thr0 = analysis.interpret_raw_data(raw_data_thr0, op_mode, vco, meta_data_th0, progress = progress)
-            raw_data_thr0 = None
-
-            self.logger.info('THR = 15')
-            #THR = 15
-            raw_data_call = ('h5_file.root.' + 'raw_data_' + str(iteration) + '[' + str(meta_data_th0['index_stop'][-1]) + ':]')
-            raw_data_thr15 = eval(raw_data_call)
-            hit_data_thr15 = analysis.interpret_raw_data(raw_data_thr15, op_mode, vco, meta_data_th15, progress = progress)
-            raw_data_thr15 = None
+            if self.histogramming is not None and self.histogramming.complete and self.histogramming.n_params == len(param_range):
+                # The histograms were already created while the iteration was running
+                scurve_th0 = self.histogramming.scurves[:, :len(param_range) // 2]
+                scurve_th15 = self.histogramming.scurves[:, len(param_range) // 2:]
+            else:
+                # Create histograms for number of detected hits for individual thresholds directly from the raw data
+                self.logger.info('THR = 0')
+                #THR = 0
+                scurve_th0, _ = analysis.raw_data_to_scurve_hist(raw_data, meta_data_th0, len(param_range) // 2, progress = progress)
+
+                self.logger.info('THR = 15')
+                #THR = 15
+                scurve_th15, _ = analysis.raw_data_to_scurve_hist(raw_data, meta_data_th15, len(param_range) - len(param_range) // 2, param_offset = len(param_range) // 2, progress = progress)
+            raw_data = None
+            meta_data = None
 
             # Read needed configuration parameters
             Vthreshold_start = [int(item[1]) for item in run_config if item[0] == b'Vthreshold_start'][0]
@@ -342,35 +351,20 @@ class PixelDACopt(ScanBase):
             last_pixeldac = [int(item[1]) for item in run_config if item[0] == b'last_pixeldac'][0]
             last_delta = [float(item[1]) for item in run_config if item[0] == b'last_delta'][0]
 
-            # Select only data which is hit data
-            hit_data_thr0 = hit_data_thr0[hit_data_thr0['data_header'] == 1]
-            hit_data_thr15 = hit_data_thr15[hit_data_thr15['data_header'] == 1]
-
-            # Divide the data into two parts - data for pixel threshold 0 and 15
-            param_range = np.unique(meta_data['scan_param_id'])
-            meta_data = None
-            param_range_th0 = np.unique(hit_data_thr0['scan_param_id'])
-            param_range_th15 = np.unique(hit_data_thr15['scan_param_id'])
-
-            # Create histograms for number of detected hits for individual thresholds
-            self.logger.info('Get the global threshold distributions for all pixels...')
-            scurve_th0 = analysis.scurve_hist(hit_data_thr0, np.arange(len(param_range) // 2))
-            hit_data_thr0 = None
-            scurve_th15 = analysis.scurve_hist(hit_data_thr15, np.arange(len(param_range) // 2, len(param_range)))
-            hit_data_thr15 = None
-
             # Get the polarity to specifiy if s or z curve is fitted
             neg_polarity = [int(item[1]) for item in general_config if item[0] == b'Polarity'][0] == 1
 
             # Fit S-Curves to the histograms for all pixels
             self.logger.info('Fit the scurves for all pixels...')
-            thr2D_th0, _, _ = analysis.fit_scurves_multithread(scurve_th0, scan_param_range=list(range(Vthreshold_start, Vthreshold_stop + 1)), n_injections=n_injections, invert_x=neg_polarity, progress = progress)
+            thr2D_th0, _, _, fit_diagnostics_th0 = analysis.fit_scurves_multithread(scurve_th0, scan_param_range=list(range(Vthreshold_start, Vthreshold_stop + 1)), n_injections=n_injections, invert_x=neg_polarity, progress = progress, method = method, diagnostics = True)
             h5_file.create_carray(h5_file.root.interpreted, name='HistSCurve_th0_' + str(iteration), obj=scurve_th0)
             h5_file.create_carray(h5_file.root.interpreted, name='ThresholdMap_th0_' + str(iteration), obj=thr2D_th0.T)
+            h5_file.create_table(h5_file.root.interpreted, name='FitDiagnostics_th0_' + str(iteration), obj=fit_diagnostics_th0)
             scurve_th0 = None
-            thr2D_th15, _, _ = analysis.fit_scurves_multithread(scurve_th15, scan_param_range=list(range(Vthreshold_start, Vthreshold_stop + 1)), n_injections=n_injections, invert_x=neg_polarity, progress = progress)
+            thr2D_th15, _, _, fit_diagnostics_th15 = analysis.fit_scurves_multithread(scurve_th15, scan_param_range=list(range(Vthreshold_start, Vthreshold_stop + 1)), n_injections=n_injections, invert_x=neg_polarity, progress = progress, method = method, diagnostics = True)
             h5_file.create_carray(h5_file.root.interpreted, name='HistSCurve_th15_' + str(iteration), obj=scurve_th15)
             h5_file.create_carray(h5_file.root.interpreted, name='ThresholdMap_th15_' + str(iteration) , obj=thr2D_th15.T)
+            h5_file.create_table(h5_file.root.interpreted, name='FitDiagnostics_th15_' + str(iteration), obj=fit_diagnostics_th15)
             scurve_th15 = None
 
         # Put the threshold distribution based on the fit results in two histograms
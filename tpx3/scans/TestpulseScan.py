@@ -30,6 +30,10 @@ local_configuration = {
     'VTP_fine_stop'    : 256 + 140,
     'n_injections'     : 100,
     #'thrfile'        : './output_data/?_mask.h5'
+
+    # Analysis parameters
+    'online_analysis'  : False,
+    'store_hit_data'   : True
 }
 
 
@@ -94,6 +98,9 @@ class TestpulseScan(ScanBase):
             # Initialize counter for progress
             step_counter = 0
 
+        # Histogram the data while the scan is running, if the scan is started with online_analysis
+        self.start_histogramming(len(cal_high_range))
+
         scan_param_id = 0
         for vcal in cal_high_range:
             # Set the fine testpulse DAC
@@ -135,11 +142,12 @@ class TestpulseScan(ScanBase):
 
         self.logger.info('Scan finished')
 
-    def analyze(self, progress = None, status = None, **kwargs):
+    def analyze(self, progress = None, status = None, store_hit_data = True, **kwargs):
         '''
             Analyze the data of the scan
             If progress is None a tqdm progress bar is used else progress should be a Multiprocess Queue which stores the progress as fraction of 1
             If there is a status queue information about the status of the scan are put into it
+            With store_hit_data the interpreted hit data is stored in interpreted/hit_data, otherwise only the histograms are created
         '''
 
         h5_filename = self.output_filename + '.h5'
@@ -151,36 +159,24 @@ class TestpulseScan(ScanBase):
         # Open the HDF5 which contains all data of the scan
         with tb.open_file(h5_filename, 'r+') as h5_file:
             # Read raw data, meta data and configuration parameters
-            raw_data = h5_file.root.raw_data[:]
             meta_data = h5_file.root.meta_data[:]
             run_config = h5_file.root.configuration.run_config[:]
             general_config = h5_file.root.configuration.generalConfig[:]
-            op_mode = [row[1] for row in general_config if row[0]==b'Op_mode'][0]
-            vco = [row[1] for row in general_config if row[0]==b'Fast_Io_en'][0]
 
             # Create a group to save all data and histograms to the HDF file
             h5_file.create_group(h5_file.root, 'interpreted', 'Interpreted Data')
 
             self.logger.info('Interpret raw data...')
-            # Interpret the raw data (2x 32 bit to 1x 48 bit)
-            hit_data = analysis.interpret_raw_data(raw_data, op_mode, vco, meta_data, progress = progress)
-            raw_data = None
-
-            # Select only data which is hit data
-            hit_data = hit_data[hit_data['data_header'] == 1]
-            h5_file.create_table(h5_file.root.interpreted, 'hit_data', hit_data, filters=tb.Filters(complib='zlib', complevel=5))
-            pix_occ = np.bincount(hit_data['x'].astype(np.uint32) * 256 + hit_data['y'].astype(np.uint32), minlength=256 * 256)
-            hist_occ = np.reshape(pix_occ, (256, 256)).T
-            h5_file.create_carray(h5_file.root.interpreted, name='HistOcc', obj=hist_occ)
             param_range = np.unique(meta_data['scan_param_id'])
+            # Create histograms for number of detected hits for individual testpulses, with store_hit_data the hit data is stored in interpreted/hit_data
+            scurve, pix_occ = self.scurve_histograms(h5_file, meta_data, len(param_range), store_hit_data, progress = progress)
             meta_data = None
+
+            hist_occ = np.reshape(pix_occ, (256, 256)).T
+            h5_file.create_carray(h5_file.root.interpreted, name='HistOcc', obj=hist_occ)
             pix_occ = None
             hist_occ = None
 
-            # Create histograms for number of detected hits for individual testpulses
-            scurve = analysis.scurve_hist(hit_data, param_range)
-            hit_data = None
-
             # Read needed configuration parameters
             n_injections = [int(item[1]) for item in run_config if item[0] == b'n_injections'][0]
             VTP_fine_start = [int(item[1]) for item in run_config if item[0] == b'VTP_fine_start'][0]
@@ -189,12 +185,13 @@ class TestpulseScan(ScanBase):
 
             # Fit S-Curves to the histograms for all pixels
             param_range = list(range(VTP_fine_start, VTP_fine_stop))
-            thr2D, sig2D, chi2ndf2D = analysis.fit_scurves_multithread(scurve, scan_param_range=param_range, n_injections=n_injections, progress = progress, invert_x=not neg_polarity)
+            thr2D, sig2D, chi2ndf2D, fit_diagnostics = analysis.fit_scurves_multithread(scurve, scan_param_range=param_range, n_injections=n_injections, progress = progress, invert_x=not neg_polarity, diagnostics = True)
 
             h5_file.create_carray(h5_file.root.interpreted, name='HistSCurve', obj=scurve)
             h5_file.create_carray(h5_file.root.interpreted, name='Chi2Map', obj=chi2ndf2D.T)
             h5_file.create_carray(h5_file.root.interpreted, name='ThresholdMap', obj=thr2D.T)
             h5_file.create_carray(h5_file.root.interpreted, name='NoiseMap', obj=sig2D.T)
+            h5_file.create_table(h5_file.root.interpreted, name='FitDiagnostics', obj=fit_diagnostics)
 
     def plot(self, status = None, plot_queue = None, **kwargs):
         '''
@@ -253,5 +250,5 @@ class TestpulseScan(ScanBase):
 if __name__ == "__main__":
     scan = TestpulseScan()
     scan.start(**local_configuration)
-    scan.analyze()
+    scan.analyze(store_hit_data = local_configuration['store_hit_data'])
     scan.plot()
\ No newline at end of file
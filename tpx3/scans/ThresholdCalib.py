@@ -32,7 +32,12 @@ local_configuration = {
     'Vthreshold_stop'  : 2911,
     'n_injections'     : 100,
     'n_pulse_heights'  : 5,
-    'thrfile'         : './output_data/20201019_184320_mask.h5'
+    'thrfile'         : './output_data/20201019_184320_mask.h5',
+
+    # Analysis parameters
+    'online_analysis'  : False,
+    'store_hit_data'   : True,
+    'method'           : 'batch'
 }
 
 
@@ -88,7 +93,7 @@ class ThresholdCalib(ScanBase):
             self.scan_iteration(iteration, progress = progress, status = status, **args)
 
             # Analyse the data of the current iteration
-            opt_results = self.analyze_iteration(iteration, progress = progress, status = status)
+            opt_results = self.analyze_iteration(iteration, progress = progress, status = status, store_hit_data = kwargs.get('store_hit_data', True), method = kwargs.get('method', 'batch'))
 
         # Create the plots for the full calibration
         self.plot(status = status, plot_queue = plot_queue)
@@ -141,6 +146,9 @@ class ThresholdCalib(ScanBase):
         self.chip.set_dac("VTP_coarse", 100)
         self.chip.set_dac("VTP_fine", 240 + (100 // n_pulse_heights) * iteration)
 
+        # Histogram the data of the iteration while it is taken, if the scan is started with online_analysis
+        self.start_histogramming(len(thresholds))
+
         scan_param_id = 0
         for threshold in thresholds:
             # Set the threshold
@@ -178,16 +186,22 @@ class ThresholdCalib(ScanBase):
             # Close the progress bar
             pbar.close()
 
+        # Wait for the histogramming of the remaining data of the iteration
+        if self.histogramming is not None:
+            self.histogramming.stop()
+
         if status != None:
             status.put("iteration_finish_symbol")
 
         self.logger.info('Iteration %i finished', iteration)
 
-    def analyze_iteration(self, iteration, progress = None, status = None):
+    def analyze_iteration(self, iteration, progress = None, status = None, store_hit_data = True, method = 'batch'):
         '''
             Analyze the data of the iteration
             If progress is None a tqdm progress bar is used else progress should be a Multiprocess Queue which stores the progress as fraction of 1
             If there is a status queue information about the status of the scan are put into it
+            With store_hit_data the interpreted hit data is stored in interpreted_<iteration>/hit_data, otherwise only the histograms are created
+            method selects the S-curve analysis of analysis.fit_scurves_multithread ('batch', 'curve_fit' or 'fitless' without fit)
         '''
 
         h5_filename = self.output_filename + '.h5'
@@ -198,41 +212,31 @@ class ThresholdCalib(ScanBase):
 
         # Open the HDF5 which contains all data of the scan
         with tb.open_file(h5_filename, 'r+') as h5_file:
-            # Read raw data, meta data and configuration parameters for the current iteration
-            raw_data_call = ('h5_file.root.' + 'raw_data_' + str(iteration) + '[:]')
+            # Read meta data and configuration parameters for the current iteration, the raw data is read in chunks
+            raw_data_call = ('h5_file.root.' + 'raw_data_' + str(iteration))
             raw_data = eval(raw_data_call)
             meta_data_call = ('h5_file.root.' + 'meta_data_' + str(iteration) + '[:]')
             meta_data = eval(meta_data_call)
             run_config_call = ('h5_file.root.' + 'configuration.run_config_' + str(iteration) + '[:]')
             run_config = eval(run_config_call)
             general_config = h5_file.root.configuration.generalConfig[:]
-            op_mode = [row[1] for row in general_config if row[0]==b'Op_mode'][0]
-            vco = [row[1] for row in general_config if row[0]==b'Fast_Io_en'][0]
 
             # Create group to save all data and histograms to the HDF file
             h5_file.create_group(h5_file.root, 'interpreted_' + str(iteration), 'Interpreted Data')
             interpreted_call = ('h5_file.root.' + 'interpreted_' + str(iteration))
 
             self.logger.info('Interpret raw data...')
-            # Interpret the raw data (2x 32 bit to 1x 48 bit)
-            hit_data = analysis.interpret_raw_data(raw_data, op_mode, vco, meta_data, progress = progress)
+            param_range = np.unique(meta_data['scan_param_id'])
+            # Create histograms for number of detected hits for individual thresholds, with store_hit_data the hit data is stored in interpreted_<iteration>/hit_data
+            scurve, pix_occ = self.scurve_histograms(h5_file, meta_data, len(param_range), store_hit_data, raw_data = raw_data, hit_data_group = eval(interpreted_call), progress = progress)
             raw_data = None
+            meta_data = None
 
-            # Select only data which is hit data
-            hit_data = hit_data[hit_data['data_header'] == 1]
-            h5_file.create_table(eval(interpreted_call), 'hit_data', hit_data, filters=tb.Filters(complib='zlib', complevel=5))
-            pix_occ = np.bincount(hit_data['x'].astype(np.uint32) * 256 + hit_data['y'].astype(np.uint32), minlength=256 * 256)
             hist_occ = np.reshape(pix_occ, (256, 256)).T
             h5_file.create_carray(eval(interpreted_call), name='HistOcc', obj=hist_occ)
-            param_range = np.unique(meta_data['scan_param_id'])
-            meta_data = None
             pix_occ = None
             hist_occ = None
 
-            # Create histograms for number of detected hits for individual thresholds
-            scurve = analysis.scurve_hist(hit_data, param_range)
-            hit_data = None
-
             # Read needed configuration parameters
             n_injections = [int(item[1]) for item in run_config if item[0] == b'n_injections'][0]
             Vthreshold_start = [int(item[1]) for item in run_config if item[0] == b'Vthreshold_start'][0]
@@ -241,12 +245,13 @@ class ThresholdCalib(ScanBase):
 
             # Fit S-Curves to the histograms for all pixels
             param_range = list(range(Vthreshold_start, Vthreshold_stop + 1))
-            thr2D, sig2D, chi2ndf2D = analysis.fit_scurves_multithread(scurve, scan_param_range=param_range, n_injections=n_injections, invert_x=neg_polarity, progress = progress)
+            thr2D, sig2D, chi2ndf2D, fit_diagnostics = analysis.fit_scurves_multithread(scurve, scan_param_range=param_range, n_injections=n_injections, invert_x=neg_polarity, progress = progress, method = method, diagnostics = True)
 
             h5_file.create_carray(eval(interpreted_call), name='HistSCurve', obj=scurve)
             h5_file.create_carray(eval(interpreted_call), name='Chi2Map', obj=chi2ndf2D.T)
             h5_file.create_carray(eval(interpreted_call), name='ThresholdMap', obj=thr2D.T)
             h5_file.create_carray(eval(interpreted_call), name='NoiseMap', obj=sig2D.T)
+            h5_file.create_table(eval(interpreted_call), name='FitDiagnostics', obj=fit_diagnostics)
 
     def plot(self, status = None, plot_queue = None, **kwargs):
         '''
@@ -29,7 +29,12 @@ local_configuration = {
     'Vthreshold_start' : 1800,
     'Vthreshold_stop'  : 2800,
     'n_injections'     : 100,
-    'thrfile'         : './output_data/20200401_160123_mask.h5'
+    'thrfile'         : './output_data/20200401_160123_mask.h5',
+
+    # Analysis parameters
+    'online_analysis'  : False,
+    'store_hit_data'   : True,
+    'method'           : 'batch'
 }
 
 
@@ -94,6 +99,9 @@ class ThresholdScan(ScanBase):
             # Initialize counter for progress
             step_counter = 0
 
+        # Histogram the data while the scan is running, if the scan is started with online_analysis
+        self.start_histogramming(len(thresholds))
+
         scan_param_id = 0
         for threshold in thresholds:
             # Set the threshold
@@ -136,11 +144,13 @@ class ThresholdScan(ScanBase):
 
         self.logger.info('Scan finished')
 
-    def analyze(self, progress = None, status = None, **kwargs):
+    def analyze(self, progress = None, status = None, store_hit_data = True, method = 'batch', **kwargs):
         '''
             Analyze the data of the scan
             If progress is None a tqdm progress bar is used else progress should be a Multiprocess Queue which stores the progress as fraction of 1
             If there is a status queue information about the status of the scan are put into it
+            With store_hit_data the interpreted hit data is stored in interpreted/hit_data, otherwise only the histograms are created
+            method selects the S-curve analysis of analysis.fit_scurves_multithread ('batch', 'curve_fit' or 'fitless' without fit)
         '''
 
         h5_filename = self.output_filename + '.h5'
@@ -152,12 +162,9 @@ class ThresholdScan(ScanBase):
         # Open the HDF5 which contains all data of the scan
         with tb.open_file(h5_filename, 'r+') as h5_file:
             # Read raw data, meta data and configuration parameters
-            raw_data = h5_file.root.raw_data[:]
             meta_data = h5_file.root.meta_data[:]
             run_config = h5_file.root.configuration.run_config[:]
             general_config = h5_file.root.configuration.generalConfig[:]
-            op_mode = [row[1] for row in general_config if row[0]==b'Op_mode'][0]
-            vco = [row[1] for row in general_config if row[0]==b'Fast_Io_en'][0]
 
 
             # Create group to save all data and histograms to the HDF file
@@ -169,25 +176,16 @@ class ThresholdScan(ScanBase):
             h5_file.create_group(h5_file.root, 'interpreted', 'Interpreted Data')
 
             self.logger.info('Interpret raw data...')
-            # Interpret the raw data (2x 32 bit to 1x 48 bit)
-            hit_data = analysis.interpret_raw_data(raw_data, op_mode, vco, meta_data, progress = progress)
-            raw_data = None
-
-            # Select only data which is hit data
-            hit_data = hit_data[hit_data['data_header'] == 1]
-            h5_file.create_table(h5_file.root.interpreted, 'hit_data', hit_data, filters=tb.Filters(complib='zlib', complevel=5))
-            pix_occ = np.bincount(hit_data['x'].astype(np.uint32) * 256 + hit_data['y'].astype(np.uint32), minlength=256 * 256)
-            hist_occ = np.reshape(pix_occ, (256, 256)).T
-            h5_file.create_carray(h5_file.root.interpreted, name='HistOcc', obj=hist_occ)
             param_range = np.unique(meta_data['scan_param_id'])
+            # Create histograms for number of detected hits for individual thresholds, with store_hit_data the hit data is stored in interpreted/hit_data
+            scurve, pix_occ = self.scurve_histograms(h5_file, meta_data, len(param_range), store_hit_data, progress = progress)
             meta_data = None
+
+            hist_occ = np.reshape(pix_occ, (256, 256)).T
+            h5_file.create_carray(h5_file.root.interpreted, name='HistOcc', obj=hist_occ)
             pix_occ = None
             hist_occ = None
 
-            # Create histograms for number of detected hits for individual thresholds
-            scurve = analysis.scurve_hist(hit_data, param_range)
-            hit_data = None
-
             # Read needed configuration parameters
             n_injections = [int(item[1]) for item in run_config if item[0] == b'n_injections'][0]
             Vthreshold_start = [int(item[1]) for item in run_config if item[0] == b'Vthreshold_start'][0]
@@ -196,12 +194,13 @@ class ThresholdScan(ScanBase):
 
             # Fit S-Curves to the histograms for all pixels
             param_range = list(range(Vthreshold_start, Vthreshold_stop + 1))
-            thr2D, sig2D, chi2ndf2D = analysis.fit_scurves_multithread(scurve, scan_param_range=param_range, n_injections=n_injections, invert_x=neg_polarity, progress = progress)
+            thr2D, sig2D, chi2ndf2D, fit_diagnostics = analysis.fit_scurves_multithread(scurve, scan_param_range=param_range, n_injections=n_injections, invert_x=neg_polarity, progress = progress, method = method, diagnostics = True)
 
             h5_file.create_carray(h5_file.root.interpreted, name='HistSCurve', obj=scurve)
             h5_file.create_carray(h5_file.root.interpreted, name='Chi2Map', obj=chi2ndf2D.T)
             h5_file.create_carray(h5_file.root.interpreted, name='ThresholdMap', obj=thr2D.T)
             h5_file.create_carray(h5_file.root.interpreted, name='NoiseMap', obj=sig2D.T)
+            h5_file.create_table(h5_file.root.interpreted, name='FitDiagnostics', obj=fit_diagnostics)
 
     def plot(self, status = None, plot_queue = None, **kwargs):
         '''
@@ -261,5 +260,5 @@ class ThresholdScan(ScanBase):
 if __name__ == "__main__":
     scan = ThresholdScan()
     scan.start(**local_configuration)
-    scan.analyze()
+    scan.analyze(store_hit_data = local_configuration['store_hit_data'], method = local_configuration['method'])
     scan.plot()
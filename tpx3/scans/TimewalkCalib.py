@@ -23,7 +23,7 @@ import tpx3.plotting as plotting
 from tpx3.plotting import ConfigDict
 import tpx3.utils as utils
 from six.moves import range
-from basil.utils.BitLogic import BitLogic
+import tpx3.lut as lut
 
 local_configuration = {
     # Scan parameters
@@ -184,51 +184,9 @@ class TimewalkCalib(ScanBase):
             VTP_fine_start = int(run_config[b'VTP_fine_start'])
             VTP_fine_stop = int(run_config[b'VTP_fine_stop'])
 
-            # create look up table for 4-bit lfsr
-            _lfsr_4_lut = np.zeros((2 ** 4), dtype=np.uint16)
-            lfsr = BitLogic(4)
-            lfsr[3:0] = 0xF
-            dummy = 0
-            for i in range(2**4):
-                _lfsr_4_lut[BitLogic.tovalue(lfsr)] = i
-                dummy = lfsr[3]
-                lfsr[3] = lfsr[2]
-                lfsr[2] = lfsr[1]
-                lfsr[1] = lfsr[0]
-                lfsr[0] = lfsr[3] ^ dummy
-            _lfsr_4_lut[2 ** 4 - 1] = 0
-
-            # create look up table for 10-bit lfsr
-            _lfsr_10_lut = np.zeros((2 ** 10), dtype=np.uint16)
-            lfsr = BitLogic(10)
-            lfsr[7:0] = 0xFF
-            lfsr[9:8] = 0b11
-            dummy = 0
-            for i in range(2 ** 10):
-                _lfsr_10_lut[BitLogic.tovalue(lfsr)] = i
-                dummy = lfsr[9]
-                lfsr[9] = lfsr[8]
-                lfsr[8] = lfsr[7]
-                lfsr[7] = lfsr[6]
-                lfsr[6] = lfsr[5]
-                lfsr[5] = lfsr[4]
-                lfsr[4] = lfsr[3]
-                lfsr[3] = lfsr[2]
-                lfsr[2] = lfsr[1]
-                lfsr[1] = lfsr[0]
-                lfsr[0] = lfsr[7] ^ dummy
-            _lfsr_10_lut[2 ** 10 - 1] = 0
-
-            # create look up table for 14-bit grey counter
-            _gray_14_lut = np.zeros((2 ** 14), dtype=np.uint16)
-            for j in range(2**14):
-                encoded_value = BitLogic(14) #48
-                encoded_value[13:0]=j #47
-                gray_decrypt_v = BitLogic(14) #48
-                gray_decrypt_v[13]=encoded_value[13] #47
-                for i in range (12, -1, -1): #46
-                    gray_decrypt_v[i]=gray_decrypt_v[i+1]^encoded_value[i]
-                _gray_14_lut[j] = gray_decrypt_v.tovalue()
+            _lfsr_4_lut = lut.lfsr_4_lut()
+            _lfsr_10_lut = lut.lfsr_10_lut()
+            _gray_14_lut = lut.gray_14_lut()
 
             # Read raw data, meta data and configuration parameters
             raw_data = h5_file.root.raw_data[:]
@@ -502,7 +460,7 @@ class TimewalkCalib(ScanBase):
                 pass
             h5_file.create_group(h5_file.root, 'interpreted', 'Interpreted Data')
             hit_data = pix_data[pix_data['data_header'] == 1]
-            h5_file.create_table(h5_file.root.interpreted, 'hit_data', hit_data, filters=tb.Filters(complib='zlib', complevel=5))
+            h5_file.create_table(h5_file.root.interpreted, 'hit_data', hit_data, **analysis.storage_options('hit_data', self.storage))
 
             amplitudes = list(range(VTP_fine_start, VTP_fine_stop, 1))
             amplitudes.insert(0,0)
@@ -28,7 +28,10 @@ local_configuration = {
     'mask_step'        : 64,
     'VTP_fine_start'   : 210 + 0,
     'VTP_fine_stop'    : 210 + 300,
-    'thrfile'        : './output_data/20200505_165149_mask.h5'
+    'thrfile'        : './output_data/20200505_165149_mask.h5',
+
+    # Analysis parameters
+    'online_analysis'  : False
 }
 
 
@@ -93,6 +96,9 @@ class ToTCalib(ScanBase):
             # Initialize counter for progress
             step_counter = 0
 
+        # Histogram the data while the scan is running, if the scan is started with online_analysis
+        self.start_histogramming(len(cal_high_range), scurve=False, tot=True)
+
         scan_param_id = 0
         for vcal in cal_high_range:
             # Set the fine testpulse DAC
@@ -169,46 +175,51 @@ class ToTCalib(ScanBase):
             self.logger.info('Interpret raw data...')
             param_range = np.unique(meta_data['scan_param_id'])
 
-            # Create arrays for interpreted data for all scan parameter IDs
-            totcurves_means = np.zeros((256*256, len(param_range)), dtype=np.uint16)
-            totcurves_hits = np.zeros((256*256, len(param_range)), dtype=np.uint16)
-
-            if progress == None:
-                pbar = tqdm(total = len(param_range))
+            if self.histogramming is not None and self.histogramming.complete:
+                # The histograms were already created while the scan was running
+                totcurves_means = self.histogramming.totcurves_means
+                totcurves_hits = self.histogramming.totcurves_hits
             else:
-                step_counter = 0
-
-            # Interpret data separately per scan parameter id to save RAM
-            for param_id in param_range:
-                start_index = meta_data[meta_data['scan_param_id'] == param_id]
-                stop_index = meta_data[meta_data['scan_param_id'] == param_id]
-                # Interpret the raw data (2x 32 bit to 1x 48 bit)
-                raw_data_tmp = h5_file.root.raw_data[start_index['index_start'][0]:stop_index['index_stop'][-1]]
-                hit_data_tmp = analysis.interpret_raw_data(raw_data_tmp, op_mode, vco, progress = progress)
-                raw_data_tmp = None
-
-                # Select only data which is hit data
-                hit_data_tmp = hit_data_tmp[hit_data_tmp['data_header'] == 1]
-
-                # Create histograms for number of detected ToT clock cycles for individual testpulses
-                full_tmp, count_tmp = analysis.totcurve_hist(hit_data_tmp)
-
-                # Put results of current scan parameter ID in overall arrays
-                totcurves_means[:, param_id] = full_tmp
-                full_tmp = None
-                totcurves_hits[:, param_id] = count_tmp
-                count_tmp = None
-                hit_data_tmp = None
+                # Create arrays for interpreted data for all scan parameter IDs
+                totcurves_means = np.zeros((256*256, len(param_range)), dtype=np.uint32)
+                totcurves_hits = np.zeros((256*256, len(param_range)), dtype=np.uint32)
 
                 if progress == None:
-                    pbar.update(1)
+                    pbar = tqdm(total = len(param_range))
                 else:
-                    step_counter += 1
-                    fraction = step_counter / (len(param_range))
-                    progress.put(fraction)
+                    step_counter = 0
+
+                # Interpret data separately per scan parameter id to save RAM
+                for param_id in param_range:
+                    start_index = meta_data[meta_data['scan_param_id'] == param_id]
+                    stop_index = meta_data[meta_data['scan_param_id'] == param_id]
+                    # Interpret the raw data (2x 32 bit to 1x 48 bit)
+                    raw_data_tmp = h5_file.root.raw_data[start_index['index_start'][0]:stop_index['index_stop'][-1]]
+                    hit_data_tmp = analysis.interpret_raw_data(raw_data_tmp, op_mode, vco, progress = progress, columns = ['data_header', 'x', 'y', 'TOT'])
+                    raw_data_tmp = None
+
+                    # Select only data which is hit data
+                    hit_data_tmp = hit_data_tmp[hit_data_tmp['data_header'] == 1]
+
+                    # Create histograms for number of detected ToT clock cycles for individual testpulses
+                    full_tmp, count_tmp = analysis.totcurve_hist(hit_data_tmp)
+
+                    # Put results of current scan parameter ID in overall arrays
+                    totcurves_means[:, param_id] = full_tmp
+                    full_tmp = None
+                    totcurves_hits[:, param_id] = count_tmp
+                    count_tmp = None
+                    hit_data_tmp = None
+
+                    if progress == None:
+                        pbar.update(1)
+                    else:
+                        step_counter += 1
+                        fraction = step_counter / (len(param_range))
+                        progress.put(fraction)
 
-            if progress == None:
-                pbar.close()
+                if progress == None:
+                    pbar.close()
 
             meta_data = None
 
@@ -22,6 +22,7 @@ import basil
 from basil.dut import Dut
 from basil.utils.BitLogic import BitLogic
 from .utils import toByteList, bitword_to_byte_list, threshold_decompose
+from . import lut
 from io import open
 import six
 from six.moves import range
@@ -1626,67 +1627,19 @@ class TPX3(Dut):
         """
         Generates a 10bit LFSR according to Manual v1.9 page 19
         """
-        lfsr = BitLogic(10)
-        lfsr[7:0] = 0xFF
-        lfsr[9:8] = 0b11
-        dummy = 0
-        for i in range(2**10):
-            self.lfsr_10[BitLogic.tovalue(lfsr)] = i
-            dummy = lfsr[9]
-            lfsr[9] = lfsr[8]
-            lfsr[8] = lfsr[7]
-            lfsr[7] = lfsr[6]
-            lfsr[6] = lfsr[5]
-            lfsr[5] = lfsr[4]
-            lfsr[4] = lfsr[3]
-            lfsr[3] = lfsr[2]
-            lfsr[2] = lfsr[1]
-            lfsr[1] = lfsr[0]
-            lfsr[0] = lfsr[7] ^ dummy
-        self.lfsr_10[2 ** 10 - 1] = 0
+        self.lfsr_10 = lut.lfsr_dict(10)
 
     def lfsr_14_bit(self):
         """
         Generates a 14bit LFSR according to Manual v1.9 page 19
         """
-        lfsr = BitLogic(14)
-        lfsr[7:0] = 0xFF
-        lfsr[13:8] = 63
-        dummy = 0
-        for i in range(2**14):
-            self.lfsr_14[BitLogic.tovalue(lfsr)] = i
-            dummy = lfsr[13]
-            lfsr[13] = lfsr[12]
-            lfsr[12] = lfsr[11]
-            lfsr[11] = lfsr[10]
-            lfsr[10] = lfsr[9]
-            lfsr[9] = lfsr[8]
-            lfsr[8] = lfsr[7]
-            lfsr[7] = lfsr[6]
-            lfsr[6] = lfsr[5]
-            lfsr[5] = lfsr[4]
-            lfsr[4] = lfsr[3]
-            lfsr[3] = lfsr[2]
-            lfsr[2] = lfsr[1]
-            lfsr[1] = lfsr[0]
-            lfsr[0] = lfsr[2] ^ dummy ^ lfsr[12] ^ lfsr[13]
-        self.lfsr_14[2 ** 14 - 1] = 0
+        self.lfsr_14 = lut.lfsr_dict(14)
 
     def lfsr_4_bit(self):
         """
         Generates a 4bit LFSR according to Manual v1.9 page 19
         """
-        lfsr = BitLogic(4)
-        lfsr[3:0] = 0xF
-        dummy = 0
-        for i in range(2**4):
-            self.lfsr_4[BitLogic.tovalue(lfsr)] = i
-            dummy = lfsr[3]
-            lfsr[3] = lfsr[2]
-            lfsr[2] = lfsr[1]
-            lfsr[1] = lfsr[0]
-            lfsr[0] = lfsr[3] ^ dummy
-        self.lfsr_4[2 ** 4 - 1] = 0
+        self.lfsr_4 = lut.lfsr_dict(4)
 
     def gray_decrypt(self, value):
         """